@@ -0,0 +1,277 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# Monitoring measures scored by the detector
+ANOMALY_MEASURES = ['ndvi', 'lai', 'stress_hydrique']
+
+# Seasonal baseline buckets: weeks of the year (day of year // 7)
+WEEKS = 53
+
+# Layout of the saved state; states saved with another layout are discarded
+STATE_VERSION = 1
+
+
+def _welford_merge(counts, means, m2, batch_counts, batch_means, batch_m2):
+    """Combines running (count, mean, M2) statistics with those of a batch (Chan et al.)."""
+    total = counts + batch_counts
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = batch_means - means
+        share = np.where(total > 0, batch_counts / total, 0.0)
+        merged_means = np.where(counts > 0, means + delta * share, batch_means)
+        merged_m2 = np.where(counts > 0, m2 + batch_m2 + delta ** 2 * counts * share, batch_m2)
+    return total, merged_means, merged_m2
+
+
+class AnomalyDetector:
+    def __init__(self, measures=None, alpha=0.2, threshold=3.0, min_parcel_observations=10,
+                 min_baseline_observations=5):
+        """
+        Online anomaly detector for monitoring measures, with constant memory per parcel.
+
+        Each observation gets two scores, computed from the state before it
+        and then folded into it in O(1):
+
+        - 'z_saison': deviation from the seasonal baseline of its crop, the
+          running mean/variance (Welford) of all parcels' values of that
+          crop in the same week of the year
+        - 'z_parcelle': deviation of the value from the parcel's EWMA level,
+          relative to the running mean/variance of those innovations
+
+        An observation is anomalous when a score exceeds ``threshold`` in
+        absolute value, once enough observations back the statistic.
+        """
+        self.measures = list(measures or ANOMALY_MEASURES)
+        self.alpha = alpha
+        self.threshold = threshold
+        self.min_parcel_observations = min_parcel_observations
+        self.min_baseline_observations = min_baseline_observations
+        # Signature of the source file the state was built from, set by its owner
+        self.source = None
+
+        n_measures = len(self.measures)
+        self.parcel_ids = []
+        self.crops = []
+        self._parcel_positions = {}
+        self._crop_positions = {}
+
+        # Per parcel and measure: innovation statistics, EWMA level and last scores
+        self.counts = np.zeros((0, n_measures), dtype=np.int64)
+        self.means = np.zeros((0, n_measures))
+        self.m2 = np.zeros((0, n_measures))
+        self.levels = np.zeros((0, n_measures))
+        self.last_values = np.zeros((0, n_measures))
+        self.last_seasonal_z = np.zeros((0, n_measures))
+        self.last_parcel_z = np.zeros((0, n_measures))
+        self.last_dates = np.zeros(0, dtype='datetime64[ns]')
+        self.last_crops = np.zeros(0, dtype=np.int64)
+
+        # Per crop, week of the year and measure: seasonal baseline
+        self.baseline_counts = np.zeros((0, WEEKS, n_measures), dtype=np.int64)
+        self.baseline_means = np.zeros((0, WEEKS, n_measures))
+        self.baseline_m2 = np.zeros((0, WEEKS, n_measures))
+
+    def _positions(self, values, known, names, grow):
+        """Maps values to positions, registering unseen ones and growing the state arrays."""
+        codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+        new = [value for value in uniques if value not in known]
+        for value in new:
+            known[value] = len(names)
+            names.append(value)
+        if new:
+            grow(len(new))
+        return np.array([known[value] for value in uniques], dtype=np.int64)[codes]
+
+    def _grow_parcels(self, count):
+        def extend(array, fill):
+            return np.concatenate((array, np.full((count,) + array.shape[1:], fill, dtype=array.dtype)))
+
+        self.counts = extend(self.counts, 0)
+        self.means, self.m2 = extend(self.means, 0.0), extend(self.m2, 0.0)
+        self.levels = extend(self.levels, np.nan)
+        self.last_values = extend(self.last_values, np.nan)
+        self.last_seasonal_z = extend(self.last_seasonal_z, np.nan)
+        self.last_parcel_z = extend(self.last_parcel_z, np.nan)
+        self.last_dates = extend(self.last_dates, np.datetime64('NaT'))
+        self.last_crops = extend(self.last_crops, 0)
+
+    def _grow_crops(self, count):
+        shape = (count, WEEKS, len(self.measures))
+        self.baseline_counts = np.concatenate((self.baseline_counts, np.zeros(shape, dtype=np.int64)))
+        self.baseline_means = np.concatenate((self.baseline_means, np.zeros(shape)))
+        self.baseline_m2 = np.concatenate((self.baseline_m2, np.zeros(shape)))
+
+    def new_observations(self, observations):
+        """Keeps the observations dated after the last one scored for their parcel."""
+        positions = pd.Index(self.parcel_ids, dtype=object).get_indexer(
+            observations['parcelle_id'].to_numpy(dtype=object))
+        # Unknown parcels (position -1) get the trailing NaT
+        known = np.append(self.last_dates, np.datetime64('NaT'))[positions]
+        dates = observations['date'].to_numpy().astype('datetime64[ns]')
+        return observations[np.isnat(known) | (dates > known)]
+
+    def update(self, observations):
+        """
+        Scores observations ('parcelle_id', 'date', 'culture' and the measures)
+        and folds them into the state.
+
+        Observations are taken in date order; those of the same date are
+        processed together, one observation per parcel at a time. Scores
+        therefore do not depend on how the observations are split in batches.
+        Returns one row per observation with its value, 'z_saison' and
+        'z_parcelle' per measure, 'anomalie' and 'mesures_anormales'.
+        """
+        frame = observations.sort_values(['date', 'parcelle_id'], kind='stable')
+        parcels = self._positions(frame['parcelle_id'].to_numpy(), self._parcel_positions, self.parcel_ids,
+                                  self._grow_parcels)
+        crops = self._positions(frame['culture'].astype(str).to_numpy(), self._crop_positions, self.crops,
+                                self._grow_crops)
+        dates = frame['date'].to_numpy().astype('datetime64[ns]')
+        weeks = np.minimum(pd.DatetimeIndex(dates).dayofyear.to_numpy() // 7, WEEKS - 1)
+        values = frame[self.measures].to_numpy(dtype=np.float64)
+
+        seasonal_z = np.full(values.shape, np.nan)
+        parcel_z = np.full(values.shape, np.nan)
+
+        # One round per date and rank of the observation among its parcel's ones that date
+        day_codes = np.unique(dates, return_inverse=True)[1].reshape(-1)
+        group_starts = np.flatnonzero(np.concatenate(
+            ([True], (day_codes[1:] != day_codes[:-1]) | (parcels[1:] != parcels[:-1]))))
+        ranks = np.arange(len(parcels)) - np.repeat(group_starts, np.diff(np.append(group_starts, len(parcels))))
+        rounds = np.unique(day_codes * (ranks.max() + 1 if len(ranks) else 1) + ranks, return_inverse=True)[1]
+        order = np.argsort(rounds.reshape(-1), kind='stable')
+        bounds = np.flatnonzero(np.diff(rounds.reshape(-1)[order], prepend=-1, append=-1))
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            rows = order[lo:hi]
+            seasonal_z[rows], parcel_z[rows] = self._step(parcels[rows], crops[rows], weeks[rows], values[rows])
+            self.last_dates[parcels[rows]] = dates[rows]
+            self.last_crops[parcels[rows]] = crops[rows]
+
+        scores = pd.DataFrame({'parcelle_id': frame['parcelle_id'].to_numpy(), 'date': dates,
+                               'culture': frame['culture'].to_numpy()})
+        anomalous = np.zeros(len(frame), dtype=bool)
+        labels = np.full(len(frame), '', dtype=object)
+        for j, measure in enumerate(self.measures):
+            scores[measure] = values[:, j]
+            scores[f"{measure}_z_saison"] = seasonal_z[:, j]
+            scores[f"{measure}_z_parcelle"] = parcel_z[:, j]
+            flagged = self._exceeds(seasonal_z[:, j], parcel_z[:, j])
+            anomalous |= flagged
+            labels = np.where(flagged, labels + np.where(labels == '', '', ', ') + measure, labels)
+        scores['anomalie'] = anomalous
+        scores['mesures_anormales'] = labels
+        return scores
+
+    def _exceeds(self, seasonal_z, parcel_z):
+        with np.errstate(invalid='ignore'):
+            return (np.abs(seasonal_z) > self.threshold) | (np.abs(parcel_z) > self.threshold)
+
+    def _step(self, parcels, crops, weeks, values):
+        """Scores then folds in one observation per parcel (``parcels`` are distinct)."""
+        valid = ~np.isnan(values)
+
+        # Seasonal score, from the crop/week baseline before this round
+        counts = self.baseline_counts[crops, weeks]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            spread = np.sqrt(self.baseline_m2[crops, weeks] / (counts - 1))
+            seasonal_z = np.where((counts >= self.min_baseline_observations) & (spread > 0) & valid,
+                                  (values - self.baseline_means[crops, weeks]) / spread, np.nan)
+
+        # Parcel score: innovation against the EWMA level, standardized by the past innovations
+        levels = self.levels[parcels]
+        innovations = values - levels
+        n, mean = self.counts[parcels], self.means[parcels]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            spread = np.sqrt(self.m2[parcels] / (n - 1))
+            parcel_z = np.where((n >= self.min_parcel_observations) & (spread > 0) & valid,
+                                (innovations - mean) / spread, np.nan)
+
+        # Welford update of the innovations, then of the level
+        stepped = valid & ~np.isnan(levels)
+        new_n = n + stepped
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta = np.where(stepped, innovations - mean, 0.0)
+            new_mean = np.where(stepped, mean + delta / np.maximum(new_n, 1), mean)
+            self.m2[parcels] += np.where(stepped, delta * (innovations - new_mean), 0.0)
+        self.counts[parcels], self.means[parcels] = new_n, new_mean
+        self.levels[parcels] = np.where(valid, np.where(np.isnan(levels), values,
+                                                        self.alpha * values + (1 - self.alpha) * levels), levels)
+        self.last_values[parcels] = np.where(valid, values, self.last_values[parcels])
+        self.last_seasonal_z[parcels] = np.where(valid, seasonal_z, self.last_seasonal_z[parcels])
+        self.last_parcel_z[parcels] = np.where(valid, parcel_z, self.last_parcel_z[parcels])
+
+        # Baseline update: this round's values grouped by crop and week, merged into the running statistics
+        buckets = crops * WEEKS + weeks
+        n_buckets = len(self.crops) * WEEKS
+        shape = self.baseline_counts.shape
+        counts, means, m2 = (self.baseline_counts.reshape(-1, shape[2]), self.baseline_means.reshape(-1, shape[2]),
+                             self.baseline_m2.reshape(-1, shape[2]))
+        for j in range(len(self.measures)):
+            keys, x = buckets[valid[:, j]], values[valid[:, j], j]
+            batch_counts = np.bincount(keys, minlength=n_buckets)
+            touched = np.flatnonzero(batch_counts)
+            batch_means = np.bincount(keys, weights=x, minlength=n_buckets)[touched] / batch_counts[touched]
+            centered = x - np.bincount(keys, weights=x, minlength=n_buckets)[keys] / batch_counts[keys]
+            batch_m2 = np.bincount(keys, weights=centered ** 2, minlength=n_buckets)[touched]
+            counts[touched, j], means[touched, j], m2[touched, j] = _welford_merge(
+                counts[touched, j], means[touched, j], m2[touched, j], batch_counts[touched], batch_means, batch_m2)
+
+        return seasonal_z, parcel_z
+
+    def flagged(self):
+        """
+        Returns the parcels whose latest observation is anomalous: 'parcelle_id',
+        'date', 'culture', 'mesures_anormales' and 'score_max' (largest absolute score).
+        """
+        exceeded = self._exceeds(self.last_seasonal_z, self.last_parcel_z)
+        rows = np.flatnonzero(exceeded.any(axis=1))
+        with np.errstate(invalid='ignore'):
+            scores = np.fmax(np.abs(self.last_seasonal_z[rows]), np.abs(self.last_parcel_z[rows]))
+        crops = np.asarray(self.crops, dtype=object)
+        return pd.DataFrame({
+            'parcelle_id': np.asarray(self.parcel_ids, dtype=object)[rows],
+            'date': self.last_dates[rows],
+            'culture': crops[self.last_crops[rows]] if len(crops) else np.empty(0, dtype=object),
+            'mesures_anormales': [', '.join(m for m, hit in zip(self.measures, row) if hit) for row in exceeded[rows]],
+            'score_max': np.nanmax(scores, axis=1) if len(rows) else np.empty(0),
+        }).sort_values('score_max', ascending=False, ignore_index=True)
+
+    def save(self, path):
+        """Writes the state to ``path`` (.npz, replaced atomically)."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as handle:
+            np.savez(handle, version=STATE_VERSION, measures=np.array(self.measures),
+                     settings=np.array([self.alpha, self.threshold, self.min_parcel_observations,
+                                        self.min_baseline_observations]),
+                     parcel_ids=np.array(self.parcel_ids, dtype=str), crops=np.array(self.crops, dtype=str),
+                     counts=self.counts, means=self.means, m2=self.m2, levels=self.levels,
+                     last_values=self.last_values, last_seasonal_z=self.last_seasonal_z,
+                     last_parcel_z=self.last_parcel_z, last_dates=self.last_dates, last_crops=self.last_crops,
+                     baseline_counts=self.baseline_counts, baseline_means=self.baseline_means,
+                     baseline_m2=self.baseline_m2, source=np.array(json.dumps(self.source)))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Reads a state written by ``save``; returns None if it is missing, unreadable or outdated."""
+        try:
+            with np.load(path, allow_pickle=False) as saved:
+                if int(saved['version']) != STATE_VERSION:
+                    return None
+                alpha, threshold, min_parcel, min_baseline = saved['settings'].tolist()
+                detector = cls(saved['measures'].tolist(), alpha, threshold, int(min_parcel), int(min_baseline))
+                detector.parcel_ids = saved['parcel_ids'].tolist()
+                detector.crops = saved['crops'].tolist()
+                for name in ('counts', 'means', 'm2', 'levels', 'last_values', 'last_seasonal_z', 'last_parcel_z',
+                             'last_dates', 'last_crops', 'baseline_counts', 'baseline_means', 'baseline_m2'):
+                    setattr(detector, name, saved[name])
+                detector.source = json.loads(str(saved['source'])) if 'source' in saved.files else None
+        except (OSError, KeyError, ValueError):
+            return None
+        detector._parcel_positions = {pid: i for i, pid in enumerate(detector.parcel_ids)}
+        detector._crop_positions = {crop: i for i, crop in enumerate(detector.crops)}
+        return detector
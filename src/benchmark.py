@@ -0,0 +1,200 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+from data_manager import AgriculturalDataManager
+from map_visualization import AgriculturalMap
+from synthetic_data import generate_dataset
+
+
+# Parcels of the real data set; scale factors multiply it
+BASE_PARCELS = 50
+
+# Allowed growth over the baseline before a stage is flagged as a regression
+TIME_TOLERANCE = 0.5
+MEMORY_TOLERANCE = 0.2
+
+# Stages faster than this are too noisy to be compared on time
+MIN_SECONDS = 0.05
+
+
+def measure(function, trace_memory=False):
+    """
+    Runs ``function`` and returns its result, wall time (s) and, with
+    ``trace_memory``, the peak of memory allocated while it ran (bytes, as
+    traced by tracemalloc; None otherwise).
+    """
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        result = function()
+    finally:
+        seconds = time.perf_counter() - started
+        peak = None
+        if trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+    return result, seconds, peak
+
+
+def pipeline_stages(data_dir):
+    """
+    Returns the benchmarked stages as (name, function) pairs, to run in order.
+
+    Stages share their results through a state dict: the manager loaded by
+    'load_data' is used by the analysis stages and the map layer builders.
+    'load_data' parses the CSV files and writes the binary cache (removed
+    beforehand); 'load_data_cache' reloads from that cache.
+    """
+    state = {}
+    shutil.rmtree(os.path.join(data_dir, '.cache'), ignore_errors=True)
+
+    def load_data():
+        state['manager'] = AgriculturalDataManager(data_dir)
+        state['manager'].load_data()
+
+    def load_data_cache():
+        manager = AgriculturalDataManager(data_dir)
+        manager.load_data()
+        return manager
+
+    def prepare_features():
+        state['features'] = state['manager'].prepare_features()
+
+    def get_temporal_patterns():
+        manager = state['manager']
+        return manager.get_temporal_patterns(next(iter(manager.parcel_index)))
+
+    def calculate_risk_metrics():
+        return state['manager'].calculate_risk_metrics(state['features'])
+
+    def parcels_data():
+        return state['manager'].parcels_data
+
+    def map_layers(*layers):
+        def build():
+            agricultural_map = AgriculturalMap(state['manager'])
+            agricultural_map.create_base_map()
+            for layer in layers:
+                getattr(agricultural_map, layer)()
+        return build
+
+    return [
+        ('load_data', load_data),
+        ('load_data_cache', load_data_cache),
+        ('prepare_features', prepare_features),
+        ('get_temporal_patterns', get_temporal_patterns),
+        ('calculate_risk_metrics', calculate_risk_metrics),
+        ('parcels_data', parcels_data),
+        ('add_yield_history_layer', map_layers('add_yield_history_layer')),
+        ('add_current_ndvi_layer', map_layers('add_current_ndvi_layer')),
+        ('add_risk_heatmap', map_layers('add_risk_heatmap')),
+    ]
+
+
+def run_benchmarks(scales=(1, 10), data_root=os.path.join('data', 'synthetique'), start='2024-01-01',
+                   end='2024-12-31', seed=0, repeat=3):
+    """
+    Runs every stage of ``pipeline_stages`` on synthetic data sets of
+    ``scale * BASE_PARCELS`` parcels (generated once per scale under
+    ``data_root``). Returns one row per scale and stage: 'echelle',
+    'parcelles', 'etape', 'secondes', 'pic_memoire_octets'.
+
+    Tracing allocations slows pandas down several times, so the stages are
+    timed without it, ``repeat`` times keeping the fastest run, then run
+    once more with memory tracing.
+    """
+    rows = []
+    for scale in scales:
+        n_parcels = int(scale * BASE_PARCELS)
+        data_dir = os.path.join(data_root, f"x{scale}_{start}_{end}_{seed}")
+        if not os.path.exists(os.path.join(data_dir, 'monitoring_cultures.csv')):
+            generate_dataset(data_dir, n_parcels=n_parcels, start=start, end=end, seed=seed)
+
+        timings = [min(runs) for runs in zip(*(
+            [measure(function)[1] for _, function in pipeline_stages(data_dir)] for _ in range(repeat)))]
+        for (stage, function), seconds in zip(pipeline_stages(data_dir), timings):
+            peak = measure(function, trace_memory=True)[2]
+            rows.append({'echelle': scale, 'parcelles': n_parcels, 'etape': stage,
+                         'secondes': seconds, 'pic_memoire_octets': peak})
+            print(f"x{scale} {stage}: {seconds:.3f} s, {peak / 2**20:.1f} MiB")
+    return pd.DataFrame(rows)
+
+
+def save_baseline(results, path):
+    """Writes benchmark results as the baseline of later runs."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as handle:
+        json.dump(results.to_dict(orient='records'), handle, indent=2)
+
+
+def load_baseline(path):
+    """Reads a baseline written by ``save_baseline``; returns None if it is missing."""
+    try:
+        with open(path) as handle:
+            return pd.DataFrame(json.load(handle))
+    except (OSError, ValueError):
+        return None
+
+
+def compare_to_baseline(results, baseline, time_tolerance=TIME_TOLERANCE,
+                        memory_tolerance=MEMORY_TOLERANCE, min_seconds=MIN_SECONDS):
+    """
+    Adds the baseline measures and their ratios to ``results``, and a
+    'regression' flag for stages slower than ``1 + time_tolerance`` times
+    their baseline (when over ``min_seconds``) or using more than
+    ``1 + memory_tolerance`` times its peak memory.
+    """
+    reference = baseline[['echelle', 'etape', 'secondes', 'pic_memoire_octets']].rename(
+        columns={'secondes': 'secondes_reference', 'pic_memoire_octets': 'pic_memoire_reference'})
+    compared = results.merge(reference, on=['echelle', 'etape'], how='left')
+    compared['ratio_temps'] = compared['secondes'] / compared['secondes_reference']
+    compared['ratio_memoire'] = compared['pic_memoire_octets'] / compared['pic_memoire_reference']
+
+    slower = (compared['ratio_temps'] > 1 + time_tolerance) & (compared['secondes'] > min_seconds)
+    larger = compared['ratio_memoire'] > 1 + memory_tolerance
+    compared['regression'] = slower | larger
+    return compared
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the data and map pipelines on synthetic data.")
+    parser.add_argument('--scales', type=float, nargs='+', default=[1, 10],
+                        help="multiples of the 50 parcels of the real data set")
+    parser.add_argument('--start', default='2024-01-01')
+    parser.add_argument('--end', default='2024-12-31')
+    parser.add_argument('--data-root', default=os.path.join('data', 'synthetique'))
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per stage, the fastest is kept")
+    parser.add_argument('--baseline', default=os.path.join('benchmarks', 'baseline.json'))
+    parser.add_argument('--update-baseline', action='store_true',
+                        help="store this run as the new baseline instead of comparing with it")
+    args = parser.parse_args(argv)
+
+    scales = [int(scale) if scale == int(scale) else scale for scale in args.scales]
+    results = run_benchmarks(scales, args.data_root, args.start, args.end, repeat=args.repeat)
+
+    baseline = None if args.update_baseline else load_baseline(args.baseline)
+    if baseline is None:
+        save_baseline(results, args.baseline)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    compared = compare_to_baseline(results, baseline)
+    print(compared[['echelle', 'etape', 'secondes', 'ratio_temps', 'ratio_memoire', 'regression']]
+          .to_string(index=False))
+    regressions = compared[compared['regression']]
+    if not regressions.empty:
+        print(f"{len(regressions)} stage(s) regressed against {args.baseline}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
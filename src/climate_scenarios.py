@@ -0,0 +1,379 @@
+import os
+import warnings
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+
+from risk_engine import (DEFAULT_LATITUDE, GDD_BASE_TEMPERATURE, HEAT_RUN_SATURATION, HEAT_THRESHOLD,
+                         RISK_WEIGHTS, ROOT_ZONE_WATER_MM, reference_evapotranspiration)
+
+
+# Daily weather variables drawn by the scenarios, in the order of the history array
+SCENARIO_VARIABLES = ['temperature', 'temperature_min', 'temperature_max', 'humidite', 'precipitation']
+TEMPERATURE_VARIABLES = ['temperature', 'temperature_min', 'temperature_max']
+
+# Percentiles of the returned bands
+PERCENTILES = (5, 25, 50, 75, 95)
+
+# Season features of the yield model moved by the scenario weather:
+# feature -> (daily variable, reduction over the season, 'shift' (difference added) or 'scale' (ratio))
+YIELD_WEATHER_FEATURES = {
+    'temperature_mean': ('temperature', 'mean', 'shift'),
+    'temperature_max_max': ('temperature_max', 'max', 'shift'),
+    'humidite_mean': ('humidite', 'mean', 'shift'),
+    'precipitation_mean': ('precipitation', 'mean', 'scale'),
+}
+
+# Float64 (scenario, parcel, day) arrays alive at once while a chunk is simulated
+ARRAYS_PER_CELL = 8
+
+# Bins of the daily risk score histograms from which the daily bands are read
+RISK_BINS = 100
+
+DEFAULT_MEMORY_BUDGET = 256 * 2**20
+
+
+def weather_history(daily, years=None):
+    """
+    Arranges daily weather as a (variable, year, day of year) array of the
+    ``SCENARIO_VARIABLES``, 366 days per year (of ``years``, by default the
+    years of ``daily``). Days missing from a year take the mean of the other
+    years for that day. Returns the array and its years.
+    """
+    dates = pd.DatetimeIndex(daily['date'])
+    if years is None:
+        years = np.unique(dates.year.to_numpy())
+    year_codes = np.searchsorted(years, dates.year.to_numpy())
+    day_of_year = dates.dayofyear.to_numpy() - 1
+
+    history = np.full((len(SCENARIO_VARIABLES), len(years), 366), np.nan)
+    for i, name in enumerate(SCENARIO_VARIABLES):
+        history[i, year_codes.reshape(-1), day_of_year] = daily[name].to_numpy(dtype=np.float64)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        typical = np.nanmean(history, axis=1, keepdims=True)
+    history = np.where(np.isnan(history), typical, history)
+    # Days never observed (e.g. 29 February) take the previous day, or the next one
+    for i in range(len(SCENARIO_VARIABLES)):
+        history[i] = pd.DataFrame(history[i]).ffill(axis=1).bfill(axis=1).to_numpy()
+    return history, years
+
+
+def station_weather_history(daily, stations):
+    """
+    Arranges the daily weather of each station ('station_id' column) as a
+    (variable, station, year, day of year) array, in the order of
+    ``stations`` and over the years of all stations. Returns the array and its years.
+    """
+    years = np.unique(pd.DatetimeIndex(daily['date']).year.to_numpy())
+    groups = daily.groupby('station_id', observed=True, sort=False).indices
+    histories = [weather_history(daily.iloc[groups[station]], years)[0] if station in groups
+                 else np.full((len(SCENARIO_VARIABLES), len(years), 366), np.nan) for station in stations]
+    return np.stack(histories, axis=1), years
+
+
+def draw_scenarios(n_scenarios, n_days, n_years, seed=0, block_days=10, temperature_sd=1.0,
+                   precipitation_sd=0.25):
+    """
+    Draws the random part of every scenario at once, so results do not depend on chunking.
+
+    Each block of ``block_days`` consecutive days is taken from a random
+    historical year (same calendar days), keeping the within-block
+    persistence of the weather. Each scenario also gets a temperature shift
+    (normal, ``temperature_sd`` °C) and a precipitation factor (log-normal,
+    ``precipitation_sd``). Returns (years per block, shifts, factors).
+    """
+    rng = np.random.default_rng(seed)
+    n_blocks = -(-n_days // block_days)
+    years = rng.integers(0, n_years, (n_scenarios, n_blocks)).astype(np.int32)
+    shifts = rng.normal(0.0, temperature_sd, n_scenarios)
+    factors = rng.lognormal(0.0, precipitation_sd, n_scenarios)
+    return years, shifts, factors
+
+
+def scenario_weather(history, day_of_year, years, shifts, factors, block_days):
+    """Builds the (variable, station, scenario, day) weather of the drawn scenarios at every station."""
+    blocks = np.arange(len(day_of_year)) // block_days
+    weather = history[:, :, years[:, blocks], day_of_year[None, :]]
+    for name in TEMPERATURE_VARIABLES:
+        weather[SCENARIO_VARIABLES.index(name)] += shifts[:, None]
+    weather[SCENARIO_VARIABLES.index('precipitation')] *= factors[:, None]
+    return weather
+
+
+def parcel_weather(weather, stations, weights):
+    """
+    Turns (variable, station, scenario, day) weather into the (variable,
+    scenario, parcel, day) weather of parcels, the weighted mean of their
+    ``stations`` (parcel x rank codes) by ``weights``. With a single station
+    the parcel axis has length 1 and broadcasts over the parcels.
+
+    Scenarios shift temperatures and scale precipitation of the historical
+    days, so blending the stations' scenarios is the scenario of their blend.
+    """
+    if weather.shape[1] == 1:
+        return weather[:, 0, :, None, :]
+    blended = np.zeros((weather.shape[0], weather.shape[2], len(stations), weather.shape[3]))
+    for rank in range(stations.shape[1]):
+        blended += weights[None, None, :, rank, None] * weather[:, stations[:, rank]].transpose(0, 2, 1, 3)
+    return blended
+
+
+def season_aggregates(weather):
+    """Reduces (variable, ..., day) weather to the ``YIELD_WEATHER_FEATURES`` over the season."""
+    aggregates = {}
+    for feature, (name, reduction, _) in YIELD_WEATHER_FEATURES.items():
+        values = weather[SCENARIO_VARIABLES.index(name)]
+        aggregates[feature] = np.nanmax(values, axis=-1) if reduction == 'max' else np.nanmean(values, axis=-1)
+    return aggregates
+
+
+def heat_runs(hot):
+    """Consecutive hot days ending at each day, along the last axis."""
+    positions = np.arange(hot.shape[-1])
+    last_cool = np.maximum.accumulate(np.where(hot, -1, positions), axis=-1)
+    return np.where(hot, positions - last_cool, 0)
+
+
+def simulate_chunk(task):
+    """
+    Simulates a chunk of scenarios for a chunk of parcels; the unit of work of a worker process.
+
+    Risk follows ``risk_engine.compute_risk_indicators`` on (scenario,
+    parcel, day) arrays; yields come from the model's design matrix with
+    its weather features moved by the scenario's season weather. Returns
+    the chunk's position, per-scenario and parcel indicators and the
+    per-parcel-day histogram of the daily risk score.
+    """
+    parcels = task['parcels']
+    stations = scenario_weather(task['history'], task['day_of_year'], task['years'], task['shifts'],
+                                task['factors'], task['block_days'])
+    weather = parcel_weather(stations, parcels['stations'], parcels['weights'])
+    del stations
+    tmean, tmin, tmax, _, precipitation = weather
+    n_scenarios, n_days = tmean.shape[0], tmean.shape[2]
+    n_parcels = len(parcels['latitude'])
+    # Parcels without soil data get the defaults of risk_engine.compute_risk_indicators
+    latitude = np.where(np.isnan(parcels['latitude']), DEFAULT_LATITUDE, parcels['latitude'])
+
+    # Rolling water balance over the last `window` days
+    evapotranspiration = reference_evapotranspiration(
+        task['dates'], tmin, tmax, tmean, latitude[:, None])
+    cumulative = np.cumsum(evapotranspiration - precipitation, axis=2)
+    del evapotranspiration
+    window = task['window']
+    deficit = cumulative
+    deficit[..., window:] -= cumulative[..., :-window].copy()
+    np.maximum(deficit, 0.0, out=deficit)
+
+    reserve = np.where(np.isnan(parcels['capacite_retention_eau']), 1.0,
+                       parcels['capacite_retention_eau']) * ROOT_ZONE_WATER_MM
+    soil_stress = np.clip(deficit / reserve[None, :, None], 0.0, 1.0)
+    del deficit
+    crop_stress = np.clip(parcels['stress_hydrique'], 0.0, 1.0)[None, :, :]
+    combined = np.where(np.isnan(crop_stress), soil_stress, (soil_stress + crop_stress) / 2)
+    heat = np.minimum(heat_runs(tmax > HEAT_THRESHOLD) / HEAT_RUN_SATURATION, 1.0)
+    risk = np.clip(RISK_WEIGHTS['stress_combine'] * combined + RISK_WEIGHTS['chaleur'] * heat, 0.0, 1.0)
+    del combined
+
+    gdd = np.maximum((tmin + tmax) / 2 - GDD_BASE_TEMPERATURE, 0.0).sum(axis=2)
+    indicators = {
+        'risk_score': risk.mean(axis=2),
+        'jours_secheresse': (soil_stress >= 0.5).sum(axis=2).astype(np.float64),
+        'degres_jours': np.broadcast_to(gdd, (n_scenarios, n_parcels)),
+    }
+    del soil_stress
+
+    model = task['yield_inputs']
+    if model is not None:
+        design = np.repeat(model['design'][None, :, :], n_scenarios, axis=0)
+        aggregates = season_aggregates(weather)
+        for feature, (_, _, mode) in YIELD_WEATHER_FEATURES.items():
+            column = model['columns'].get(feature)
+            if column is None:
+                continue
+            reference = model['reference'][feature]
+            if mode == 'scale':
+                design[:, :, column] *= np.divide(aggregates[feature], reference, where=reference != 0,
+                                                  out=np.ones((n_scenarios, n_parcels)))
+            else:
+                design[:, :, column] += aggregates[feature] - reference
+            # The model is not extrapolated beyond the weather it was trained on
+            if feature in model.get('bounds', {}):
+                np.clip(design[:, :, column], *model['bounds'][feature], out=design[:, :, column])
+        # A linear model can extrapolate below zero under extreme scenarios
+        predictions = np.maximum(model['pipeline'].predict(design.reshape(-1, design.shape[2])), 0.0)
+        indicators['rendement'] = predictions.reshape(n_scenarios, n_parcels)
+
+    # Histogram of the daily risk per parcel and day, mergeable across scenario chunks
+    # (days without a finite risk, e.g. from missing weather, are left out)
+    finite = np.isfinite(risk)
+    bins = np.minimum((np.where(finite, risk, 0.0) * RISK_BINS).astype(np.int64), RISK_BINS - 1)
+    cells = (np.arange(n_parcels * n_days, dtype=np.int64) * RISK_BINS).reshape(1, n_parcels, n_days)
+    histogram = np.bincount((bins + cells)[finite], minlength=n_parcels * n_days * RISK_BINS)
+    histogram = histogram.reshape(n_parcels, n_days, RISK_BINS).astype(np.int32)
+
+    indicators = {name: np.asarray(values, dtype=np.float32) for name, values in indicators.items()}
+    return task['parcel_chunk'], task['scenario_start'], indicators, histogram
+
+
+def chunk_sizes(n_parcels, n_days, n_scenarios, n_features, memory_budget, n_stations=1):
+    """
+    Returns (parcels, scenarios) per chunk so that a chunk's arrays fit in
+    ``memory_budget`` bytes: at most half of it for the parcels' daily risk
+    histograms, the rest for the (scenario, parcel, day) arrays. With
+    several stations, each parcel also gets its own blended weather.
+    """
+    histogram_bytes = n_days * RISK_BINS * 12
+    parcels = int(max(1, min(n_parcels, memory_budget // 2 // histogram_bytes)))
+    arrays = ARRAYS_PER_CELL + (2 * len(SCENARIO_VARIABLES) if n_stations > 1 else 0)
+    cell_bytes = n_days * 8 * arrays + n_features * 8 * 2
+    station_bytes = n_stations * n_days * 8 * len(SCENARIO_VARIABLES)
+    scenarios = (memory_budget - parcels * histogram_bytes) // (parcels * cell_bytes + station_bytes)
+    return parcels, int(max(1, min(n_scenarios, scenarios)))
+
+
+def band_values(histogram, n_scenarios):
+    """Reads the ``PERCENTILES`` of the daily risk from (parcel, day, bin) histograms."""
+    cumulative = np.cumsum(histogram, axis=-1)
+    return {f"p{q}": (np.argmax(cumulative >= q / 100 * n_scenarios, axis=-1) + 0.5) / RISK_BINS
+            for q in PERCENTILES}
+
+
+def simulate_scenarios(history, dates, parcels, n_scenarios=1000, seed=0, yield_inputs=None, window=30,
+                       block_days=10, temperature_sd=1.0, precipitation_sd=0.25,
+                       memory_budget=DEFAULT_MEMORY_BUDGET, max_workers=1):
+    """
+    Runs ``n_scenarios`` weather scenarios for every parcel over ``dates``.
+
+    ``history`` comes from ``station_weather_history``; ``parcels`` holds
+    'parcelle_id', 'latitude', 'capacite_retention_eau' (one value per
+    parcel), 'stress_hydrique' (parcel x day, NaN when unobserved), and
+    the 'stations' (parcel x rank positions in ``history``) and 'weights'
+    blending their weather (see ``parcel_weather``). ``yield_inputs``
+    optionally holds the fitted 'pipeline', the parcels' 'design' matrix,
+    the 'columns' of the weather features in it, their 'reference' values
+    in the observed season (per parcel) and the (min, max) 'bounds' seen
+    in training.
+
+    Work is split into chunks of parcels and scenarios sized to
+    ``memory_budget`` bytes, run in this process or, with ``max_workers``
+    above 1, over a process pool. At most ``max_workers`` chunks are
+    submitted at a time and each result is folded in as it arrives, so
+    memory stays within about ``max_workers`` chunk budgets.
+
+    Returns two frames:
+    - per parcel and indicator ('risk_score', 'jours_secheresse',
+      'degres_jours', 'rendement'): 'moyenne' and the ``PERCENTILES``
+      columns 'p5' ... 'p95' over the scenarios
+    - per parcel and day: percentiles of the daily risk score
+    """
+    dates = pd.DatetimeIndex(dates)
+    day_of_year = dates.dayofyear.to_numpy() - 1
+    parcel_ids = np.asarray(parcels['parcelle_id'])
+    n_parcels, n_days = len(parcel_ids), len(dates)
+    years, shifts, factors = draw_scenarios(n_scenarios, n_days, history.shape[2], seed, block_days,
+                                            temperature_sd, precipitation_sd)
+
+    # Parcels are grouped by nearest station so that each chunk only draws its neighbourhood's weather
+    stations = np.asarray(parcels['stations'])
+    groups = [np.arange(n_parcels)]
+    if history.shape[1] > 1 and n_parcels:
+        order = np.argsort(stations[:, 0], kind='stable')
+        groups = np.split(order, np.flatnonzero(np.diff(stations[order, 0])) + 1)
+
+    n_stations = max(len(np.unique(stations[group])) for group in groups) if n_parcels else 1
+    n_features = yield_inputs['design'].shape[1] if yield_inputs is not None else 0
+    parcels_per_chunk, scenarios_per_chunk = chunk_sizes(n_parcels, n_days, n_scenarios, n_features,
+                                                         memory_budget, n_stations)
+    parcel_chunks = [group[i:i + parcels_per_chunk] for group in groups
+                     for i in range(0, len(group), parcels_per_chunk)]
+
+    def tasks():
+        for index, rows in enumerate(parcel_chunks):
+            chunk = {name: np.asarray(values)[rows] for name, values in parcels.items()}
+            # Scenarios are only drawn at the stations of the chunk's parcels
+            used, codes = np.unique(chunk['stations'], return_inverse=True)
+            chunk['stations'] = codes.reshape(chunk['stations'].shape)
+            chunk_history = history[:, used]
+            model = None
+            if yield_inputs is not None:
+                model = dict(yield_inputs, design=yield_inputs['design'][rows],
+                             reference={feature: np.broadcast_to(value, n_parcels)[rows]
+                                        for feature, value in yield_inputs['reference'].items()})
+            for start in range(0, n_scenarios, scenarios_per_chunk):
+                drawn = slice(start, start + scenarios_per_chunk)
+                yield {'parcel_chunk': index, 'scenario_start': start, 'history': chunk_history,
+                       'dates': dates, 'day_of_year': day_of_year, 'years': years[drawn], 'shifts': shifts[drawn],
+                       'factors': factors[drawn], 'block_days': block_days, 'window': window,
+                       'parcels': chunk, 'yield_inputs': model}
+
+    scenario_chunks = -(-n_scenarios // scenarios_per_chunk)
+    n_tasks = len(parcel_chunks) * scenario_chunks
+    max_workers = max_workers or os.cpu_count() or 1
+
+    # Per parcel chunk: scenario indicators and risk histogram, until all its scenario chunks are in
+    partial, remaining, summaries, bands = {}, {}, {}, {}
+
+    def reduce(result):
+        index, start, chunk_indicators, chunk_histogram = result
+        if index not in partial:
+            partial[index] = ({}, np.zeros_like(chunk_histogram))
+            remaining[index] = scenario_chunks
+        indicators, histogram = partial[index]
+        for name, values in chunk_indicators.items():
+            if name not in indicators:
+                indicators[name] = np.empty((n_scenarios, values.shape[1]), dtype=np.float32)
+            indicators[name][start:start + len(values)] = values
+        histogram += chunk_histogram
+        remaining[index] -= 1
+        if not remaining[index]:
+            del partial[index], remaining[index]
+            chunk_ids = parcel_ids[parcel_chunks[index]]
+            summaries[index] = _summarize(chunk_ids, indicators)
+            bands[index] = _bands(chunk_ids, dates, histogram, n_scenarios)
+
+    if max_workers == 1 or n_tasks == 1:
+        for task in tasks():
+            reduce(simulate_chunk(task))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            running = set()
+            for task in tasks():
+                if len(running) >= max_workers:
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        reduce(future.result())
+                running.add(executor.submit(simulate_chunk, task))
+            for future in running:
+                reduce(future.result())
+
+    summaries = [summaries[index] for index in sorted(summaries)]
+    bands = [bands[index] for index in sorted(bands)]
+    if not summaries:
+        return (pd.DataFrame(columns=['parcelle_id', 'indicateur', 'moyenne'] + [f"p{q}" for q in PERCENTILES]),
+                pd.DataFrame(columns=['parcelle_id', 'date'] + [f"p{q}" for q in PERCENTILES]))
+    return pd.concat(summaries, ignore_index=True), pd.concat(bands, ignore_index=True)
+
+
+def _summarize(parcel_ids, indicators):
+    """One row per parcel and indicator: mean and percentiles over the scenarios."""
+    frames = []
+    for name, values in indicators.items():
+        percentiles = np.percentile(values, PERCENTILES, axis=0)
+        frame = pd.DataFrame({'parcelle_id': parcel_ids, 'indicateur': name, 'moyenne': values.mean(axis=0)})
+        for q, row in zip(PERCENTILES, percentiles):
+            frame[f"p{q}"] = row
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _bands(parcel_ids, dates, histogram, n_scenarios):
+    """One row per parcel and day with the percentiles of the daily risk score."""
+    frame = pd.DataFrame({'parcelle_id': np.repeat(parcel_ids, len(dates)),
+                          'date': np.tile(dates.to_numpy(), len(parcel_ids))})
+    for name, values in band_values(histogram, n_scenarios).items():
+        frame[name] = values.ravel()
+    return frame
@@ -1,13 +1,44 @@
 from bokeh.layouts import column, row, gridplot
 from bokeh.models import (ColumnDataSource, Select, DateRangeSlider,
-                          HoverTool, ColorBar, LinearColorMapper)
+                          HoverTool, ColorBar, LinearColorMapper, Range1d,
+                          DataTable, TableColumn, DateFormatter, NumberFormatter)
 from bokeh.plotting import figure, curdoc
+from bokeh.events import RangesUpdate
 from bokeh.palettes import RdYlBu11 as palette
 import bokeh.plotting as bk
+from functools import partial
+import numpy as np
+import pandas as pd
+
+from downsampling import downsample
+from feature_store import level_for
+from instrumentation import instrumented
+
+
+# Colonnes réellement envoyées au navigateur pour chaque source
+MONITORING_COLUMNS = ['date', 'ndvi']
+YIELD_COLUMNS = ['annee', 'culture', 'rendement']
+WEATHER_COLUMNS = ['date', 'temperature']
+PREDICTION_COLUMNS = ['annee', 'predicted_yield']
+ANOMALY_COLUMNS = ['parcelle_id', 'date', 'culture', 'mesures_anormales', 'score_max']
+BAND_COLUMNS = ['p5', 'p25', 'p50', 'p75', 'p95']
+
+# Scénarios climatiques simulés pour les bandes de la parcelle affichée
+SCENARIO_COUNT = 500
+
+# Largeur des graphiques temporels, en pixels : au plus un point affiché par pixel
+PLOT_WIDTH = 800
+
+
+def to_columns(frame, columns):
+    """
+    Extrait les colonnes utiles d'un DataFrame sous forme de tableaux NumPy.
+    """
+    return {col: frame[col].to_numpy() for col in columns}
 
 
 class AgriculturalDashboard:
-    def __init__(self, data_manager):
+    def __init__(self, data_manager, parcelle_id=None, start_date=None, end_date=None):
         """
         Initialise le tableau de bord avec le gestionnaire de données.
         
@@ -16,27 +47,73 @@ class AgriculturalDashboard:
         - L’historique des rendements
         - Les données météorologiques
         - Les caractéristiques des sols
+
+        La parcelle et la période affichées au départ peuvent être fournies ;
+        par défaut, la première parcelle sur toute la période de monitoring.
         """
         self.data_manager = data_manager
         self.source = None
         self.hist_source = None
         self.stress_source = None
+        self.weather_source = None
+        self.prediction_source = None
+        self.anomaly_source = None
+        self.weather_plot = None
+        self.scenario_risk_source = None
+        self.scenario_yield_source = None
+        # Bandes des scénarios déjà simulées, par parcelle
+        self.scenario_bands = {}
+        self.max_points = PLOT_WIDTH
+        self.ndvi_complete = True
+        # Vrai quand la source contient les points bruts de sa plage, sans réduction
+        self.ndvi_raw = True
+        self.weather_raw = True
+
+        # Sélection courante : parcelle, sa station météo et fenêtre temporelle
+        self.parcelle_id = None
+        self.station_id = None
+        self.start_date = None
+        self.end_date = None
+        if len(data_manager.parcel_index):
+            self.parcelle_id = next(iter(data_manager.parcel_index))
+            dates = data_manager.monitoring_dates_sorted
+            self.start_date, self.end_date = pd.Timestamp(dates[0]), pd.Timestamp(dates[-1])
+        if parcelle_id is not None:
+            self.parcelle_id = parcelle_id
+        if start_date is not None:
+            self.start_date = pd.Timestamp(start_date)
+        if end_date is not None:
+            self.end_date = pd.Timestamp(end_date)
+        if self.parcelle_id is not None:
+            self.station_id = data_manager.get_parcel_station(self.parcelle_id)
+
         self.create_data_sources()
 
+    @instrumented
     def create_data_sources(self):
         """
         Prépare les sources de données pour Bokeh en intégrant
         les données actuelles et historiques.
         """
-        # Source pour les données de monitoring
-        monitoring_data = self.data_manager.monitoring_data
+        # Historique des rendements de la parcelle sélectionnée uniquement
+        yield_history = self.data_manager.get_parcel_yield_history(self.parcelle_id)
+
+        # Une seule source par graphique, réutilisée pour toute la session
+        self.source = ColumnDataSource({col: [] for col in MONITORING_COLUMNS})
+        self.hist_source = ColumnDataSource(to_columns(yield_history, YIELD_COLUMNS))
+        self.weather_source = ColumnDataSource({col: [] for col in WEATHER_COLUMNS})
+        self.prediction_source = ColumnDataSource(self.parcel_prediction())
+        self.anomaly_source = ColumnDataSource(self.parcel_anomalies())
+        self.scenario_risk_source = ColumnDataSource({col: [] for col in ['date'] + BAND_COLUMNS})
+        self.scenario_yield_source = ColumnDataSource({col: [] for col in ['annee'] + BAND_COLUMNS})
+        self.refresh_scenarios()
 
-        # Source pour les données historiques des rendements
-        yield_history = self.data_manager.yield_history
+        # NDVI et météo sont sous-échantillonnés à la largeur des graphiques
+        self.refresh_ndvi()
+        self.refresh_weather()
 
-        # Créer des sources de données Bokeh
-        self.source = ColumnDataSource(monitoring_data)
-        self.hist_source = ColumnDataSource(yield_history)
+        # Axe temporel partagé entre le NDVI et la météo
+        self.time_range = Range1d(start=self.start_date, end=self.end_date)
 
         # Exemple de matrice de stress pour démonstration
         stress_data = {
@@ -46,6 +123,7 @@ class AgriculturalDashboard:
         }
         self.stress_source = ColumnDataSource(stress_data)
 
+    @instrumented
     def create_yield_history_plot(self):
         """
         Crée un graphique montrant l’évolution historique des rendements.
@@ -60,20 +138,64 @@ class AgriculturalDashboard:
 
         return p
 
+    @instrumented
     def create_ndvi_temporal_plot(self):
         """
         Crée un graphique montrant l’évolution du NDVI avec des seuils de référence.
         """
         p = figure(title='Évolution du NDVI et Seuils Historiques',
-                   x_axis_type='datetime',
-                   height=400, width=800)
+                   x_axis_type='datetime', x_range=self.time_range,
+                   height=400, width=PLOT_WIDTH)
 
         p.line('date', 'ndvi', source=self.source, line_width=2, color="green", legend_label="NDVI")
         p.add_tools(HoverTool(tooltips=[("Date", "@date{%F}"), ("NDVI", "@ndvi")],
                               formatters={"@date": "datetime"}))
+        p.on_event(RangesUpdate, self.update_visible_range)
 
         return p
 
+    @instrumented
+    def create_weather_plot(self):
+        """
+        Crée un graphique de la température sur la période sélectionnée, à la
+        station météo la plus proche de la parcelle.
+        """
+        p = figure(title=self.weather_title(),
+                   x_axis_type='datetime', x_range=self.time_range,
+                   height=300, width=PLOT_WIDTH)
+
+        p.line('date', 'temperature', source=self.weather_source, line_width=1, color="orange",
+               legend_label="Température")
+        p.add_tools(HoverTool(tooltips=[("Date", "@date{%F %H:%M}"), ("Température", "@temperature")],
+                              formatters={"@date": "datetime"}))
+        p.on_event(RangesUpdate, self.update_visible_range)
+        self.weather_plot = p
+
+        return p
+
+    def weather_title(self):
+        """Titre du graphique météo, avec la station affichée."""
+        return f"Température sur la Période (station {self.station_id})"
+
+    @instrumented
+    def create_controls(self):
+        """
+        Crée les widgets de sélection de la parcelle et de la période.
+        """
+        parcels = [str(p) for p in self.data_manager.parcel_index]
+        self.parcel_select = Select(title="Parcelle", value=self.parcelle_id, options=parcels)
+        self.parcel_select.on_change('value', self.update_plots)
+
+        weather_dates = self.data_manager.get_weather_window()['date']
+        start = min(self.start_date, weather_dates.iloc[0])
+        end = max(self.end_date, weather_dates.iloc[-1])
+        self.date_slider = DateRangeSlider(title="Période", start=start, end=end,
+                                           value=(self.start_date, self.end_date), width=800)
+        self.date_slider.on_change('value', self.update_date_range)
+
+        return row(self.parcel_select, self.date_slider)
+
+    @instrumented
     def create_stress_matrix(self):
         """
         Crée une matrice de stress combinant stress hydrique et conditions météorologiques.
@@ -88,48 +210,343 @@ class AgriculturalDashboard:
 
         return p
 
+    @instrumented
     def create_yield_prediction_plot(self):
         """
         Crée un graphique de prédiction des rendements.
         """
         p = figure(title='Prédiction des Rendements',
-                   x_axis_type='datetime',
                    height=400, width=800)
 
-        # Exemple d'ajout de prédictions fictives
-        p.line('annee', 'rendement', source=self.hist_source, line_width=2, color="red", legend_label="Prédiction")
-        p.add_tools(HoverTool(tooltips=[("Année", "@annee"), ("Prédiction", "@rendement")]))
+        # Historique observé et prédiction du modèle pour la saison en cours
+        p.line('annee', 'rendement', source=self.hist_source, line_width=2, color="gray", legend_label="Historique")
+        # Bandes des scénarios climatiques : 5e-95e et 25e-75e centiles
+        p.segment(x0='annee', y0='p5', x1='annee', y1='p95', source=self.scenario_yield_source,
+                  line_width=2, color="salmon", legend_label="Scénarios (5-95 %)")
+        p.vbar(x='annee', bottom='p25', top='p75', width=0.3, source=self.scenario_yield_source,
+               fill_color="salmon", fill_alpha=0.5, line_color="salmon", legend_label="Scénarios (25-75 %)")
+        prediction = p.scatter('annee', 'predicted_yield', source=self.prediction_source, size=12,
+                               color="red", legend_label="Prédiction")
+        p.add_tools(HoverTool(renderers=[prediction],
+                              tooltips=[("Année", "@annee"), ("Prédiction", "@predicted_yield{0.00}")]))
+
+        return p
+
+    @instrumented
+    def create_risk_scenario_plot(self):
+        """
+        Crée un graphique des bandes de risque journalier sous les scénarios climatiques.
+        """
+        p = figure(title='Risque Journalier sous Scénarios Climatiques',
+                   x_axis_type='datetime', x_range=self.time_range, y_range=(0, 1),
+                   height=300, width=PLOT_WIDTH)
+
+        p.varea(x='date', y1='p5', y2='p95', source=self.scenario_risk_source, fill_color="firebrick",
+                fill_alpha=0.15, legend_label="5-95 %")
+        p.varea(x='date', y1='p25', y2='p75', source=self.scenario_risk_source, fill_color="firebrick",
+                fill_alpha=0.3, legend_label="25-75 %")
+        p.line('date', 'p50', source=self.scenario_risk_source, line_width=2, color="firebrick",
+               legend_label="Médiane")
+        p.add_tools(HoverTool(tooltips=[("Date", "@date{%F}"), ("Médiane", "@p50{0.00}"),
+                                        ("5-95 %", "@p5{0.00} - @p95{0.00}")],
+                              formatters={"@date": "datetime"}))
 
         return p
 
+    def refresh_scenarios(self):
+        """
+        Met à jour les bandes de risque journalier et de rendement de la
+        parcelle sélectionnée.
+
+        Les scénarios d'une parcelle ne sont simulés qu'à sa première
+        sélection, à partir des entrées de saison que le gestionnaire de
+        données prépare une seule fois pour toutes les parcelles ; les
+        sélections suivantes relisent les bandes conservées.
+        """
+        if not hasattr(self.data_manager, 'simulate_climate_scenarios') or self.parcelle_id is None:
+            return
+        bands = self.scenario_bands.get(self.parcelle_id)
+        if bands is None:
+            summary, daily = self.data_manager.simulate_climate_scenarios(SCENARIO_COUNT,
+                                                                          parcel_ids=[self.parcelle_id])
+            yields = summary[summary['indicateur'] == 'rendement']
+            bands = self.scenario_bands[self.parcelle_id] = (to_columns(daily, ['date'] + BAND_COLUMNS),
+                                                             to_columns(yields, ['annee'] + BAND_COLUMNS))
+        self.scenario_risk_source.data, self.scenario_yield_source.data = bands
+
+    def parcel_prediction(self):
+        """
+        Renvoie le rendement prédit pour la saison en cours de la parcelle sélectionnée.
+
+        Les prédictions viennent de ``parcels_data``, calculées une seule fois
+        par le modèle de rendement du gestionnaire de données.
+        """
+        parcels = self.data_manager.parcels_data
+        if parcels is None:
+            return {col: [] for col in PREDICTION_COLUMNS}
+        parcel = parcels[parcels['parcelle_id'] == self.parcelle_id]
+        return {'annee': parcel['date'].dt.year.to_numpy(),
+                'predicted_yield': parcel['predicted_yield'].to_numpy()}
+
+    @instrumented
+    def create_anomaly_table(self):
+        """
+        Crée le tableau des parcelles dont la dernière observation est anormale.
+        """
+        columns = [
+            TableColumn(field='parcelle_id', title='Parcelle'),
+            TableColumn(field='date', title='Date', formatter=DateFormatter(format='%d/%m/%Y')),
+            TableColumn(field='culture', title='Culture'),
+            TableColumn(field='mesures_anormales', title='Mesures anormales'),
+            TableColumn(field='score_max', title='Score |z|', formatter=NumberFormatter(format='0.00')),
+        ]
+        return DataTable(source=self.anomaly_source, columns=columns, height=250, width=800,
+                         index_position=None)
+
+    def parcel_anomalies(self):
+        """
+        Renvoie les parcelles signalées par le détecteur d'anomalies du
+        gestionnaire de données, les plus anormales en premier.
+        """
+        if not hasattr(self.data_manager, 'get_parcel_anomalies'):
+            return {col: [] for col in ANOMALY_COLUMNS}
+        return to_columns(self.data_manager.get_parcel_anomalies(), ANOMALY_COLUMNS)
+
+    @instrumented
     def create_layout(self):
         """
         Organise tous les graphiques dans une mise en page cohérente.
         """
+        controls = self.create_controls()
         yield_plot = self.create_yield_history_plot()
         ndvi_plot = self.create_ndvi_temporal_plot()
+        weather_plot = self.create_weather_plot()
         stress_plot = self.create_stress_matrix()
         prediction_plot = self.create_yield_prediction_plot()
+        scenario_plot = self.create_risk_scenario_plot()
+        anomaly_table = self.create_anomaly_table()
 
-        layout = column(yield_plot, ndvi_plot, stress_plot, prediction_plot)
+        layout = column(controls, yield_plot, ndvi_plot, weather_plot, stress_plot, prediction_plot,
+                        scenario_plot, anomaly_table)
         return layout
 
+    @instrumented
     def update_plots(self, attr, old, new):
         """
         Met à jour tous les graphiques quand une nouvelle parcelle est sélectionnée.
+        La météo n'est rechargée que si la parcelle dépend d'une autre station.
+        """
+        self.parcelle_id = new
+        station_id = self.data_manager.get_parcel_station(new)
+        if station_id != self.station_id:
+            self.station_id = station_id
+            self.refresh_weather()
+            if self.weather_plot is not None:
+                self.weather_plot.title.text = self.weather_title()
+
+        # Seules les lignes de la parcelle, lues via l'index, sont envoyées au navigateur
+        self.refresh_ndvi()
+        self.hist_source.data = to_columns(self.data_manager.get_parcel_yield_history(new), YIELD_COLUMNS)
+        self.prediction_source.data = self.parcel_prediction()
+        self.refresh_scenarios()
+
+    def update_date_range(self, attr, old, new):
+        """
+        Met à jour les graphiques quand la période du curseur change.
+        """
+        self.start_date, self.end_date = [pd.Timestamp(value).tz_localize(None)
+                                          for value in self.date_slider.value_as_datetime]
+        self.time_range.update(start=self.start_date, end=self.end_date)
+        self.refresh_visible_range()
+
+    def update_visible_range(self, event):
+        """
+        Recharge une résolution plus fine pour la plage visible après un zoom ou un déplacement.
+
+        Les graphiques partageant l'axe temporel signalent chacun le même
+        changement : une plage identique à la plage courante est ignorée.
+        """
+        start, end = pd.Timestamp(event.x0, unit='ms'), pd.Timestamp(event.x1, unit='ms')
+        if (start, end) == (self.start_date, self.end_date):
+            return
+        self.start_date, self.end_date = start, end
+        self.refresh_visible_range()
+
+    def refresh_visible_range(self):
+        """
+        Recharge les séries dont la plage visible n'est pas déjà entièrement chargée.
+        """
+        if not self.ndvi_complete:
+            self.refresh_ndvi()
+        self.refresh_weather()
+
+    @instrumented
+    def refresh_ndvi(self):
+        """
+        Charge le NDVI de la parcelle sélectionnée, réduit par LTTB à ``max_points`` points.
+
+        Si tout l'historique de la parcelle tient dans la largeur du graphique,
+        il est envoyé en entier et les changements de plage ne le rechargent
+        plus. Sinon seule la plage visible est chargée puis sous-échantillonnée ;
+        si elle compte plus de jours que de pixels, les moyennes hebdomadaires,
+        mensuelles ou saisonnières précalculées du magasin d'agrégats sont
+        lues directement.
+        """
+        monitoring_data = self.data_manager.get_parcel_monitoring(self.parcelle_id)
+        self.ndvi_complete = len(monitoring_data) <= self.max_points
+        if not self.ndvi_complete:
+            level = self.aggregate_level()
+            if level is not None:
+                aggregates = self.data_manager.get_feature_store().query(
+                    self.parcelle_id, self.start_date, self.end_date, level=level)
+                self.source.data = to_columns(aggregates.rename(columns={'periode': 'date'}),
+                                              MONITORING_COLUMNS)
+                self.ndvi_raw = False
+                return
+            monitoring_data = self.data_manager.get_monitoring_window(
+                self.parcelle_id, self.start_date, self.end_date)
+
+        keep = downsample(monitoring_data['date'].to_numpy(), monitoring_data['ndvi'].to_numpy(),
+                          self.max_points)
+        self.source.data = to_columns(monitoring_data.iloc[keep], MONITORING_COLUMNS)
+        self.ndvi_raw = len(keep) == len(monitoring_data)
+
+    @instrumented
+    def refresh_weather(self):
+        """
+        Recharge les relevés météo de la station de la parcelle sur la plage
+        visible, réduits par seaux min/max, ou agrégés par le magasin
+        d'agrégats pour les plages les plus longues.
+        """
+        level = self.aggregate_level()
+        if level is not None:
+            aggregates = self.data_manager.get_feature_store().query_weather(
+                self.start_date, self.end_date, level=level, station_id=self.station_id)
+            self.weather_source.data = to_columns(aggregates.rename(columns={'periode': 'date'}),
+                                                  WEATHER_COLUMNS)
+            self.weather_raw = False
+            return
+
+        weather_data = self.data_manager.get_weather_window(self.start_date, self.end_date,
+                                                           station_id=self.station_id)
+        keep = downsample(weather_data['date'].to_numpy(), weather_data['temperature'].to_numpy(),
+                          self.max_points, method='minmax')
+        self.weather_source.data = to_columns(weather_data.iloc[keep], WEATHER_COLUMNS)
+        self.weather_raw = len(keep) == len(weather_data)
+
+    def aggregate_level(self):
+        """
+        Renvoie le niveau d'agrégation suffisant pour afficher la plage visible
+        dans la largeur du graphique, ou None si c'est le jour (les données
+        brutes sont alors sous-échantillonnées). Le magasin d'agrégats n'est
+        construit qu'à la première plage qui en a besoin.
+        """
+        level = level_for(self.start_date, self.end_date, self.max_points)
+        return None if level == 'jour' else level
+
+    def visible_rows(self, rows):
+        """Renvoie les lignes datées dans la plage visible, triées par date."""
+        rows = rows[(rows['date'] >= self.start_date) & (rows['date'] <= self.end_date)]
+        return rows.sort_values('date')
+
+    def stream_or_refresh(self, source, raw, rows, columns, rollover, refresh):
+        """
+        Envoie ``rows`` via ``source.stream`` si la source contient des points
+        bruts que ces lignes prolongent sans dépasser ``rollover`` points
+        (``max_points`` par défaut). Sinon la source, réduite ou agrégée, est
+        recalculée pour la plage visible par ``refresh``.
+        """
+        rollover = rollover or self.max_points
+        dates = np.asarray(source.data['date'])
+        extends = not len(dates) or rows['date'].to_numpy()[0] >= dates[-1]
+        if raw and extends and len(dates) + len(rows) <= rollover:
+            source.stream(to_columns(rows, columns), rollover=rollover)
+        else:
+            refresh()
+
+    def stream_observations(self, observations, rollover=None):
+        """
+        Ajoute de nouvelles observations de monitoring à la source existante.
+
+        Seules les lignes de la parcelle affichée sont prises en compte ; si
+        la source contient les points bruts, le navigateur reçoit uniquement
+        les nouveaux points via ``source.stream``. Sinon le NDVI de la plage
+        visible est de nouveau réduit (``refresh_ndvi``).
+        """
+        rows = observations[observations['parcelle_id'] == self.parcelle_id]
+        # L'historique complet est affiché tant qu'il tient dans la largeur du graphique
+        rows = rows.sort_values('date') if self.ndvi_complete else self.visible_rows(rows)
+        if len(rows):
+            self.stream_or_refresh(self.source, self.ndvi_raw, rows, MONITORING_COLUMNS, rollover,
+                                   self.refresh_ndvi)
+
+    def stream_weather(self, readings, rollover=None):
         """
-        parcelle_id = new
-        updated_data = self.data_manager.monitoring_data[self.data_manager.monitoring_data['parcelle_id'] == parcelle_id]
-        self.source.data = ColumnDataSource(updated_data).data
+        Ajoute les nouveaux relevés météo de la plage visible, à la station
+        affichée, à la source existante, via ``source.stream`` si elle contient
+        les relevés bruts, sinon en réduisant de nouveau la plage visible
+        (``refresh_weather``).
+        """
+        if 'station_id' in readings.columns:
+            readings = readings[readings['station_id'].astype(str) == str(self.station_id)]
+        rows = self.visible_rows(readings)
+        if len(rows):
+            self.stream_or_refresh(self.weather_source, self.weather_raw, rows, WEATHER_COLUMNS, rollover,
+                                   self.refresh_weather)
+
+    @instrumented
+    def push_updates(self, monitoring=None, weather=None):
+        """
+        Reçoit un lot ajouté au gestionnaire de données (``subscribe``) et
+        n'envoie au navigateur que ses nouvelles lignes. Le tableau des
+        anomalies est relu depuis l'état du détecteur, mis à jour par le lot.
+        Les bandes des scénarios conservées sont oubliées : chaque parcelle
+        est simulée de nouveau à sa prochaine sélection, hors de ce rappel.
+        """
+        if monitoring is not None:
+            self.stream_observations(monitoring)
+            self.anomaly_source.data = self.parcel_anomalies()
+        if weather is not None:
+            self.stream_weather(weather)
+        self.scenario_bands = {}
+
+    def patch_observations(self, corrections):
+        """
+        Corrige des observations déjà affichées via ``source.patch``.
+
+        Les corrections sont repérées par leur date dans la source de la
+        parcelle affichée ; seules les valeurs modifiées sont envoyées.
+        """
+        rows = corrections[corrections['parcelle_id'] == self.parcelle_id]
+        dates = np.asarray(self.source.data['date'])
+        if not len(rows) or not len(dates):
+            return
+
+        new_dates = rows['date'].to_numpy()
+        positions = np.minimum(np.searchsorted(dates, new_dates), len(dates) - 1)
+        found = dates[positions] == new_dates
+
+        patches = {}
+        for col in MONITORING_COLUMNS:
+            if col != 'date' and col in rows:
+                values = rows[col].to_numpy()[found]
+                patches[col] = [(int(i), v) for i, v in zip(positions[found], values.tolist())]
+        if patches:
+            self.source.patch(patches)
+
+# Main code to run the Bokeh app (bokeh serve), skipped when the module is only imported
+if __name__.startswith('bokeh_app'):
+    from data_manager import AgriculturalDataManager
 
-# Main code to run the Bokeh app
-from data_manager import AgriculturalDataManager
+    data_manager = AgriculturalDataManager()
+    data_manager.load_data()
 
-data_manager = AgriculturalDataManager()
-data_manager.load_data()
+    dash = AgriculturalDashboard(data_manager)
+    layout = dash.create_layout()
 
-dash = AgriculturalDashboard(data_manager)
-layout = dash.create_layout()
+    # Les lots ajoutés au gestionnaire sont diffusés depuis la boucle du document
+    doc = curdoc()
+    data_manager.subscribe(lambda **batch: doc.add_next_tick_callback(partial(dash.push_updates, **batch)))
 
-curdoc().add_root(layout)
-curdoc().title = "Tableau de Bord Agricole"
\ No newline at end of file
+    doc.add_root(layout)
+    doc.title = "Tableau de Bord Agricole"
\ No newline at end of file
@@ -2,9 +2,16 @@ from bokeh.layouts import column
 from bokeh.models import (ColumnDataSource, HoverTool)
 from bokeh.plotting import figure, curdoc
 from bokeh.palettes import RdYlBu11 as palette
+from bokeh.events import RangesUpdate
 import pandas as pd
 import numpy as np
 
+from downsampling import lttb
+from instrumentation import instrumented
+
+# Plot width in pixels: at most one NDVI point is drawn per pixel
+PLOT_WIDTH = 800
+
 class AgriculturalDashboard:
     def __init__(self, data_manager):
         """
@@ -21,16 +28,20 @@ class AgriculturalDashboard:
         self.hist_source = None
         self.create_data_sources()
 
+    @instrumented
     def create_data_sources(self):
         """
         Prepare data sources for Bokeh by integrating current and historical data
         """
-        monitoring_data = self.data_manager.monitoring_data
-        self.source = ColumnDataSource(monitoring_data)
+        monitoring_data = self.data_manager.monitoring_data.sort_values('date')
+        self.ndvi_dates = monitoring_data['date'].to_numpy()
+        self.ndvi_values = monitoring_data['ndvi'].to_numpy()
+        self.source = ColumnDataSource(self.downsample_ndvi())
 
         yield_history = self.data_manager.yield_history
         self.hist_source = ColumnDataSource(yield_history)
 
+    @instrumented
     def create_yield_history_plot(self):
         """
         Create a plot showing historical yield evolution with annotations for important events
@@ -47,21 +58,43 @@ class AgriculturalDashboard:
 
         return p
 
+    @instrumented
     def create_ndvi_temporal_plot(self):
         """
         Create a plot showing NDVI evolution with historical thresholds
         """
         p = figure(title="Évolution du NDVI et Seuils Historiques",
                    x_axis_type="datetime",
-                   height=400, width=800)
+                   height=400, width=PLOT_WIDTH)
 
         p.line(x='date', y='ndvi', source=self.source, line_width=2, color="green", legend_label="NDVI")
 
         hover = HoverTool(tooltips=[("Date", "@date{%F}"), ("NDVI", "@ndvi")], formatters={"@date": "datetime"})
         p.add_tools(hover)
+        p.on_event(RangesUpdate, self.update_visible_range)
 
         return p
 
+    def downsample_ndvi(self, start=None, end=None):
+        """
+        Return the NDVI points between start and end, reduced with LTTB to the plot width
+        """
+        lo = 0 if start is None else np.searchsorted(self.ndvi_dates, pd.Timestamp(start).to_datetime64())
+        hi = len(self.ndvi_dates) if end is None else np.searchsorted(
+            self.ndvi_dates, pd.Timestamp(end).to_datetime64(), side='right')
+        dates, values = self.ndvi_dates[lo:hi], self.ndvi_values[lo:hi]
+        keep = lttb(dates, values, PLOT_WIDTH)
+        return {'date': dates[keep], 'ndvi': values[keep]}
+
+    def update_visible_range(self, event):
+        """
+        Re-fetch a finer NDVI resolution for the visible range after a zoom or pan
+        """
+        if len(self.ndvi_dates) > PLOT_WIDTH:
+            self.source.data = self.downsample_ndvi(pd.Timestamp(event.x0, unit='ms'),
+                                                    pd.Timestamp(event.x1, unit='ms'))
+
+    @instrumented
     def create_stress_matrix(self):
         """
         Create a stress matrix combining hydric stress and meteorological conditions
@@ -80,6 +113,7 @@ class AgriculturalDashboard:
 
         return p
 
+    @instrumented
     def create_yield_prediction_plot(self):
         """
         Create a plot showing yield predictions based on historical and current data
@@ -95,6 +129,7 @@ class AgriculturalDashboard:
 
         return p
 
+    @instrumented
     def create_layout(self):
         """
         Organize all plots into a coherent layout
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+
+
+CACHE_VERSION = 1
+
+
+def file_digest(path, block_size=1 << 20, limit=None):
+    """
+    Computes the SHA-256 digest of a file, reading it block by block.
+
+    With ``limit``, only the first ``limit`` bytes are hashed.
+    """
+    digest = hashlib.sha256()
+    remaining = limit
+    with open(path, 'rb') as handle:
+        while remaining is None or remaining > 0:
+            block = handle.read(block_size if remaining is None else min(block_size, remaining))
+            if not block:
+                break
+            digest.update(block)
+            if remaining is not None:
+                remaining -= len(block)
+    return digest.hexdigest()
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as handle:
+            meta = json.load(handle)
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != CACHE_VERSION:
+        return None
+    return meta
+
+
+def read_meta(directory):
+    """Returns the metadata of a frame written by ``write_frame``, or None."""
+    return _read_meta(os.path.join(directory, 'meta.json'))
+
+
+def _write_meta(meta_path, meta):
+    tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as handle:
+        json.dump(meta, handle)
+    os.replace(tmp_path, meta_path)
+
+
+def write_frame(frame, directory, signature=None):
+    """
+    Writes a DataFrame as one ``.npy`` file per column.
+
+    Numeric, boolean and datetime columns are stored as-is so they can be
+    memory-mapped on load. Categorical and string columns are stored as
+    integer codes, their categories being kept in ``meta.json``.
+
+    Each write uses new file names, each file being written aside and
+    renamed into place, so files that readers may have memory-mapped are
+    never truncated, even by another process rebuilding the same source.
+    """
+    os.makedirs(directory, exist_ok=True)
+    signature = dict(signature or {})
+    generation = f"{signature.get('sha256', '')[:12]}{uuid.uuid4().hex[:12]}"
+
+    columns = []
+    for position, name in enumerate(frame.columns):
+        series = frame[name]
+        entry = {'name': name, 'dtype': str(series.dtype)}
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            values = series.cat.codes.to_numpy()
+            entry['kind'] = 'category'
+            entry['categories'] = series.cat.categories.tolist()
+            entry['ordered'] = bool(series.cat.ordered)
+        elif (pd.api.types.is_numeric_dtype(series.dtype)
+              or pd.api.types.is_bool_dtype(series.dtype)
+              or pd.api.types.is_datetime64_dtype(series.dtype)):
+            values = series.to_numpy()
+            entry['kind'] = 'array'
+        else:
+            codes, uniques = pd.factorize(series, use_na_sentinel=True)
+            values = codes.astype(np.int32)
+            entry['kind'] = 'codes'
+            entry['categories'] = [str(value) for value in uniques]
+
+        entry['file'] = f"{position}-{generation}.npy"
+        path = os.path.join(directory, entry['file'])
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as handle:
+            np.save(handle, values, allow_pickle=False)
+        os.replace(tmp_path, path)
+        columns.append(entry)
+
+    meta = {'version': CACHE_VERSION, 'rows': len(frame), 'columns': columns}
+    meta.update(signature)
+    _write_meta(os.path.join(directory, 'meta.json'), meta)
+
+    # Remove column files from previous generations
+    current = {entry['file'] for entry in columns} | {'meta.json'}
+    for filename in os.listdir(directory):
+        if filename.endswith('.npy') and filename not in current:
+            try:
+                os.remove(os.path.join(directory, filename))
+            except OSError:
+                pass
+
+
+def read_frame(directory, mmap=True, meta=None):
+    """
+    Reads a DataFrame written by ``write_frame``.
+
+    With ``mmap=True`` the numeric columns are copy-on-write memory maps, so
+    several processes reading the same cache share the same physical pages.
+    """
+    meta = meta or _read_meta(os.path.join(directory, 'meta.json'))
+    if meta is None:
+        return None
+
+    mmap_mode = 'c' if mmap else None
+    data = {}
+    for entry in meta['columns']:
+        values = np.load(os.path.join(directory, entry['file']),
+                         mmap_mode=mmap_mode, allow_pickle=False)
+        if entry['kind'] == 'category':
+            values = pd.Categorical.from_codes(values, categories=entry['categories'],
+                                               ordered=entry['ordered'])
+        elif entry['kind'] == 'codes':
+            values = pd.Series(pd.Categorical.from_codes(values, categories=entry['categories']))
+            values = values.astype(entry['dtype']).to_numpy()
+        data[entry['name']] = values
+
+    return pd.DataFrame(data, copy=False)
+
+
+def load_cached_frame(source_path, cache_dir, name, build, mmap=True):
+    """
+    Returns the cached version of ``source_path``, rebuilding it when needed.
+
+    The cache entry is considered fresh when the source file's modification
+    time and size are unchanged. Otherwise the source content hash is compared
+    to the stored one, so a file that was only touched is not re-parsed.
+    ``build`` is a callable returning the DataFrame to cache.
+    """
+    directory = os.path.join(cache_dir, name)
+    meta_path = os.path.join(directory, 'meta.json')
+    stat = os.stat(source_path)
+    meta = _read_meta(meta_path)
+
+    if meta is not None:
+        if meta.get('mtime_ns') == stat.st_mtime_ns and meta.get('size') == stat.st_size:
+            frame = _safe_read(directory, mmap, meta)
+            if frame is not None:
+                return frame
+        digest = file_digest(source_path)
+        if meta.get('sha256') == digest:
+            frame = _safe_read(directory, mmap, meta)
+            if frame is not None:
+                meta.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+                _write_meta(meta_path, meta)
+                return frame
+    else:
+        digest = file_digest(source_path)
+
+    frame = build()
+    try:
+        write_frame(frame, directory, signature={
+            'source': os.path.abspath(source_path),
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'sha256': digest,
+        })
+    except OSError as e:
+        print(f"Unable to write cache for {name}: {e}")
+    return frame
+
+
+def _safe_read(directory, mmap, meta):
+    try:
+        return read_frame(directory, mmap=mmap, meta=meta)
+    except (OSError, ValueError, KeyError):
+        return None
@@ -1,62 +1,1147 @@
 import pandas as pd
 import numpy as np
-from sklearn.preprocessing import StandardScaler
-from statsmodels.tsa.seasonal import seasonal_decompose
+from pandas.api.types import union_categoricals
 import warnings
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from anomaly_detection import ANOMALY_MEASURES, AnomalyDetector
+from climate_scenarios import (DEFAULT_MEMORY_BUDGET, YIELD_WEATHER_FEATURES, parcel_weather, season_aggregates,
+                               simulate_scenarios, station_weather_history)
+from data_cache import file_digest, load_cached_frame, read_frame, read_meta, write_frame
+from feature_store import FeatureStore
+from incremental import NdviTrendState, RiskState
+from instrumentation import instrumented, stage
+from risk_engine import compute_risk_indicators, parcel_risk_scores
+from spatial_index import ParcelSpatialIndex
+from weather_stations import DEFAULT_STATION, assign_stations, join_station_weather, weather_stations
+from yield_analysis import decompose_many, history_digest
+from yield_model import YieldModel, season_features
 
 
 warnings.filterwarnings('ignore')
 
+# Datasets read from the data directory: attribute -> (file name, date columns)
+DATASET_FILES = {
+    'monitoring_data': ('monitoring_cultures.csv', ['date']),
+    'weather_data': ('meteo_detaillee.csv', ['date']),
+    'soil_data': ('sols.csv', None),
+    'yield_history': ('historique_rendements.csv', None),
+}
+
+# Partial daily weather statistics, combined across chunks with these reductions
+DAILY_PARTIAL_REDUCTIONS = {
+    'temperature_min': 'min',
+    'temperature_max': 'max',
+    'temperature_sum': 'sum',
+    'temperature_count': 'sum',
+    'humidite_sum': 'sum',
+    'humidite_count': 'sum',
+    'precipitation': 'sum',
+    'rayonnement_solaire': 'sum',
+    'vitesse_vent_max': 'max',
+    'latitude': 'first',
+    'longitude': 'first',
+}
+
+
+def _daily_weather_partials(chunk):
+    """Reduces a chunk of hourly weather rows to per-day (and per-station) partial statistics."""
+    keys = [chunk['date'].dt.normalize()]
+    if 'station_id' in chunk.columns:
+        keys.append(chunk['station_id'].astype(str))
+    grouped = chunk.groupby(keys)
+    partials = pd.DataFrame({
+        'temperature_min': grouped['temperature'].min(),
+        'temperature_max': grouped['temperature'].max(),
+        'temperature_sum': grouped['temperature'].sum(),
+        'temperature_count': grouped['temperature'].count(),
+        'humidite_sum': grouped['humidite'].sum(),
+        'humidite_count': grouped['humidite'].count(),
+        'precipitation': grouped['precipitation'].sum(),
+        'rayonnement_solaire': grouped['rayonnement_solaire'].sum(),
+        'vitesse_vent_max': grouped['vitesse_vent'].max(),
+    })
+    # Station coordinates are kept so stations can be located from daily aggregates
+    for column in ['latitude', 'longitude']:
+        if 'station_id' in chunk.columns and column in chunk.columns:
+            partials[column] = grouped[column].first()
+    return partials
+
+
+def _finalize_daily_weather(partials, by_station=False):
+    """
+    Turns accumulated partial statistics into the daily weather table.
+
+    Partials of several stations give one row per station and day with
+    ``by_station``, and otherwise the mean of the stations' daily values.
+    """
+    daily = pd.DataFrame({
+        'date': partials.index.get_level_values('date'),
+        'temperature_min': partials['temperature_min'].to_numpy(),
+        'temperature_max': partials['temperature_max'].to_numpy(),
+        'temperature': (partials['temperature_sum'] / partials['temperature_count']).to_numpy(),
+        'humidite': (partials['humidite_sum'] / partials['humidite_count']).to_numpy(),
+        'precipitation': partials['precipitation'].to_numpy(),
+        'rayonnement_solaire': partials['rayonnement_solaire'].to_numpy(),
+        'vitesse_vent_max': partials['vitesse_vent_max'].to_numpy(),
+    })
+    if 'station_id' in partials.index.names:
+        daily.insert(0, 'station_id', partials.index.get_level_values('station_id'))
+        if by_station:
+            for position, column in enumerate(['latitude', 'longitude'], start=1):
+                if column in partials.columns:
+                    daily.insert(position, column, partials[column].to_numpy())
+            return daily.sort_values(['station_id', 'date'], ignore_index=True)
+        daily = daily.drop(columns='station_id').groupby('date', as_index=False).mean()
+    return daily.sort_values('date', ignore_index=True)
+
+
+def aggregate_daily_weather(chunks, by_station=False):
+    """
+    Builds daily weather aggregates from an iterable of hourly weather chunks.
+
+    Only per-day partial statistics are kept between chunks, so memory grows
+    with the number of days and not with the number of hourly rows. The
+    partials are combined once at the end, days split across chunk
+    boundaries being merged then. Readings of several stations are
+    aggregated per station, then averaged unless ``by_station``.
+    """
+    parts = [_daily_weather_partials(chunk) for chunk in chunks]
+    partials = parts[0] if len(parts) == 1 else None
+    if len(parts) > 1:
+        levels = list(range(parts[0].index.nlevels))
+        reductions = {column: DAILY_PARTIAL_REDUCTIONS[column] for column in parts[0].columns}
+        partials = pd.concat(parts).groupby(level=levels).agg(reductions)
+
+    if partials is None:
+        partials = pd.DataFrame(columns=list(DAILY_PARTIAL_REDUCTIONS)[:-2], index=pd.DatetimeIndex([]))
+    partials.index.names = ['date', 'station_id'][:partials.index.nlevels]
+    return _finalize_daily_weather(partials, by_station)
+
+
+def build_partition_index(frame, key, order_by):
+    """
+    Sorts ``frame`` by ``key`` then ``order_by`` and indexes each key's rows.
+
+    Returns the sorted frame and a dict mapping each key value to the
+    ``slice`` of its contiguous rows, so a partition is read with ``iloc``
+    without scanning the frame. The frame is not copied when already sorted.
+    """
+    codes, keys = pd.factorize(frame[key], sort=True)
+    order = np.lexsort((frame[order_by].to_numpy(), codes))
+    if not np.array_equal(order, np.arange(len(order))):
+        frame = frame.iloc[order].reset_index(drop=True)
+        codes = codes[order]
+
+    counts = np.bincount(codes, minlength=len(keys))
+    stops = np.cumsum(counts)
+    starts = stops - counts
+    index = {k: slice(int(start), int(stop)) for k, start, stop in zip(keys, starts, stops)}
+    return frame, index
+
+
+def index_positions(rows):
+    """
+    Returns the row positions of a partition index entry.
+
+    Entries are slices after a full indexing and position arrays for
+    partitions extended by appended rows.
+    """
+    if isinstance(rows, slice):
+        return np.arange(rows.start, rows.stop)
+    return rows
+
+
+def append_rows(frame, rows):
+    """
+    Appends ``rows`` to ``frame`` with the same columns and dtypes.
+
+    Categorical columns are extended with the new categories instead of
+    falling back to object columns.
+    """
+    rows = rows.reindex(columns=frame.columns)
+    columns = {}
+    for name in frame.columns:
+        series = frame[name]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            columns[name] = union_categoricals([series.array, pd.Categorical(rows[name])], ignore_order=True)
+        else:
+            columns[name] = pd.concat([series, rows[name].astype(series.dtype)], ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+def date_bounds(dates, start=None, end=None):
+    """
+    Returns the ``(lo, hi)`` positions delimiting ``[start, end]`` in a sorted
+    datetime array, found by binary search. ``None`` leaves a bound open.
+    """
+    lo = 0 if start is None else int(np.searchsorted(dates, pd.Timestamp(start).to_datetime64(), side='left'))
+    hi = len(dates) if end is None else int(np.searchsorted(dates, pd.Timestamp(end).to_datetime64(), side='right'))
+    return lo, max(lo, hi)
+
+# Columns stored as categories in compact mode (repeated labels)
+CATEGORICAL_COLUMNS = ['parcelle_id', 'culture', 'type_sol', 'crop_name']
+
+# Float columns kept in float64 in compact mode (coordinates need the precision)
+FLOAT64_COLUMNS = ['latitude', 'longitude']
+
+
+def compact_frame(frame):
+    """
+    Returns a memory-compact copy of ``frame``.
+
+    Identifier and label columns become categories, float measurements
+    float32, and integer columns (such as 'annee') the smallest integer type
+    that holds their values. Dates and coordinates are unchanged.
+    """
+    columns = {}
+    for name in frame.columns:
+        series = frame[name]
+        if name in CATEGORICAL_COLUMNS:
+            series = series.astype('category')
+        elif pd.api.types.is_float_dtype(series.dtype) and name not in FLOAT64_COLUMNS:
+            series = series.astype(np.float32)
+        elif pd.api.types.is_integer_dtype(series.dtype):
+            series = pd.to_numeric(series, downcast='integer')
+        columns[name] = series
+    return pd.DataFrame(columns, index=frame.index)
+
+
+def expand_frame(frame):
+    """
+    Returns a copy of ``frame`` with pandas' default CSV schema
+    (categories as strings, float64 and int64 numbers), the inverse of ``compact_frame``.
+    """
+    columns = {}
+    for name in frame.columns:
+        series = frame[name]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            series = series.astype(series.cat.categories.dtype)
+        elif pd.api.types.is_float_dtype(series.dtype):
+            series = series.astype(np.float64)
+        elif pd.api.types.is_integer_dtype(series.dtype):
+            series = series.astype(np.int64)
+        columns[name] = series
+    return pd.DataFrame(columns, index=frame.index)
+
+
+def _lazy_dataset(name):
+    """Property loading a dataset on first access and returning its indexed frame."""
+    def getter(self):
+        return self._get_dataset(name)
+
+    def setter(self, value):
+        with self._lock:
+            self._datasets[name] = value
+            self._indexed.discard(name)
+            # Running states derived from the previous rows no longer apply
+            self.ndvi_trends = None
+            self.risk_state = None
+            self.anomaly_detector = None
+            self.season_features = None
+            self._revision += 1
+
+    return property(getter, setter, doc=f"``{DATASET_FILES[name][0]}``, loaded on first access.")
+
+
+def _lazy_index(dataset, key, default=None):
+    """Property returning an index built when ``dataset`` is loaded."""
+    def getter(self):
+        self._get_dataset(dataset)
+        return self._index_data.get(key, default() if callable(default) else default)
+
+    return property(getter, doc=f"Index over ``{dataset}``, built on load.")
+
+
 class AgriculturalDataManager:
-    def __init__(self):
+    # Datasets are read on first access, or all at once (in parallel) by load_data
+    monitoring_data = _lazy_dataset('monitoring_data')
+    weather_data = _lazy_dataset('weather_data')
+    soil_data = _lazy_dataset('soil_data')
+    yield_history = _lazy_dataset('yield_history')
+
+    # Indexes built as soon as their dataset is loaded
+    parcel_index = _lazy_index('monitoring_data', 'parcel_index', dict)
+    monitoring_date_order = _lazy_index('monitoring_data', 'monitoring_date_order')
+    monitoring_dates_sorted = _lazy_index('monitoring_data', 'monitoring_dates_sorted')
+    yield_index = _lazy_index('yield_history', 'yield_index', dict)
+    spatial_index = _lazy_index('soil_data', 'spatial_index')
+    station_index = _lazy_index('weather_data', 'station_index', dict)
+
+    def __init__(self, data_dir='data', cache_dir=None, use_cache=True, weather_chunksize=50000,
+                 compact=False, station_join='nearest', station_neighbours=3):
         """
         Initializes the agricultural data manager.
+
+        When ``use_cache`` is enabled, each CSV is converted once to a binary
+        columnar cache in ``cache_dir`` (``<data_dir>/.cache`` by default) and
+        memory-mapped from there on subsequent loads.
+
+        ``weather_chunksize`` is the number of hourly rows read at a time when
+        the weather file is ingested in streaming mode.
+
+        Nothing is read here: each dataset is loaded on first access, or all
+        of them concurrently by ``load_data``.
+
+        With ``compact=True`` datasets use the compact schema of
+        ``compact_frame`` (categories, float32, small integers), which is also
+        what gets cached.
+
+        Weather readings may carry a 'station_id' with the station's
+        coordinates. Parcels then get the weather of their nearest station
+        (``station_join='nearest'``) or an inverse-distance blend of their
+        ``station_neighbours`` nearest ones (``station_join='idw'``).
         """
-        self.monitoring_data = None
-        self.weather_data = None
-        self.soil_data = None
-        self.yield_history = None
-        self.parcels_data = None  # Add this line
+        self.data_dir = data_dir
+        self.cache_dir = cache_dir or os.path.join(data_dir, '.cache')
+        self.use_cache = use_cache
+        self.weather_chunksize = weather_chunksize
+        self.compact = compact
+        self.station_join = station_join
+        self.station_neighbours = station_neighbours
+        self.stream_weather = False
+        self.daily_weather = None
+        self.station_daily_weather = None
+        self._datasets = {}
+        self._indexed = set()
+        self._index_data = {}
+        self._parcels_data = None
+        self._decompositions = {}
+        self.feature_store = None
+        self.ndvi_trends = None
+        self.risk_state = None
+        self.anomaly_detector = None
+        self._listeners = []
+        self.season_features = None
+        self.yield_model = None
+        self._yield_predictions = None
+        self._scenario_inputs = None
+        # Number of in-memory changes (appends, replaced datasets) since the files were read
+        self._revision = 0
+        self._lock = threading.RLock()
+
+    @property
+    def parcels_data(self):
+        """
+        Per-parcel table built on first access from the latest monitoring row
+        of each parcel, instead of a copy of every monitoring row.
+        """
+        with self._lock:
+            if self._parcels_data is None and self.monitoring_data is not None:
+                self._parcels_data = self._build_parcels_data()
+            return self._parcels_data
+
+    @parcels_data.setter
+    def parcels_data(self, value):
+        self._parcels_data = value
 
-    def load_data(self):
+    def _build_parcels_data(self):
+        parcels_data = self.get_latest_observations().reset_index(drop=True)
+
+        # Add 'predicted_yield' if missing, from the yield model
+        if 'predicted_yield' not in parcels_data.columns:
+            predictions = self.predict_yields()[['parcelle_id', 'predicted_yield']]
+            parcels_data = parcels_data.merge(predictions, on='parcelle_id', how='left')
+
+        # Add 'crop_name' if missing
+        if 'crop_name' not in parcels_data.columns:
+            parcels_data['crop_name'] = ['Crop ' + str(i % 3 + 1) for i in range(len(parcels_data))]
+
+        return parcels_data
+
+    @instrumented
+    def load_data(self, stream_weather=False, parallel=True):
         """
         Loads all necessary datasets and parses dates where applicable.
+
+        With ``parallel=True`` the files are read concurrently by a thread
+        pool. With ``stream_weather=True`` the hourly weather file is never
+        held in memory: it is read in chunks and only the daily aggregates are
+        kept (``self.daily_weather``), ``self.weather_data`` staying ``None``.
+        """
+        with self._lock:
+            self.stream_weather = stream_weather
+            self.daily_weather = None
+            self.station_daily_weather = None
+            self._datasets = {}
+            self._indexed = set()
+            self._index_data = {}
+            self._parcels_data = None
+            self.feature_store = None
+            self.ndvi_trends = None
+            self.risk_state = None
+            self.anomaly_detector = None
+            self.season_features = None
+            self._revision = 0
+
+            names = list(DATASET_FILES)
+            try:
+                if parallel:
+                    with ThreadPoolExecutor(max_workers=len(names)) as executor:
+                        frames = dict(zip(names, executor.map(self._read_named_dataset, names)))
+                else:
+                    frames = {name: self._read_named_dataset(name) for name in names}
+            except FileNotFoundError as e:
+                print(f"Error loading datasets: {e}")
+                frames = dict.fromkeys(names)
+                self.daily_weather = None
+
+            self._datasets.update(frames)
+            self.build_indexes()
+
+    def _read_named_dataset(self, name):
+        """
+        Reads one dataset by attribute name; raises FileNotFoundError if missing.
+
+        In streaming mode the weather task builds the daily aggregates instead.
+        """
+        if name == 'weather_data' and self.stream_weather:
+            self.daily_weather = self.load_daily_weather()
+            return None
+        filename, parse_dates = DATASET_FILES[name]
+        with stage(f"lecture {filename}") as measured:
+            return measured.set_result(self._read_dataset(filename, parse_dates=parse_dates))
+
+    def _get_dataset(self, name):
+        """Returns a dataset, loading and indexing it first if needed."""
+        with self._lock:
+            if name not in self._datasets:
+                try:
+                    self._datasets[name] = self._read_named_dataset(name)
+                except FileNotFoundError as e:
+                    print(f"Error loading datasets: {e}")
+                    self._datasets[name] = None
+            if name not in self._indexed:
+                self._index_dataset(name)
+            return self._datasets[name]
+
+    @instrumented
+    def build_indexes(self):
+        """
+        Sorts monitoring data by parcel and date, yield history by parcel and
+        year, and records the row range of each parcel in both. Also builds
+        the date order of monitoring rows and the spatial index of parcels.
+
+        Only datasets already loaded are indexed; the others are indexed when
+        they are first accessed.
+        """
+        with self._lock:
+            self._indexed.clear()
+            for name in list(self._datasets):
+                self._index_dataset(name)
+
+    def _index_dataset(self, name):
+        frame = self._datasets.get(name)
+        self._indexed.add(name)
+        if frame is None:
+            return
+
+        if name == 'monitoring_data':
+            frame, self._index_data['parcel_index'] = build_partition_index(frame, 'parcelle_id', 'date')
+            self._index_data.pop('station_assignment', None)
+
+            # Date-sorted view of monitoring rows for fleet-wide date range queries
+            dates = frame['date'].to_numpy()
+            self._index_data['monitoring_date_order'] = np.argsort(dates, kind='stable')
+            self._index_data['monitoring_dates_sorted'] = dates[self._index_data['monitoring_date_order']]
+        elif name == 'yield_history':
+            frame, self._index_data['yield_index'] = build_partition_index(frame, 'parcelle_id', 'annee')
+        elif name == 'weather_data':
+            # Rows of each station, sorted by date, read through the station index
+            if 'station_id' in frame.columns:
+                frame, self._index_data['station_index'] = build_partition_index(frame, 'station_id', 'date')
+            else:
+                if not frame['date'].is_monotonic_increasing:
+                    frame = frame.sort_values('date', kind='stable', ignore_index=True)
+                self._index_data['station_index'] = {DEFAULT_STATION: slice(0, len(frame))}
+            self._index_data['weather_stations'] = weather_stations(frame)
+            self._index_data.pop('station_assignment', None)
+        elif name == 'soil_data':
+            # Spatial grid over parcel coordinates from the soil table
+            self._index_data['spatial_index'] = ParcelSpatialIndex(frame['parcelle_id'].to_numpy(),
+                                                                   frame['latitude'].to_numpy(),
+                                                                   frame['longitude'].to_numpy())
+            self._index_data.pop('station_assignment', None)
+        self._datasets[name] = frame
+
+    def get_parcel_monitoring(self, parcelle_id):
+        """Returns the monitoring rows of a parcel, sorted by date, through the parcel index."""
+        return self.monitoring_data.iloc[self.parcel_index.get(parcelle_id, slice(0, 0))]
+
+    def get_parcel_yield_history(self, parcelle_id):
+        """Returns the yield history of a parcel, sorted by year, through the parcel index."""
+        return self.yield_history.iloc[self.yield_index.get(parcelle_id, slice(0, 0))]
+
+    def get_parcels_in_bounds(self, bounds):
+        """
+        Returns the ids of the parcels inside ``[[south, west], [north, east]]``.
+        """
+        (south, west), (north, east) = bounds
+        positions = self.spatial_index.query_bbox(south, west, north, east)
+        return self.spatial_index.parcel_ids[positions]
+
+    def get_nearest_parcels(self, latitude, longitude, k=5):
+        """
+        Returns the ``k`` parcels closest to a point, with their distance in km.
+        """
+        positions, distances = self.spatial_index.nearest(latitude, longitude, k)
+        return pd.DataFrame({'parcelle_id': self.spatial_index.parcel_ids[positions],
+                             'distance_km': distances})
+
+    def get_latest_observations(self, parcel_ids=None):
+        """
+        Returns the most recent monitoring row of each requested parcel (all by default).
+
+        Uses the last row of each parcel's index entry, without scanning the monitoring rows.
+        """
+        if parcel_ids is None:
+            parcel_ids = self.parcel_index.keys()
+        index = self.parcel_index
+        rows = [index[pid].stop - 1 if isinstance(index[pid], slice) else index[pid][-1]
+                for pid in parcel_ids if pid in index]
+        return self.monitoring_data.iloc[rows]
+
+    def get_monitoring_window(self, parcelle_id=None, start=None, end=None):
+        """
+        Returns the monitoring rows dated within ``[start, end]``.
+
+        For a single parcel the window is located by binary search inside the
+        parcel's date-sorted rows and returned as a slice. Without a parcel the
+        global date order built at load time is searched instead.
+        """
+        if parcelle_id is not None:
+            rows = self.parcel_index.get(parcelle_id, slice(0, 0))
+            dates = self.monitoring_data['date'].to_numpy()[rows]
+            lo, hi = date_bounds(dates, start, end)
+            if isinstance(rows, slice):
+                return self.monitoring_data.iloc[rows.start + lo:rows.start + hi]
+            return self.monitoring_data.iloc[rows[lo:hi]]
+
+        lo, hi = date_bounds(self.monitoring_dates_sorted, start, end)
+        return self.monitoring_data.iloc[self.monitoring_date_order[lo:hi]]
+
+    def get_weather_window(self, start=None, end=None, station_id=None):
+        """
+        Returns the weather rows dated within ``[start, end]`` by binary search.
+
+        Hourly readings are returned when loaded, daily aggregates otherwise
+        (of ``station_id``, or averaged over the stations). With several
+        stations, the window is searched in each station's rows (or only
+        ``station_id``'s) and the rows are returned in date order.
+        """
+        if self.weather_data is None:
+            weather = self.get_daily_weather()
+            if station_id is not None:
+                daily, partitions = self._station_daily_index()
+                weather = daily.iloc[partitions.get(station_id, slice(0, 0))]
+            lo, hi = date_bounds(weather['date'].to_numpy(), start, end)
+            return weather.iloc[lo:hi]
+
+        weather = self.weather_data
+        dates = weather['date'].to_numpy()
+        partitions = self.station_index
+        if station_id is not None:
+            partitions = {station_id: partitions.get(station_id, slice(0, 0))}
+        positions = []
+        for rows in partitions.values():
+            lo, hi = date_bounds(dates[rows], start, end)
+            if len(partitions) == 1 and isinstance(rows, slice):
+                return weather.iloc[rows.start + lo:rows.start + hi]
+            positions.append(np.arange(rows.start + lo, rows.start + hi) if isinstance(rows, slice)
+                             else rows[lo:hi])
+        positions = np.concatenate(positions) if positions else np.empty(0, dtype=np.int64)
+        return weather.iloc[positions[np.argsort(dates[positions], kind='stable')]]
+
+    def get_weather_stations(self):
+        """Returns one row per weather station: 'station_id', 'latitude', 'longitude'."""
+        self._get_dataset('weather_data')
+        stations = self._index_data.get('weather_stations')
+        if stations is None:
+            daily = self.get_station_daily_weather()
+            stations = weather_stations(daily if 'station_id' in daily.columns else None)
+        return stations
+
+    @instrumented
+    def get_station_assignment(self):
+        """
+        Returns the weather stations of each parcel of ``sols.csv`` with their
+        weights (see ``weather_stations.assign_stations``). Monitored parcels
+        missing from ``sols.csv`` have no coordinates and are placed at the
+        mean parcel location. Computed once, and again only when the soil
+        table, the monitored parcels or the stations change.
+        """
+        with self._lock:
+            monitored = np.array([str(pid) for pid in self.parcel_index], dtype=object)
+            key = (self.station_join, self.station_neighbours, len(monitored))
+            cached = self._index_data.get('station_assignment')
+            if cached is None or cached[0] != key:
+                soil = self.soil_data.drop_duplicates('parcelle_id')
+                parcel_ids = soil['parcelle_id'].astype(str).to_numpy(dtype=object)
+                missing = monitored[~np.isin(monitored, parcel_ids)]
+                unplaced = np.full(len(missing), np.nan)
+                latitudes = np.concatenate((soil['latitude'].to_numpy(dtype=np.float64), unplaced))
+                longitudes = np.concatenate((soil['longitude'].to_numpy(dtype=np.float64), unplaced))
+                assignment = assign_stations(np.concatenate((parcel_ids, missing)), latitudes, longitudes,
+                                             self.get_weather_stations(), self.station_join,
+                                             self.station_neighbours)
+                cached = self._index_data['station_assignment'] = (key, assignment)
+            return cached[1]
+
+    def get_parcel_station(self, parcelle_id):
+        """Returns the nearest weather station of a parcel (rank 0 of ``get_station_assignment``)."""
+        assignment = self.get_station_assignment()
+        nearest = assignment['station_id'][(assignment['rang'] == 0)
+                                           & (assignment['parcelle_id'] == str(parcelle_id))]
+        return nearest.iloc[0] if len(nearest) else None
+
+    def subscribe(self, callback):
+        """
+        Registers ``callback(monitoring=None, weather=None)``, called with each appended batch.
+
+        Live dashboards use it to stream the new rows to their sources.
+        """
+        self._listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        """Stops calling ``callback`` for appended batches."""
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def _notify(self, **batch):
+        for callback in list(self._listeners):
+            callback(**batch)
+
+    @instrumented
+    def append_monitoring(self, observations):
+        """
+        Appends a batch of new monitoring rows without reloading or re-indexing the history.
+
+        The rows are added at the end of ``monitoring_data``. Only the index
+        entries, latest observations, NDVI trend state, risk indicators and
+        aggregates of the parcels and days in the batch are updated, and the
+        new observations are scored by the anomaly detector.
+        Observations older than a parcel's last one are accepted; that
+        parcel's entries are then re-sorted.
+        """
+        with self._lock:
+            frame = self.monitoring_data
+            batch = observations.reindex(columns=frame.columns)
+            batch['date'] = pd.to_datetime(batch['date'])
+            batch = batch.sort_values(['parcelle_id', 'date'], kind='stable', ignore_index=True)
+            if self.compact:
+                batch = compact_frame(batch)
+            if batch.empty:
+                return
+
+            start = len(frame)
+            frame = append_rows(frame, batch)
+            self._datasets['monitoring_data'] = frame
+            dates = frame['date'].to_numpy()
+            ndvi = frame['ndvi'].to_numpy(dtype=float)
+
+            # Parcel index and NDVI trends, parcel by parcel of the batch
+            index = self._index_data['parcel_index']
+            trends = self.ndvi_trends
+            for parcelle_id, rows in batch.groupby('parcelle_id', sort=False, observed=True).indices.items():
+                positions = start + rows
+                previous = index.get(parcelle_id)
+                if previous is None:
+                    index[parcelle_id] = slice(int(positions[0]), int(positions[-1]) + 1)
+                    merged, in_order = positions, True
+                else:
+                    previous = index_positions(previous)
+                    merged = np.concatenate((previous, positions))
+                    in_order = dates[previous[-1]] <= dates[positions[0]]
+                    if not in_order:
+                        merged = merged[np.argsort(dates[merged], kind='stable')]
+                    index[parcelle_id] = merged
+
+                if trends is not None:
+                    if in_order:
+                        trends.append(parcelle_id, dates[positions], ndvi[positions])
+                    else:
+                        trends.reset_parcel(parcelle_id, dates[merged], ndvi[merged])
+
+            # Global date order: the batch dates are inserted by binary search
+            order = np.argsort(dates[start:], kind='stable')
+            new_dates = dates[start:][order]
+            insert_at = np.searchsorted(self._index_data['monitoring_dates_sorted'], new_dates, side='right')
+            self._index_data['monitoring_date_order'] = np.insert(
+                self._index_data['monitoring_date_order'], insert_at, start + order)
+            self._index_data['monitoring_dates_sorted'] = np.insert(
+                self._index_data['monitoring_dates_sorted'], insert_at, new_dates)
+
+            # Latest observation of the parcels in the batch
+            touched = list(batch['parcelle_id'].unique())
+            if self._parcels_data is not None:
+                parcels = self._parcels_data
+                replaced = parcels['parcelle_id'].isin(touched)
+                extra = [column for column in parcels.columns if column not in frame.columns]
+                latest = self.get_latest_observations(touched).reset_index(drop=True)
+                latest = latest.merge(parcels.loc[replaced, ['parcelle_id'] + extra], on='parcelle_id', how='left')
+                self._parcels_data = pd.concat([parcels[~replaced], latest], ignore_index=True)
+
+            if self.risk_state is not None:
+                self._refresh_risk(touched, batch['date'].min().normalize())
+            if self.anomaly_detector is not None:
+                self._score_anomalies(batch)
+            if self.feature_store is not None:
+                self.feature_store.update(monitoring=batch, assignment=self.get_station_assignment())
+            self.season_features = None
+            self._revision += 1
+
+        self._notify(monitoring=batch)
+
+    @instrumented
+    def append_weather(self, readings):
+        """
+        Appends a batch of new weather readings without reloading the history.
+
+        Hourly readings are added to ``weather_data`` and to the station index;
+        only the days they cover are re-aggregated in the daily weather (fleet
+        and per station), the feature store and the risk indicators. Without
+        hourly data in memory (streaming mode), each batch must hold complete days.
+        """
+        with self._lock:
+            batch = readings.copy()
+            batch['date'] = pd.to_datetime(batch['date'])
+            batch = batch.sort_values('date', kind='stable', ignore_index=True)
+            if batch.empty:
+                return
+
+            hourly = self.weather_data if self._datasets.get('weather_data') is not None else None
+            days = np.unique(batch['date'].to_numpy().astype('datetime64[D]'))
+            first_day, next_day = pd.Timestamp(days[0]), pd.Timestamp(days[-1]) + pd.Timedelta(days=1)
+            if hourly is not None:
+                start = len(hourly)
+                hourly = append_rows(hourly, compact_frame(batch) if self.compact else batch)
+                self._datasets['weather_data'] = hourly
+                self._extend_station_index(hourly, start)
+
+                # Re-aggregate the covered days from all their hourly readings
+                covered = self.get_weather_window(first_day, next_day - pd.Timedelta(1))
+            else:
+                covered = batch
+            covered_days = pd.DatetimeIndex(days)
+            daily = aggregate_daily_weather([covered])
+            daily = daily[daily['date'].isin(covered_days)].reset_index(drop=True)
+            station_daily = aggregate_daily_weather([covered], by_station=True)
+            if 'station_id' not in station_daily.columns:
+                station_daily.insert(0, 'station_id', DEFAULT_STATION)
+            station_daily = station_daily[station_daily['date'].isin(covered_days)].reset_index(drop=True)
+
+            if self.station_daily_weather is not None or hourly is None:
+                # Only the covered days of the stations in the batch are replaced
+                stored = self.get_station_daily_weather()
+                replaced = (stored['date'].isin(covered_days)
+                            & stored['station_id'].isin(station_daily['station_id']))
+                self.station_daily_weather = pd.concat([stored[~replaced], station_daily],
+                                                       ignore_index=True).sort_values(
+                    ['station_id', 'date'], kind='stable', ignore_index=True)
+            if self.daily_weather is not None:
+                kept = self.daily_weather[~self.daily_weather['date'].isin(daily['date'])]
+                self.daily_weather = pd.concat([kept, daily], ignore_index=True).sort_values(
+                    'date', kind='stable', ignore_index=True)
+
+            if self.risk_state is not None:
+                self._refresh_risk(None, first_day)
+            if self.feature_store is not None:
+                self.feature_store.update(daily_weather=station_daily,
+                                          assignment=self.get_station_assignment())
+            self.season_features = None
+            self._revision += 1
+
+        self._notify(weather=batch)
+
+    def _extend_station_index(self, frame, start):
+        """
+        Adds the weather rows appended from position ``start`` to the station index.
+
+        A station's entry stays a slice while its new readings directly follow
+        its rows, and otherwise becomes the array of its positions, re-sorted
+        only when the new readings are older than its last one. New stations are
+        added to the station list and the parcels' stations are reassigned.
+        """
+        index = self._index_data['station_index']
+        dates = frame['date'].to_numpy()
+        added = frame.iloc[start:]
+        if 'station_id' in frame.columns:
+            groups = added.groupby('station_id', sort=False, observed=True).indices
+        else:
+            groups = {DEFAULT_STATION: np.arange(len(added))}
+
+        new_stations = [station for station in groups if station not in index]
+        for station, rows in groups.items():
+            positions = start + rows
+            previous = index.get(station)
+            contiguous = positions[-1] - positions[0] + 1 == len(positions)
+            if previous is None:
+                index[station] = slice(int(positions[0]), int(positions[-1]) + 1) if contiguous else positions
+                continue
+            if (isinstance(previous, slice) and previous.stop == positions[0] and contiguous
+                    and dates[previous.stop - 1] <= dates[positions[0]]):
+                # Readings following the station's last rows in the frame keep it a slice
+                index[station] = slice(previous.start, int(positions[-1]) + 1)
+                continue
+            previous = index_positions(previous)
+            merged = np.concatenate((previous, positions))
+            if dates[previous[-1]] > dates[positions[0]]:
+                merged = merged[np.argsort(dates[merged], kind='stable')]
+            index[station] = merged
+
+        if new_stations:
+            known = self._index_data.get('weather_stations')
+            self._index_data['weather_stations'] = weather_stations(
+                pd.concat([known, added[added['station_id'].isin(new_stations)]], ignore_index=True))
+            self._index_data.pop('station_assignment', None)
+
+    @instrumented
+    def get_ndvi_trends(self):
+        """
+        Returns the NDVI trend metrics of ``get_all_temporal_trends`` (7-observation
+        rolling mean), kept up to date by ``append_monitoring`` instead of recomputed.
+        """
+        with self._lock:
+            if self.ndvi_trends is None:
+                state = NdviTrendState(window=7)
+                dates = self.monitoring_data['date'].to_numpy()
+                ndvi = self.monitoring_data['ndvi'].to_numpy(dtype=float)
+                for parcelle_id, rows in self.parcel_index.items():
+                    state.reset_parcel(parcelle_id, dates[rows], ndvi[rows])
+                self.ndvi_trends = state
+            return self.ndvi_trends.to_frame()
+
+    @instrumented
+    def get_risk_state(self):
+        """
+        Returns the daily risk indicators of every monitored parcel, computed
+        once by ``calculate_risk_metrics`` then kept up to date by the append
+        methods.
         """
+        with self._lock:
+            if self.risk_state is None:
+                self.risk_state = RiskState()
+                self.risk_state.reset(self.calculate_risk_metrics(self._risk_inputs()))
+            return self.risk_state
+
+    @instrumented
+    def get_anomaly_detector(self):
+        """
+        Returns the online anomaly detector of the monitoring measures.
+
+        Its state is saved in the cache directory after each update, with the
+        signature of the monitoring file it was built from, and reloaded by
+        later runs, which only score the observations dated after the last one
+        seen for each parcel. A state whose file was edited or replaced,
+        rather than only extended, is discarded.
+        """
+        with self._lock:
+            if self.anomaly_detector is None:
+                detector, source = None, None
+                if self.use_cache:
+                    detector = AnomalyDetector.load(self._anomaly_state_path())
+                    if detector is not None and detector.source is not None:
+                        source = self._anomaly_source(detector.source)
+                    if source is None:
+                        detector, source = None, self._anomaly_source()
+                self.anomaly_detector = detector or AnomalyDetector()
+                self.anomaly_detector.source = source
+                if self.monitoring_data is not None:
+                    self._score_anomalies(self.monitoring_data)
+            return self.anomaly_detector
+
+    def _anomaly_state_path(self):
+        return os.path.join(self.cache_dir, 'anomalies.npz')
+
+    def _anomaly_source(self, saved=None):
+        """
+        Returns the signature of the monitoring file ('mtime_ns', 'size',
+        'sha256'), or None if ``saved`` (the signature stored with a
+        detector state) does not describe the file or its beginning.
+        """
+        path = os.path.join(self.data_dir, DATASET_FILES['monitoring_data'][0])
         try:
-            self.monitoring_data = pd.read_csv('data/monitoring_cultures.csv', parse_dates=['date'])
-            self.weather_data = pd.read_csv('data/meteo_detaillee.csv', parse_dates=['date'])
-            self.soil_data = pd.read_csv('data/sols.csv')
-            self.yield_history = pd.read_csv('data/historique_rendements.csv')
-            self.parcels_data = self.monitoring_data.copy()  # Reuse monitoring data for parcels
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return {} if saved is None else None
+        current = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+        if saved is not None:
+            if not saved or saved.get('size', -1) > stat.st_size:
+                return None
+            if saved.get('mtime_ns') == stat.st_mtime_ns and saved.get('size') == stat.st_size:
+                return dict(current, sha256=saved.get('sha256'))
+            # Rows appended to the file keep its first bytes: the state still applies
+            if file_digest(path, limit=saved['size']) != saved.get('sha256'):
+                return None
+        return dict(current, sha256=file_digest(path))
+
+    def _score_anomalies(self, observations):
+        """Scores the observations not yet seen by the anomaly detector and saves its state."""
+        columns = ['parcelle_id', 'date', 'culture'] + ANOMALY_MEASURES
+        observations = observations[columns].astype({'parcelle_id': str, 'culture': str})
+        new = self.anomaly_detector.new_observations(observations)
+        if new.empty:
+            return None
+        scores = self.anomaly_detector.update(new)
+        if self.use_cache:
+            try:
+                self.anomaly_detector.save(self._anomaly_state_path())
+            except OSError as e:
+                print(f"Error saving anomaly state: {e}")
+        return scores
+
+    @instrumented
+    def get_parcel_anomalies(self):
+        """
+        Returns the parcels whose latest observation is anomalous, with their
+        coordinates; see ``AnomalyDetector.flagged``.
+        """
+        flagged = self.get_anomaly_detector().flagged()
+        soil = self.soil_data[['parcelle_id', 'latitude', 'longitude']].astype({'parcelle_id': str})
+        return flagged.merge(soil, on='parcelle_id', how='left')
+
+    @instrumented
+    def get_risk_indicators(self, parcel_ids=None):
+        """
+        Returns the daily risk indicators of ``calculate_risk_metrics`` for each
+        monitored day of ``parcel_ids`` (all parcels by default).
+        """
+        return self.calculate_risk_metrics(self._risk_inputs(parcel_ids))
+
+    def _risk_inputs(self, parcel_ids=None, start=None):
+        """
+        Builds the daily inputs of the risk indicators: each monitored parcel-day
+        (from ``start``) with its mean water stress, the day's weather at the
+        parcel's stations and the parcel's soil retention and latitude. Days
+        without weather are left out.
+        """
+        monitoring = self.get_monitoring_window(start=start)
+        if parcel_ids is not None:
+            monitoring = monitoring[monitoring['parcelle_id'].isin(parcel_ids)]
+        stress = (monitoring.assign(date=monitoring['date'].dt.normalize())
+                  .groupby(['parcelle_id', 'date'], observed=True)['stress_hydrique'].mean()
+                  .reset_index())
+        stress['parcelle_id'] = stress['parcelle_id'].astype(str)
+
+        columns = ['temperature', 'temperature_min', 'temperature_max', 'precipitation']
+        daily, partitions = self._station_daily_index()
+        weather = join_station_weather(stress, daily, partitions, self.get_station_assignment(),
+                                       exact_day=True)[columns]
+        stress = pd.concat([stress, weather], axis=1)[weather.notna().any(axis=1).to_numpy()]
+        soil = self.soil_data[['parcelle_id', 'capacite_retention_eau', 'latitude']].astype(
+            {'parcelle_id': str})
+        return stress.reset_index(drop=True).merge(soil, on='parcelle_id', how='left')
+
+    def _station_daily_index(self):
+        """
+        Returns the per-station daily weather sorted by station then date and
+        the slice of each station, built once until the daily table changes.
+        """
+        daily = self.get_station_daily_weather()
+        cached = self._index_data.get('station_daily_index')
+        if cached is None or cached[0] is not daily:
+            cached = self._index_data['station_daily_index'] = (
+                daily, *build_partition_index(daily, 'station_id', 'date'))
+        return cached[1], cached[2]
+
+    def _refresh_risk(self, parcel_ids, first_day, window=30):
+        """
+        Recomputes the risk indicators of ``parcel_ids`` (all parcels if None)
+        from ``first_day`` onward. The ``window`` days before it are read
+        again for the rolling deficit, and degree days continue from the
+        stored ones.
+        """
+        context = first_day - pd.Timedelta(days=window)
+        carry = self.risk_state.carry(context)
+        indicators = self.calculate_risk_metrics(self._risk_inputs(parcel_ids, context), window, carry)
+        self.risk_state.replace(indicators[indicators['date'] >= first_day], first_day)
+
+    def _read_dataset(self, filename, parse_dates=None):
+        """
+        Reads one CSV from the data directory, going through the binary cache when enabled.
+        """
+        path = os.path.join(self.data_dir, filename)
+        return self._cached(path, os.path.splitext(filename)[0],
+                            lambda: pd.read_csv(path, parse_dates=parse_dates))
+
+    def _cached(self, path, name, build):
+        """
+        Builds a frame derived from ``path``, applying the compact schema if
+        enabled, and caches it under ``name`` when caching is on.
+        """
+        if self.compact:
+            name, build = f"{name}_compact", (lambda read=build: compact_frame(read()))
+        if not self.use_cache:
+            return build()
+        return load_cached_frame(path, self.cache_dir, name, build)
+
+    @instrumented
+    def load_daily_weather(self, by_station=False):
+        """
+        Streams the hourly weather file in chunks and returns its daily aggregates.
+
+        Columns: min/max/mean temperature, mean humidity, precipitation and
+        solar radiation sums, and maximum wind speed, one row per day (and
+        per station with ``by_station``, if readings carry a 'station_id').
+        """
+        path = os.path.join(self.data_dir, 'meteo_detaillee.csv')
+        columns = {'date', 'station_id', 'latitude', 'longitude', 'temperature', 'humidite', 'precipitation',
+                   'rayonnement_solaire', 'vitesse_vent'}
+
+        def build():
+            chunks = pd.read_csv(path, parse_dates=['date'], chunksize=self.weather_chunksize,
+                                 usecols=lambda column: column in columns)
+            return aggregate_daily_weather(chunks, by_station=by_station)
+
+        return self._cached(path, 'meteo_journaliere_stations' if by_station else 'meteo_journaliere', build)
+
+    def get_daily_weather(self):
+        """
+        Returns the daily weather aggregates, computing them on first use.
+
+        Hourly weather already in memory is aggregated directly; otherwise the
+        file is streamed without loading the hourly rows.
+        """
+        if self.daily_weather is None:
+            hourly = self._datasets.get('weather_data')
+            if hourly is not None:
+                self.daily_weather = aggregate_daily_weather([hourly])
+            else:
+                self.daily_weather = self.load_daily_weather()
+        return self.daily_weather
+
+    def get_station_daily_weather(self):
+        """
+        Returns the daily weather aggregates of each station, sorted by
+        station then date, with a 'station_id' column (``DEFAULT_STATION``
+        for a single-series weather file).
+        """
+        if self.station_daily_weather is None:
+            hourly = self._datasets.get('weather_data')
+            if hourly is not None:
+                daily = aggregate_daily_weather([hourly], by_station=True)
+            else:
+                daily = self.load_daily_weather(by_station=True)
+            if 'station_id' not in daily.columns:
+                daily.insert(0, 'station_id', DEFAULT_STATION)
+            self.station_daily_weather = daily
+        return self.station_daily_weather
+
+    @instrumented
+    def get_feature_store(self):
+        """
+        Returns the materialized daily/weekly/monthly/season aggregates.
+
+        The store is built once from the monitoring rows and the daily weather
+        of each station, saved in the cache directory and reloaded as long as
+        the source CSV files are unchanged. Parcels get the weather of their
+        stations (see ``get_station_assignment``).
+        """
+        with self._lock:
+            if self.feature_store is None:
+                directory = os.path.join(self.cache_dir, 'agregats') if self.use_cache else None
+                store = FeatureStore(directory)
+                signature = self._feature_store_signature()
+                if not store.load(signature):
+                    store.build(self.monitoring_data, self.get_station_daily_weather())
+                    store.save(signature)
+                store.update(assignment=self.get_station_assignment())
+                self.feature_store = store
+            return self.feature_store
+
+    def _feature_store_signature(self):
+        """Identifies the source files of the feature store by modification time and size."""
+        return self._source_signature(['monitoring_data', 'weather_data'])
+
+    def _source_signature(self, names=None):
+        """
+        Identifies source files by modification time and size (None for a
+        missing file), for all datasets by default.
+        """
+        signature = {}
+        for name in names or DATASET_FILES:
+            path = os.path.join(self.data_dir, DATASET_FILES[name][0])
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                signature[name] = None
+                continue
+            signature[name] = [stat.st_mtime_ns, stat.st_size]
+        return signature
 
-            # Add 'predicted_yield' if missing
-            if 'predicted_yield' not in self.parcels_data.columns:
-                self.parcels_data['predicted_yield'] = np.random.uniform(5, 12, len(self.parcels_data))
+    def _dataset_signature(self):
+        """
+        Identifies the data the season features are computed from: the
+        source files, the options shaping the features, and the in-memory
+        changes made since the files were read.
+        """
+        return {
+            'sources': self._source_signature(),
+            'compact': self.compact,
+            'stations': [self.station_join, self.station_neighbours],
+            'revision': self._revision,
+        }
 
-            # Add 'crop_name' if missing
-            if 'crop_name' not in self.parcels_data.columns:
-                self.parcels_data['crop_name'] = ['Crop ' + str(i % 3 + 1) for i in range(len(self.parcels_data))]
+    def memory_report(self):
+        """
+        Reports the memory footprint of each dataset with the default and the compact schema.
 
-        except FileNotFoundError as e:
-            print(f"Error loading datasets: {e}")
-            self.monitoring_data = None
-            self.weather_data = None
-            self.soil_data = None
-            self.yield_history = None
-            self.parcels_data = None
+        ``parcels_data`` is compared with the full monitoring copy it used to be.
+        """
+        datasets = {name: getattr(self, name) for name in DATASET_FILES}
+        datasets['daily_weather'] = self.daily_weather
+        rows = []
+        for name, frame in datasets.items():
+            if frame is None:
+                continue
+            rows.append({'dataset': name, 'lignes': len(frame),
+                         'defaut_octets': expand_frame(frame).memory_usage(deep=True).sum(),
+                         'compact_octets': compact_frame(frame).memory_usage(deep=True).sum()})
 
+        if self.monitoring_data is not None:
+            full_copy = self.monitoring_data.assign(predicted_yield=0.0, crop_name='Crop 1')
+            rows.append({'dataset': 'parcels_data', 'lignes': len(self.parcels_data),
+                         'defaut_octets': expand_frame(full_copy).memory_usage(deep=True).sum(),
+                         'compact_octets': compact_frame(self.parcels_data).memory_usage(deep=True).sum()})
 
+        report = pd.DataFrame(rows, columns=['dataset', 'lignes', 'defaut_octets', 'compact_octets'])
+        report['reduction'] = 1 - report['compact_octets'] / report['defaut_octets']
+        return report
+
+    @instrumented
+    def prepare_features(self, daily_weather=None):
+        """
+        Prepares data by merging monitoring, weather, and soil datasets.
+
+        Each monitoring row gets the weather of its parcel's station(s), see
+        ``get_station_assignment``: the latest hourly reading at or before
+        it, or with ``daily_weather=True`` the aggregates of its whole day. By
+        default the daily join is used only when hourly weather is not loaded.
+        Weather is read from per-station partitions sorted once at load time.
+        """
+        if daily_weather is None:
+            daily_weather = self.weather_data is None
 
+        # Monitoring rows in date order, from the order built at load time
+        monitoring = self.monitoring_data.iloc[self.monitoring_date_order].reset_index(drop=True)
+        assignment = self.get_station_assignment()
 
-    def prepare_features(self):
-        """Prepares data by merging monitoring, weather, and soil datasets."""
-        # Merge monitoring and weather data
-        merged_data = pd.merge_asof(
-            self.monitoring_data.sort_values('date'),
-            self.weather_data.sort_values('date'),
-            on='date',
-        )
+        with stage('jointure_stations') as measured:
+            if daily_weather:
+                # Join each monitoring day with the aggregates of the same day at the parcel's stations
+                weather, partitions = self._station_daily_index()
+                joined = join_station_weather(monitoring, weather, partitions, assignment, exact_day=True)
+            else:
+                # Latest hourly reading at or before each observation, from the station partitions
+                partitions = self.station_index
+                joined = join_station_weather(monitoring, self.weather_data, partitions, assignment)
+            measured.rows = len(joined)
+        if list(partitions) == [DEFAULT_STATION]:
+            joined = joined.drop(columns='station_id', errors='ignore')
+        merged_data = pd.concat([monitoring, joined.drop(columns=[c for c in joined.columns
+                                                                  if c in monitoring.columns])], axis=1)
 
         # Merge soil data
         merged_data = merged_data.merge(self.soil_data, on='parcelle_id', how='left')
@@ -66,15 +1151,16 @@ class AgriculturalDataManager:
 
         return merged_data
 
+    @instrumented
     def enrich_with_yield_history(self, data):
         """Enriches the data with historical yields."""
         enriched_data = data.merge(self.yield_history, on=['parcelle_id', 'annee'], how='left')
         return enriched_data
 
+    @instrumented
     def get_temporal_patterns(self, parcelle_id):
         """Analyzes temporal patterns for a specific parcelle_id."""
-        parcelle_data = self.monitoring_data[self.monitoring_data['parcelle_id'] == parcelle_id]
-        parcelle_data.set_index('date', inplace=True)
+        parcelle_data = self.get_parcel_monitoring(parcelle_id).set_index('date')
 
         # Compute a rolling mean for NDVI as an example
         parcelle_data['ndvi_rolling'] = parcelle_data['ndvi'].rolling(window=7, min_periods=1).mean()
@@ -94,28 +1180,420 @@ class AgriculturalDataManager:
         trend = {'pente': slope, 'variation_moyenne': variation_mean}
         return parcelle_data, trend
 
-    def calculate_risk_metrics(self, data):
-        """Calculates risk metrics based on weather and soil data."""
-        data['drought_risk'] = data['precipitation'] < 10
-        data['heat_risk'] = data['temperature'] > 35
-        return data
+    @instrumented
+    def get_all_temporal_trends(self, window=7):
+        """
+        Computes NDVI trend metrics for every parcel in a single vectorized pass.
+
+        Returns one row per parcel with the number of observations, the date and
+        value of the last ``window``-observation rolling mean, and the same
+        'pente' / 'variation_moyenne' metrics as ``get_temporal_patterns``. The
+        slope is obtained from closed-form least-squares sums instead of one
+        ``np.polyfit`` per parcel. Rows are read parcel by parcel from the
+        date-sorted partitions of ``parcel_index``, without sorting the frame.
+        """
+        index = self.parcel_index
+        parcels = sorted(index)
+        rows = [index_positions(index[pid]) for pid in parcels]
+        order = np.concatenate(rows).astype(np.int64) if rows else np.empty(0, dtype=np.int64)
+        counts = np.array([len(positions) for positions in rows], dtype=np.int64)
+        n_parcels = len(parcels)
+        codes = np.repeat(np.arange(n_parcels), counts)
+        dates = self.monitoring_data['date'].to_numpy()
+        y = self.monitoring_data['ndvi'].to_numpy(dtype=float)[order]
+
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        ends = starts + counts
+
+        # Position of each observation within its parcel, as in get_temporal_patterns
+        x = np.arange(len(codes)) - starts[codes]
+
+        # Closed-form least squares: slope = (n.Sxy - Sx.Sy) / (n.Sxx - Sx^2)
+        sum_x = np.bincount(codes, weights=x, minlength=n_parcels)
+        sum_y = np.bincount(codes, weights=y, minlength=n_parcels)
+        sum_xx = np.bincount(codes, weights=x * x, minlength=n_parcels)
+        sum_xy = np.bincount(codes, weights=x * y, minlength=n_parcels)
+        denominator = counts * sum_xx - sum_x ** 2
+        enough = counts > 1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = np.where(enough & (denominator != 0),
+                             (counts * sum_xy - sum_x * sum_y) / denominator, 0.0)
+            mean = np.where(enough, sum_y / counts, 0.0)
+
+        # Rolling mean over the last `window` observations, from prefix sums
+        cumulative = np.concatenate(([0.0], np.cumsum(y)))
+        last = ends - 1
+        first = np.maximum(starts, ends - window)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rolling = (cumulative[ends] - cumulative[first]) / (ends - first)
+
+        last_dates = dates[order[np.maximum(last, 0)]] if len(codes) else dates[:0]
+        return pd.DataFrame({
+            'parcelle_id': np.array(parcels, dtype=object),
+            'nb_observations': counts,
+            'derniere_date': last_dates,
+            'ndvi_rolling': rolling,
+            'pente': slope,
+            'variation_moyenne': mean,
+        })
 
+    @instrumented
+    def calculate_risk_metrics(self, data, window=30, carry=None):
+        """
+        Calculates daily risk indicators per parcel from weather and soil data.
+
+        Returns a new frame (``data`` is left unchanged) with the rolling
+        precipitation deficit, consecutive heat days, growing degree days,
+        soil-adjusted water stress, drought/heat flags and a 'risk_score' in
+        [0, 1]; see ``risk_engine.compute_risk_indicators``.
+        """
+        return compute_risk_indicators(data, window=window, carry=carry)
+
+    @instrumented
+    def get_parcel_risk_scores(self, features=None):
+        """
+        Returns one row per parcel with its coordinates and a risk score in [0, 1].
+
+        The score is the mean daily 'risk_score' of ``calculate_risk_metrics``
+        over the parcel's monitoring days. By default it comes from the
+        indicators kept by ``get_risk_state``.
+        """
+        if features is None:
+            scores = self.get_risk_state().scores()
+        else:
+            scores = parcel_risk_scores(self.calculate_risk_metrics(features))
+        return self.soil_data[['parcelle_id', 'latitude', 'longitude']].merge(scores, on='parcelle_id')
+
+    @instrumented
+    def simulate_climate_scenarios(self, n_scenarios=1000, parcel_ids=None, seed=0,
+                                   memory_budget=DEFAULT_MEMORY_BUDGET, max_workers=1, **options):
+        """
+        Simulates the latest season of ``parcel_ids`` (all parcels by default)
+        under ``n_scenarios`` weather scenarios drawn from the daily weather
+        history; see ``climate_scenarios.simulate_scenarios`` for ``options``.
+
+        The season is the calendar year of the latest monitoring day. Scenarios
+        are drawn at every weather station and each parcel gets the weather of
+        its stations (see ``get_station_assignment``). Each scenario goes
+        through the risk indicators (with the observed water stress) and the
+        yield model (with its weather features moved).
+        Returns the per-parcel indicator percentiles, with the simulated
+        season's 'annee', and the daily risk bands.
+        """
+        if parcel_ids is None:
+            parcel_ids = list(self.parcel_index)
+        parcel_ids = pd.Index([str(pid) for pid in parcel_ids])
+        season = self._scenario_season()
+        parcels = self._scenario_parcels(parcel_ids, season)
+
+        yield_inputs = None
+        if season['yield_model'] is not None:
+            current = season['yield_seasons'].reindex(parcel_ids).reset_index()
+            # Weather features of the observed season at each parcel's stations
+            observed = parcel_weather(season['observed'][:, :, None, :], parcels['stations'], parcels['weights'])
+            yield_inputs = dict(season['yield_inputs'], design=season['yield_model'].design_matrix(current),
+                                reference=season_aggregates(observed[:, 0]))
+
+        summary, bands = simulate_scenarios(season['history'], season['dates'], parcels, n_scenarios=n_scenarios,
+                                            seed=seed, yield_inputs=yield_inputs, memory_budget=memory_budget,
+                                            max_workers=max_workers, **options)
+        summary.insert(1, 'annee', season['year'])
+        return summary, bands
+
+    def _scenario_season(self):
+        """
+        Returns the inputs of the scenarios shared by all parcels, computed
+        once per dataset signature (see ``_dataset_signature``): the season's
+        'year' and 'dates', the weather 'history' of the 'stations', the
+        soil table, and the yield model with the season rows of every parcel,
+        so a call for a few parcels does not go over the whole fleet again.
+        """
+        with self._lock:
+            signature = self._dataset_signature()
+            if self._scenario_inputs is None or self._scenario_inputs[0] != signature:
+                year = pd.Timestamp(self.monitoring_dates_sorted[-1]).year
+                dates = pd.date_range(f"{year}-01-01", f"{year}-12-31", freq='D')
+                daily = self.get_station_daily_weather()
+                stations = pd.Index(pd.unique(daily['station_id'].astype(str)))
+                season = {
+                    'year': year,
+                    'dates': dates,
+                    'stations': stations,
+                    'history': station_weather_history(daily.astype({'station_id': str}), stations)[0],
+                    'soil': (self.soil_data.astype({'parcelle_id': str}).drop_duplicates('parcelle_id')
+                             .set_index('parcelle_id')),
+                }
+                season.update(self._scenario_yield_inputs(daily.astype({'station_id': str}), year, dates,
+                                                          stations))
+                self._scenario_inputs = (signature, season)
+            return self._scenario_inputs[1]
+
+    def _scenario_yield_inputs(self, daily, year, dates, stations):
+        """
+        Gathers the yield model inputs of the scenarios: the 'yield_model',
+        its 'yield_seasons' in ``year`` indexed by parcel, the 'observed'
+        (variable, station, day) weather of the season, and the
+        'yield_inputs' of ``climate_scenarios.simulate_scenarios`` but the
+        parcels' design matrix and reference values. The model is None when
+        no season has a known yield to train on or the season has no weather.
+        """
+        seasons = self.get_season_features()
+        trained = seasons[seasons['rendement'].notna()]
+        season_days = daily[daily['date'].dt.year == year]
+        if trained.empty or season_days.empty:
+            reason = "no season with a known yield" if trained.empty else f"no weather in {year}"
+            print(f"Yield scenarios skipped: {reason}")
+            return {'yield_model': None, 'yield_seasons': None, 'observed': None, 'yield_inputs': None}
+
+        model = self.load_yield_model(seasons)
+        current = (seasons[seasons['annee'] == year].astype({'parcelle_id': str})
+                   .drop_duplicates('parcelle_id', keep='last').set_index('parcelle_id'))
+        observed = station_weather_history(season_days, stations)[0][:, :, 0, dates.dayofyear.to_numpy() - 1]
+        return {
+            'yield_model': model,
+            'yield_seasons': current,
+            'observed': observed,
+            'yield_inputs': {
+                'pipeline': model.pipeline,
+                'columns': {feature: model.numeric_columns.index(feature) for feature in YIELD_WEATHER_FEATURES
+                            if feature in model.numeric_columns},
+                'bounds': {feature: (trained[feature].min(), trained[feature].max())
+                           for feature in YIELD_WEATHER_FEATURES if feature in trained},
+            },
+        }
+
+    def _scenario_parcels(self, parcel_ids, season):
+        """
+        Gathers the per-parcel inputs of the scenarios: soil retention and
+        latitude, the mean observed water stress of each day (NaN when the
+        parcel was not observed), and the positions of the parcel's stations
+        in the season's 'stations' with their weights. Parcels unknown to the
+        station assignment are placed like parcels without coordinates. Only
+        the rows of ``parcel_ids`` are read, through the parcel index.
+        """
+        dates = season['dates']
+        soil = season['soil'].reindex(parcel_ids)
+        index = self.parcel_index
+        positions = [index_positions(index[pid]) for pid in parcel_ids if pid in index]
+        monitoring = self.monitoring_data.iloc[np.concatenate(positions) if positions else []]
+        monitoring = monitoring[(monitoring['date'] >= dates[0])
+                                & (monitoring['date'] < dates[-1] + pd.Timedelta(days=1))]
+
+        stress = np.full((len(parcel_ids), len(dates)), np.nan)
+        if len(monitoring):
+            rows = parcel_ids.get_indexer(monitoring['parcelle_id'].astype(str).to_numpy())
+            days = (monitoring['date'].dt.normalize() - dates[0]).dt.days.to_numpy()
+            values = monitoring['stress_hydrique'].to_numpy(dtype=np.float64)
+            valid = ~np.isnan(values)
+            cells = rows[valid] * len(dates) + days[valid]
+            totals = np.bincount(cells, weights=values[valid], minlength=stress.size)
+            counts = np.bincount(cells, minlength=stress.size)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                stress = np.where(counts > 0, totals / counts, np.nan).reshape(stress.shape)
+
+        assignment = self.get_station_assignment()
+        missing = parcel_ids.difference(assignment['parcelle_id'])
+        if len(missing):
+            unplaced = np.full(len(missing), np.nan)
+            assignment = pd.concat([assignment, assign_stations(missing.to_numpy(), unplaced, unplaced,
+                                                                self.get_weather_stations(), self.station_join,
+                                                                self.station_neighbours)], ignore_index=True)
+        assignment = assignment[assignment['parcelle_id'].isin(parcel_ids)]
+        rows = parcel_ids.get_indexer(assignment['parcelle_id'])
+        ranks = assignment['rang'].to_numpy()
+        codes = season['stations'].get_indexer(assignment['station_id'].astype(str))
+        stations = np.zeros((len(parcel_ids), int(ranks.max()) + 1 if len(ranks) else 1), dtype=np.int64)
+        weights = np.zeros(stations.shape)
+        stations[rows, ranks] = np.maximum(codes, 0)
+        weights[rows, ranks] = np.where(codes >= 0, assignment['poids'].to_numpy(), 0.0)
+
+        return {
+            'parcelle_id': parcel_ids.to_numpy(),
+            'latitude': soil['latitude'].to_numpy(dtype=np.float64),
+            'capacite_retention_eau': soil['capacite_retention_eau'].to_numpy(dtype=np.float64),
+            'stress_hydrique': stress,
+            'stations': stations,
+            'weights': weights,
+        }
+
+    @instrumented
+    def get_season_features(self):
+        """
+        Returns one row per parcel and season: aggregated monitoring and daily
+        weather, soil properties, earlier yields and the season's yield if known.
+
+        The table is computed once per dataset signature (see
+        ``_dataset_signature``) and saved in the cache directory, so later
+        calls and runs over unchanged sources do not prepare the features again.
+        """
+        with self._lock:
+            signature = self._dataset_signature()
+            if self.season_features is None or self.season_features[0] != signature:
+                seasons = self._read_season_features(signature)
+                if seasons is None:
+                    features = self.enrich_with_yield_history(self.prepare_features(daily_weather=True))
+                    seasons = season_features(features, self.yield_history)
+                    self._write_season_features(seasons, signature)
+                self.season_features = (signature, seasons)
+            return self.season_features[1]
+
+    def _season_features_dir(self):
+        return os.path.join(self.cache_dir, 'saisons_compact' if self.compact else 'saisons')
+
+    def _read_season_features(self, signature):
+        if not self.use_cache or signature['revision']:
+            return None
+        directory = self._season_features_dir()
+        meta = read_meta(directory)
+        if meta is None or meta.get('saisons') != signature:
+            return None
+        try:
+            return read_frame(directory, mmap=False, meta=meta)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_season_features(self, seasons, signature):
+        # Tables of appended data describe no file state and are only kept in memory
+        if not self.use_cache or signature['revision']:
+            return
+        try:
+            write_frame(seasons, self._season_features_dir(), signature={'saisons': signature})
+        except OSError as e:
+            print(f"Unable to write the season features: {e}")
+
+    @instrumented
+    def load_yield_model(self, seasons=None, retrain=False):
+        """
+        Returns the yield model, trained once and persisted in the cache directory.
+
+        The model is stored with the dataset signature it was validated
+        against and reused without looking at the seasons while the signature
+        is unchanged. Otherwise it is reused if the seasons it was trained on
+        are unchanged, and retrained when they differ or ``retrain`` is set.
+        """
+        name = 'modele_rendement_compact' if self.compact else 'modele_rendement'
+        path = os.path.join(self.cache_dir, f"{name}.pkl")
+        signature = self._dataset_signature()
+
+        model = None if retrain else (self.yield_model or YieldModel.load(path))
+        if model is not None and getattr(model, 'source_signature', None) != signature:
+            if seasons is None:
+                seasons = self.get_season_features()
+            if model.is_trained_on(seasons):
+                model.source_signature = signature
+                model.save(path)
+            else:
+                model = None
+
+        if model is None:
+            if seasons is None:
+                seasons = self.get_season_features()
+            model = YieldModel().fit(seasons)
+            model.source_signature = signature
+            model.save(path)
+            self._yield_predictions = None
+            self._scenario_inputs = None
+
+        self.yield_model = model
+        return model
+
+    @instrumented
+    def predict_yields(self, parcel_ids=None):
+        """
+        Predicts the yield of the latest season of ``parcel_ids`` (every parcel by default).
+
+        Predictions are kept between calls: only parcels whose season inputs
+        changed are scored again. Returns 'parcelle_id', 'annee' and
+        'predicted_yield'.
+        """
+        seasons = self.get_season_features()
+        model = self.load_yield_model(seasons)
+
+        latest = seasons.groupby('parcelle_id', observed=True)['annee'].transform('max')
+        current = seasons[seasons['annee'] == latest]
+        if parcel_ids is not None:
+            current = current[current['parcelle_id'].isin(parcel_ids)]
+        current = current.reset_index(drop=True)
+
+        predictions = model.score(current, self._yield_predictions)
+        previous = self._yield_predictions
+        if parcel_ids is not None and previous is not None:
+            kept = previous[~previous['parcelle_id'].isin(predictions['parcelle_id'])]
+            self._yield_predictions = pd.concat([kept, predictions], ignore_index=True)
+        else:
+            self._yield_predictions = predictions
+        return predictions[['parcelle_id', 'annee', 'predicted_yield']]
+
+    @instrumented
     def analyze_yield_patterns(self, parcelle_id):
         """
         Performs advanced yield pattern analysis for a specific parcelle_id.
         """
-        # Extract and prepare data
-        history = self.yield_history[self.yield_history['parcelle_id'] == parcelle_id].copy()
+        # statsmodels is only needed here, so it is not imported with the module
+        from statsmodels.tsa.seasonal import seasonal_decompose
 
-        # Ensure data is sorted by year
-        history.sort_values(by='annee', inplace=True)
+        # Extract and prepare data
+        # Rows come sorted by year from the yield index
+        history = self.get_parcel_yield_history(parcelle_id)
 
         # Apply seasonal decomposition to yield data
-        result = seasonal_decompose(history['rendement'], model='additive', period=1)
+        with stage('seasonal_decompose'):
+            result = seasonal_decompose(history['rendement'], model='additive', period=1)
 
         # Return components for analysis
         return result.trend, result.seasonal, result.resid
 
+    @instrumented
+    def analyze_all_yield_patterns(self, period=2, model='additive', rotation_aware=True, max_workers=None):
+        """
+        Decomposes the yield history of every parcel with the given ``period`` (in years).
+
+        With ``rotation_aware`` each yield is first expressed relative to the
+        fleet-wide mean yield of its crop ('rendement_ajuste'), so that crop
+        rotation is not read as trend or seasonality. Decompositions are
+        spread over a process pool of ``max_workers`` and memoized by parcel
+        and by a hash of the decomposed series: later calls only recompute
+        parcels whose history changed.
+
+        Returns one row per parcel and year with the 'tendance', 'saisonnier'
+        and 'residu' components (NaN for series shorter than two periods).
+        """
+        history = self.yield_history
+        values = history['rendement'].to_numpy(dtype=float)
+        if rotation_aware:
+            crop_means = history.groupby('culture', observed=True)['rendement'].transform('mean')
+            values = values - crop_means.to_numpy(dtype=float)
+        years = history['annee'].to_numpy()
+
+        # Only parcels whose series changed since the last call are decomposed
+        keys, pending = {}, []
+        for parcelle_id, rows in self.yield_index.items():
+            key = (parcelle_id, period, model, rotation_aware)
+            digest = history_digest(years[rows], values[rows])
+            keys[parcelle_id] = (key, digest)
+            cached = self._decompositions.get(key)
+            if cached is None or cached[0] != digest:
+                pending.append((key, values[rows]))
+
+        with stage('seasonal_decompose') as measured:
+            measured.rows = len(pending)
+            decomposed = decompose_many(pending, period, model, max_workers)
+        for key, components in decomposed.items():
+            self._decompositions[key] = (keys[key[0]][1], components)
+
+        trend, seasonal, resid = (np.full(len(history), np.nan) for _ in range(3))
+        for parcelle_id, rows in self.yield_index.items():
+            parcel_trend, parcel_seasonal, parcel_resid = self._decompositions[keys[parcelle_id][0]][1]
+            trend[rows], seasonal[rows], resid[rows] = parcel_trend, parcel_seasonal, parcel_resid
+
+        result = history[['parcelle_id', 'annee', 'culture', 'rendement']].copy()
+        if rotation_aware:
+            result['rendement_ajuste'] = values
+        result['tendance'] = trend
+        result['saisonnier'] = seasonal
+        result['residu'] = resid
+        return result
+
 if __name__ == "__main__":
     # Initialize the data manager
     data_manager = AgriculturalDataManager()
@@ -146,6 +1624,12 @@ if __name__ == "__main__":
     print("\nTemporal Patterns for Parcelle 'P001':")
     print(temporal_patterns[['ndvi', 'ndvi_rolling']].head())
 
+    print("\nEmpreinte mémoire (schéma par défaut / compact) :")
+    print(data_manager.memory_report())
+
+    print("\nTendances NDVI de toutes les parcelles :")
+    print(data_manager.get_all_temporal_trends().head())
+
     print(f"\nTendance de rendement : {trend['pente']:.2f} tonnes/ha/an")
     print(f"Variation moyenne : {trend['variation_moyenne']*100:.1f}%")
 
@@ -156,4 +1640,13 @@ if __name__ == "__main__":
     print(seasonal_component)
 
     print("\nRésidus :")
-    print(resid_component)
\ No newline at end of file
+    print(resid_component)
+
+    print("\nDécomposition des rendements de toutes les parcelles (période de 2 ans) :")
+    print(data_manager.analyze_all_yield_patterns().head(10))
+
+    print("\nRendements prédits pour la saison en cours :")
+    print(data_manager.predict_yields().head(10))
+
+    print("\nAgrégats mensuels (magasin d'agrégats) :")
+    print(data_manager.get_feature_store().aggregates('mois').head(10))
\ No newline at end of file
@@ -0,0 +1,85 @@
+import numpy as np
+
+
+def _as_float(x):
+    """Converts an x array (numeric or datetime64) to float64 for area computations."""
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.astype('datetime64[ms]').astype(np.int64).astype(np.float64)
+    return x.astype(np.float64)
+
+
+def lttb(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+
+    Keeps the first and last points and, in each of the ``n_out - 2`` buckets
+    in between, the point forming the largest triangle with the previously
+    kept point and the average of the next bucket. Returns the indices of the
+    kept points, so any other column can be sliced the same way.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    xf = _as_float(x)
+    yf = np.asarray(y, dtype=np.float64)
+
+    # Bucket boundaries over the points strictly between the first and last
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    starts, stops = edges[:-1], edges[1:]
+
+    # Average point of each bucket, used as the third triangle vertex
+    cum_x = np.concatenate(([0.0], np.cumsum(xf)))
+    cum_y = np.concatenate(([0.0], np.cumsum(yf)))
+    sizes = np.maximum(stops - starts, 1)
+    avg_x = (cum_x[stops] - cum_x[starts]) / sizes
+    avg_y = (cum_y[stops] - cum_y[starts]) / sizes
+    avg_x = np.append(avg_x[1:], xf[-1])
+    avg_y = np.append(avg_y[1:], yf[-1])
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i, (start, stop) in enumerate(zip(starts, stops)):
+        if stop <= start:
+            stop = start + 1
+        bx, by = xf[start:stop], yf[start:stop]
+        area = np.abs((xf[previous] - avg_x[i]) * (by - yf[previous])
+                      - (xf[previous] - bx) * (avg_y[i] - yf[previous]))
+        previous = start + int(np.argmax(area))
+        selected[i + 1] = previous
+    return selected
+
+
+def minmax_downsample(y, n_buckets):
+    """
+    Min/max bucketing: keeps the minimum and maximum of each bucket.
+
+    Fully vectorized and preserves extremes, which suits noisy hourly series.
+    Returns the sorted indices of the kept points (at most ``2 * n_buckets``).
+    """
+    n = len(y)
+    if 2 * n_buckets >= n or n_buckets < 1:
+        return np.arange(n)
+
+    yf = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(0, n, n_buckets + 1).astype(np.int64)
+    bucket = np.repeat(np.arange(n_buckets), np.diff(edges))
+
+    # Sort by (bucket, value): the first and last entry of each bucket are its min and max
+    order = np.lexsort((yf, bucket))
+    starts, stops = edges[:-1], edges[1:]
+    keep = np.concatenate((order[starts], order[stops - 1]))
+    return np.unique(keep)
+
+
+def downsample(x, y, max_points, method='lttb'):
+    """
+    Returns the indices of at most ``max_points`` points summarizing ``(x, y)``.
+
+    ``method`` is ``'lttb'`` (shape-preserving) or ``'minmax'`` (extreme-preserving).
+    """
+    if method == 'minmax':
+        return minmax_downsample(y, max_points // 2)
+    return lttb(x, y, max_points)
@@ -0,0 +1,369 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_cache import read_frame, read_meta, write_frame
+from weather_stations import DEFAULT_STATION, join_station_weather
+
+
+# Aggregation levels from finest to coarsest, with their approximate length in days
+LEVELS = {
+    'jour': 1.0,
+    'semaine': 7.0,
+    'mois': 30.44,
+    'saison': 365.25,
+}
+
+# Monitoring measures aggregated per parcel and period
+MONITORING_MEASURES = ['ndvi', 'lai', 'stress_hydrique', 'biomasse_estimee']
+
+# Daily weather columns combined per period with these reductions
+WEATHER_REDUCTIONS = {
+    'temperature': 'mean',
+    'temperature_min': 'min',
+    'temperature_max': 'max',
+    'humidite': 'mean',
+    'precipitation': 'sum',
+    'rayonnement_solaire': 'sum',
+    'vitesse_vent_max': 'max',
+}
+
+PARTIAL_KEYS = ['parcelle_id', 'periode']
+
+REDUCERS = {'sum': np.add, 'min': np.fmin, 'max': np.fmax}
+
+# Layout of the saved partials; stores saved with another layout are rebuilt
+STORE_VERSION = 3
+
+
+def period_start(dates, level):
+    """
+    Returns the first day of the ``level`` period containing each date.
+
+    Weeks start on Monday and seasons are calendar years.
+    """
+    days = np.asarray(dates, dtype='datetime64[D]')
+    if level == 'semaine':
+        # 1970-01-01 was a Thursday: shift every day back to its Monday
+        days = days - ((days.astype(np.int64) + 3) % 7).astype('timedelta64[D]')
+    elif level == 'mois':
+        days = days.astype('datetime64[M]').astype('datetime64[D]')
+    elif level == 'saison':
+        days = days.astype('datetime64[Y]').astype('datetime64[D]')
+    elif level != 'jour':
+        raise ValueError(f"Unknown aggregation level: {level}")
+    return days.astype('datetime64[ns]')
+
+
+def start_period(date, level):
+    """Returns the first day of the ``level`` period containing ``date``."""
+    return period_start(np.array([pd.Timestamp(date).to_datetime64()]), level)[0]
+
+
+def level_for(start, end, max_points):
+    """
+    Returns the finest level with at most ``max_points`` periods in ``[start, end]``.
+
+    This is the coarsest aggregation a plot of ``max_points`` points
+    needs: anything finer would be downsampled again before display.
+    """
+    span = (pd.Timestamp(end) - pd.Timestamp(start)) / pd.Timedelta(days=1) + 1
+    for level, days in LEVELS.items():
+        if span / days <= max_points:
+            return level
+    return 'saison'
+
+
+def _within(frame, start, end, level):
+    """Keeps the rows whose ``level`` period overlaps ``[start, end]``."""
+    periods = frame['periode']
+    mask = np.ones(len(frame), dtype=bool)
+    if start is not None:
+        mask &= (periods >= pd.Timestamp(start_period(start, level))).to_numpy()
+    if end is not None:
+        mask &= (periods <= pd.Timestamp(end)).to_numpy()
+    return frame[mask]
+
+
+def _reduce(parcels, periods, columns):
+    """
+    Groups rows by period and parcel, and reduces each column of ``columns``
+    (name -> (values, 'sum' | 'min' | 'max')). Groups come out sorted by
+    period then parcel.
+    """
+    codes, parcel_ids = pd.factorize(np.asarray(parcels), sort=True)
+    periods = np.asarray(periods)
+    order = np.lexsort((codes, periods))
+    codes, periods = codes[order], periods[order]
+    starts = np.flatnonzero(np.concatenate(([len(codes) > 0],
+                                            (codes[1:] != codes[:-1]) | (periods[1:] != periods[:-1]))))
+
+    result = {'parcelle_id': np.asarray(parcel_ids)[codes[starts]], 'periode': periods[starts]}
+    for name, (values, reduction) in columns.items():
+        values = np.asarray(values)[order]
+        result[name] = REDUCERS[reduction].reduceat(values, starts) if len(starts) else values
+    return pd.DataFrame(result)
+
+
+def monitoring_partials(rows, level):
+    """
+    Reduces monitoring rows to mergeable per-parcel, per-period partial statistics.
+
+    Each measure keeps its sum, count, min and max, so partials of new rows
+    can be combined with stored ones without going back to the raw rows.
+    """
+    columns = {'lignes': (np.ones(len(rows), dtype=np.int64), 'sum')}
+    for measure in MONITORING_MEASURES:
+        values = rows[measure].to_numpy(dtype=np.float64)
+        valid = ~np.isnan(values)
+        columns[f"{measure}_somme"] = (np.where(valid, values, 0.0), 'sum')
+        columns[f"{measure}_nombre"] = (valid.astype(np.int64), 'sum')
+        columns[f"{measure}_min"] = (values, 'min')
+        columns[f"{measure}_max"] = (values, 'max')
+    return _reduce(rows['parcelle_id'], period_start(rows['date'].to_numpy(), level), columns)
+
+
+def _partial_reduction(column):
+    """Returns the reduction combining a partial statistic column."""
+    return 'min' if column.endswith('_min') else 'max' if column.endswith('_max') else 'sum'
+
+
+def merge_partials(stored, new):
+    """
+    Combines stored partial statistics with those of new rows.
+
+    Partials are sorted by period, so only the stored periods at or after
+    the earliest new period are regrouped; earlier ones are kept as they are.
+    """
+    if stored is None or not len(stored):
+        return new.reset_index(drop=True)
+    if not len(new):
+        return stored
+
+    split = int(np.searchsorted(stored['periode'].to_numpy(), new['periode'].to_numpy().min(), side='left'))
+    tail = pd.concat([stored.iloc[split:], new], ignore_index=True)
+    merged = _reduce(tail['parcelle_id'], tail['periode'],
+                     {column: (tail[column].to_numpy(), _partial_reduction(column))
+                      for column in tail.columns if column not in PARTIAL_KEYS})
+    return pd.concat([stored.iloc[:split], merged], ignore_index=True)
+
+
+def finalize_partials(partials):
+    """Turns partial statistics into mean, min and max columns per measure."""
+    frame = partials[PARTIAL_KEYS + ['lignes']].copy()
+    for measure in MONITORING_MEASURES:
+        count = partials[f"{measure}_nombre"].to_numpy(dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            frame[measure] = np.where(count > 0, partials[f"{measure}_somme"].to_numpy() / count, np.nan)
+        frame[f"{measure}_min"] = partials[f"{measure}_min"].to_numpy()
+        frame[f"{measure}_max"] = partials[f"{measure}_max"].to_numpy()
+    return frame
+
+
+class FeatureStore:
+    def __init__(self, directory=None):
+        """
+        Materialized per-parcel aggregates at daily, weekly, monthly and season level.
+
+        Monitoring rows are kept as mergeable partial statistics per level,
+        so new rows are folded in without recomputing from the raw data.
+        Daily weather is kept once per station and day and rolled up to each
+        coarser level once, when first queried, until new days are added.
+        Each parcel's aggregates get the weather of its stations from the
+        station ``assignment`` (see ``weather_stations.assign_stations``);
+        without one, stations are averaged. With a ``directory`` the store is
+        saved there in the binary cache format.
+        """
+        self.directory = directory
+        self.partials = {}
+        self.daily_weather = None
+        self.assignment = None
+        self.signature = None
+        self._views = {}
+        self._weather_views = {}
+
+    def build(self, monitoring, daily_weather=None, assignment=None):
+        """Computes every level from the full monitoring rows and daily weather (per station or not)."""
+        self.partials = {level: monitoring_partials(monitoring, level) for level in LEVELS}
+        self.daily_weather = self._weather_days(daily_weather)
+        self.assignment = assignment
+        self._views = {}
+        self._weather_views = {}
+        return self
+
+    def update(self, monitoring=None, daily_weather=None, signature=None, assignment=None):
+        """
+        Folds new monitoring rows and new or corrected weather days into the store.
+
+        Monitoring rows must not already be in the store, as they are added to
+        the existing statistics. Weather days replace stored days of the same
+        station and date. A new station ``assignment`` replaces the current
+        one. When a ``signature`` is given, the store is saved with it.
+        """
+        if monitoring is not None and len(monitoring):
+            for level in LEVELS:
+                self.partials[level] = merge_partials(self.partials.get(level),
+                                                      monitoring_partials(monitoring, level))
+        if daily_weather is not None and len(daily_weather):
+            days = self._weather_days(daily_weather)
+            if self.daily_weather is not None:
+                stored = self.daily_weather
+                replaced = stored['date'].isin(days['date']) & stored['station_id'].isin(days['station_id'])
+                days = pd.concat([stored[~replaced], days], ignore_index=True)
+            self.daily_weather = days.sort_values(['station_id', 'date'], kind='stable', ignore_index=True)
+            self._weather_views = {}
+        if assignment is not None:
+            self.assignment = assignment
+        self._views = {}
+
+        if signature is not None:
+            self.save(signature)
+        return self
+
+    def _weather_days(self, daily_weather):
+        if daily_weather is None:
+            return None
+        columns = ['date'] + [column for column in WEATHER_REDUCTIONS if column in daily_weather.columns]
+        days = daily_weather[columns].copy()
+        stations = daily_weather['station_id'] if 'station_id' in daily_weather.columns else DEFAULT_STATION
+        days.insert(0, 'station_id', pd.Series(stations, index=days.index).astype(str))
+        return days.sort_values(['station_id', 'date'], kind='stable', ignore_index=True)
+
+    def weather(self, level):
+        """
+        Returns the weather of each station aggregated per ``level`` period
+        (columns 'station_id' and 'periode'), sorted by station then period
+        and computed once per level.
+        """
+        if self.daily_weather is None:
+            return None
+        view = self._weather_views.get(level)
+        if view is None:
+            days = self.daily_weather
+            reductions = {column: reduction for column, reduction in WEATHER_REDUCTIONS.items()
+                          if column in days.columns}
+            periods = pd.Series(period_start(days['date'].to_numpy(), level), name='periode')
+            view = self._weather_views[level] = (days.drop(columns='date')
+                                                 .groupby([days['station_id'], periods], sort=True)
+                                                 .agg(reductions).reset_index())
+        return view
+
+    def _parcel_weather(self, frame, level):
+        """
+        Returns the period weather of each row of ``frame`` ('parcelle_id',
+        'periode') at the parcel's stations, or the mean of the stations
+        without an assignment.
+        """
+        weather = self.weather(level)
+        if self.assignment is None or weather['station_id'].nunique() == 1:
+            weather = weather.drop(columns='station_id').groupby('periode', as_index=False).mean()
+            return frame[['periode']].merge(weather, on='periode', how='left').drop(columns='periode')
+
+        # The roll-up is sorted by station then period: each station is a contiguous slice
+        weather = weather.rename(columns={'periode': 'date'})
+        partitions = {station: slice(int(rows[0]), int(rows[-1]) + 1)
+                      for station, rows in weather.groupby('station_id', sort=False).indices.items()}
+        observations = pd.DataFrame({'parcelle_id': frame['parcelle_id'].astype(str).to_numpy(),
+                                     'date': frame['periode'].to_numpy()})
+        joined = join_station_weather(observations, weather.drop(columns='station_id'), partitions,
+                                      self.assignment, exact_day=True)
+        return joined.set_index(frame.index)
+
+    def aggregates(self, level):
+        """
+        Returns the aggregates of ``level``: one row per parcel and period with
+        the mean, min and max of each measure and the period's weather at the
+        parcel's stations.
+        """
+        view = self._views.get(level)
+        if view is None:
+            frame = finalize_partials(self.partials[level])
+            if self.daily_weather is not None:
+                frame = pd.concat([frame, self._parcel_weather(frame, level)], axis=1)
+
+            # Sorted by parcel then period, each parcel is a contiguous slice
+            codes, parcels = pd.factorize(frame['parcelle_id'], sort=True)
+            order = np.lexsort((frame['periode'].to_numpy(), codes))
+            frame, codes = frame.iloc[order].reset_index(drop=True), codes[order]
+            counts = np.bincount(codes, minlength=len(parcels))
+            stops = np.cumsum(counts)
+            slices = {pid: slice(int(stop - count), int(stop))
+                      for pid, stop, count in zip(parcels, stops, counts)}
+            view = self._views[level] = (frame, slices)
+        return view[0]
+
+    def level_for(self, start, end, max_points):
+        """Returns the level chosen by the module-level ``level_for``."""
+        return level_for(start, end, max_points)
+
+    def query(self, parcelle_id=None, start=None, end=None, level=None, max_points=None):
+        """
+        Returns the aggregates of a parcel (all parcels by default) within ``[start, end]``.
+
+        Without an explicit ``level``, the level is chosen by ``level_for``
+        from ``max_points``, or is the daily level.
+        """
+        if level is None:
+            if max_points is not None and start is not None and end is not None:
+                level = self.level_for(start, end, max_points)
+            else:
+                level = 'jour'
+
+        frame = self.aggregates(level)
+        if parcelle_id is not None:
+            frame = frame.iloc[self._views[level][1].get(parcelle_id, slice(0, 0))]
+
+        return _within(frame, start, end, level)
+
+    def query_weather(self, start=None, end=None, level='jour', station_id=None):
+        """
+        Returns the ``level`` weather aggregates of ``station_id`` within
+        ``[start, end]``, or the mean of the stations by default.
+        """
+        weather = self.weather(level)
+        if weather is None:
+            return None
+        if station_id is None:
+            weather = weather.drop(columns='station_id').groupby('periode', as_index=False).mean()
+        else:
+            weather = weather[weather['station_id'] == str(station_id)].drop(columns='station_id')
+        return _within(weather.reset_index(drop=True), start, end, level)
+
+    def save(self, signature=None):
+        """Writes every level and the daily weather to the store directory."""
+        if self.directory is None:
+            return
+        self.signature = signature
+        meta = {'store': signature, 'store_version': STORE_VERSION}
+        try:
+            for level, partials in self.partials.items():
+                write_frame(partials, os.path.join(self.directory, level), signature=meta)
+            if self.daily_weather is not None:
+                write_frame(self.daily_weather, os.path.join(self.directory, 'meteo'), signature=meta)
+        except OSError as e:
+            print(f"Unable to write the feature store: {e}")
+
+    def load(self, signature=None):
+        """
+        Reads a saved store; returns False when it is missing or was saved
+        with a different ``signature`` (its sources changed).
+        """
+        if self.directory is None:
+            return False
+        partials = {}
+        for level in LEVELS:
+            directory = os.path.join(self.directory, level)
+            meta = read_meta(directory)
+            if meta is None or meta.get('store') != signature or meta.get('store_version') != STORE_VERSION:
+                return False
+            partials[level] = read_frame(directory, mmap=False, meta=meta)
+
+        weather_dir = os.path.join(self.directory, 'meteo')
+        meta = read_meta(weather_dir)
+        self.daily_weather = None
+        if meta is not None and meta.get('store') == signature and meta.get('store_version') == STORE_VERSION:
+            self.daily_weather = read_frame(weather_dir, mmap=False, meta=meta)
+
+        self.partials, self.signature, self._views, self._weather_views = partials, signature, {}, {}
+        return True
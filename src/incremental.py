@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+
+
+class NdviTrendState:
+    def __init__(self, window=7):
+        """
+        Running NDVI trend statistics per parcel, updated observation by observation.
+
+        For each parcel it keeps the least-squares sums of (position, NDVI),
+        the date of the last observation and the last ``window`` NDVI values,
+        which is all ``get_all_temporal_trends`` needs. Appending observations
+        only touches the parcels they belong to.
+        """
+        self.window = window
+        self.sums = {}
+        self.recent = {}
+        self.last_dates = {}
+
+    def reset_parcel(self, parcelle_id, dates, values):
+        """Recomputes the state of a parcel from all its date-sorted observations."""
+        self.sums[parcelle_id] = np.zeros(5)
+        self.recent[parcelle_id] = np.empty(0)
+        self.last_dates.pop(parcelle_id, None)
+        self.append(parcelle_id, dates, values)
+
+    def append(self, parcelle_id, dates, values):
+        """Adds observations dated after the parcel's last one."""
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return
+        sums = self.sums.setdefault(parcelle_id, np.zeros(5))
+        x = sums[0] + np.arange(len(values))
+        sums += [len(values), x.sum(), values.sum(), (x * x).sum(), (x * values).sum()]
+
+        recent = np.concatenate((self.recent.get(parcelle_id, np.empty(0)), values))
+        self.recent[parcelle_id] = recent[-self.window:]
+        self.last_dates[parcelle_id] = np.asarray(dates)[-1]
+
+    def to_frame(self):
+        """Returns the trend metrics in the format of ``get_all_temporal_trends``."""
+        parcels = sorted(self.sums)
+        sums = np.array([self.sums[pid] for pid in parcels]).reshape(-1, 5)
+        counts, sum_x, sum_y, sum_xx, sum_xy = sums.T
+
+        denominator = counts * sum_xx - sum_x ** 2
+        enough = counts > 1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = np.where(enough & (denominator != 0),
+                             (counts * sum_xy - sum_x * sum_y) / denominator, 0.0)
+            mean = np.where(enough, sum_y / counts, 0.0)
+
+        return pd.DataFrame({
+            'parcelle_id': parcels,
+            'nb_observations': counts.astype(np.int64),
+            'derniere_date': pd.to_datetime([self.last_dates[pid] for pid in parcels]),
+            'ndvi_rolling': [self.recent[pid].mean() for pid in parcels],
+            'pente': slope,
+            'variation_moyenne': mean,
+        })
+
+
+class RiskState:
+    def __init__(self):
+        """
+        Daily risk scores and growing degree days per parcel, kept between appends.
+
+        Risk indicators only look backward in time, so new or corrected days
+        change the rows from their date onward: ``replace`` swaps those rows
+        for recomputed ones and leaves earlier days untouched.
+        """
+        self.dates = {}
+        self.risk = {}
+        self.gdd = {}
+
+    def reset(self, indicators):
+        """Stores the indicators of every parcel ('parcelle_id', 'date', 'risk_score', 'degres_jours')."""
+        self.dates, self.risk, self.gdd = {}, {}, {}
+        self.replace(indicators)
+
+    def replace(self, indicators, since=None):
+        """Replaces, for the parcels in ``indicators``, the days from ``since`` onward."""
+        since = None if since is None else np.datetime64(pd.Timestamp(since), 'ns')
+        dates = indicators['date'].to_numpy()
+        risk = indicators['risk_score'].to_numpy(dtype=np.float64)
+        gdd = indicators['degres_jours'].to_numpy(dtype=np.float64)
+        for parcelle_id, rows in indicators.groupby('parcelle_id', sort=False, observed=True).indices.items():
+            kept = 0
+            if since is not None and parcelle_id in self.dates:
+                kept = int(np.searchsorted(self.dates[parcelle_id], since, side='left'))
+            for stored, values in ((self.dates, dates), (self.risk, risk), (self.gdd, gdd)):
+                stored[parcelle_id] = np.concatenate((stored.get(parcelle_id, values[:0])[:kept], values[rows]))
+
+    def carry(self, before):
+        """
+        Returns, per parcel, the date and degree days of the last stored day
+        before ``before``, to continue the accumulation from there.
+        """
+        before = np.datetime64(pd.Timestamp(before), 'ns')
+        parcels, dates, gdd = [], [], []
+        for parcelle_id, parcel_dates in self.dates.items():
+            position = int(np.searchsorted(parcel_dates, before, side='left')) - 1
+            if position >= 0:
+                parcels.append(parcelle_id)
+                dates.append(parcel_dates[position])
+                gdd.append(self.gdd[parcelle_id][position])
+        return pd.DataFrame({'date': pd.to_datetime(dates), 'degres_jours': gdd},
+                            index=pd.Index(parcels, name='parcelle_id'))
+
+    def scores(self):
+        """Returns the mean daily risk score of each parcel ('risk_score')."""
+        parcels = sorted(self.risk)
+        return pd.DataFrame({'parcelle_id': parcels,
+                             'risk_score': [self.risk[pid].mean() if len(self.risk[pid]) else np.nan
+                                            for pid in parcels]})
@@ -0,0 +1,214 @@
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+
+# Set to '1' to record metrics from startup, or 'memory' to also trace memory deltas
+ENVIRONMENT_VARIABLE = 'AGRI_METRICS'
+
+# Columns of the recorded metrics
+METRIC_COLUMNS = ['etape', 'parent', 'debut', 'secondes', 'lignes', 'octets', 'memoire_delta_octets', 'thread']
+
+
+def result_size(result):
+    """
+    Returns (rows, bytes) of a stage result: DataFrames, Series and arrays,
+    dicts of columns (e.g. ``ColumnDataSource.data``), HTML strings, and
+    tuples or lists of those. Unknown types give (None, None).
+    """
+    if isinstance(result, pd.DataFrame):
+        return len(result), int(result.memory_usage(index=False).sum())
+    if isinstance(result, (pd.Series, np.ndarray)):
+        return len(result), int(result.nbytes)
+    if isinstance(result, str):
+        return None, len(result)
+    if isinstance(result, dict):
+        arrays = [value for value in result.values() if isinstance(value, (np.ndarray, pd.Series))]
+        if not arrays:
+            return None, None
+        return len(arrays[0]), int(sum(array.nbytes for array in arrays))
+    if isinstance(result, (tuple, list)):
+        sizes = [result_size(item) for item in result]
+        rows = [r for r, _ in sizes if r is not None]
+        sizes = [b for _, b in sizes if b is not None]
+        return (max(rows) if rows else None), (sum(sizes) if sizes else None)
+    return None, None
+
+
+class MetricsRegistry:
+    def __init__(self):
+        """
+        In-process registry of stage measurements.
+
+        Each record holds the stage name, its enclosing stage, start time,
+        duration, rows and bytes of its result and, when memory tracing is
+        on, the change in traced memory. Records are appended under a lock
+        and can be read as a DataFrame or dumped to JSON.
+        """
+        self.enabled = False
+        self.trace_memory = False
+        self.records = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def enable(self, trace_memory=False):
+        """Starts recording; ``trace_memory`` also measures memory deltas with tracemalloc."""
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif not trace_memory and self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.trace_memory = trace_memory
+        self.enabled = True
+
+    def disable(self):
+        """Stops recording (and memory tracing); recorded metrics are kept."""
+        self.enabled = False
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.trace_memory = False
+
+    def clear(self):
+        """Drops every recorded measurement."""
+        with self._lock:
+            self.records = []
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def record(self, name, parent, started, seconds, rows=None, size=None, memory_delta=None):
+        with self._lock:
+            self.records.append({
+                'etape': name, 'parent': parent, 'debut': started, 'secondes': seconds,
+                'lignes': rows, 'octets': size, 'memoire_delta_octets': memory_delta,
+                'thread': threading.current_thread().name,
+            })
+
+    def to_frame(self):
+        """Returns the records as a DataFrame, one row per stage run."""
+        with self._lock:
+            return pd.DataFrame(self.records, columns=METRIC_COLUMNS)
+
+    def summary(self):
+        """Returns per-stage totals: runs, total and max duration, rows, bytes and memory delta."""
+        frame = self.to_frame()
+
+        def total(values):
+            # Stages without a known size stay NaN rather than summing to 0
+            return values.sum(min_count=1)
+
+        return (frame.groupby('etape', sort=False)
+                .agg(appels=('secondes', 'size'), secondes=('secondes', 'sum'),
+                     secondes_max=('secondes', 'max'), lignes=('lignes', total),
+                     octets=('octets', total), memoire_delta_octets=('memoire_delta_octets', total))
+                .sort_values('secondes', ascending=False)
+                .reset_index())
+
+    def to_json(self, path=None):
+        """Returns the records as a JSON string, also written to ``path`` if given."""
+        with self._lock:
+            text = json.dumps(self.records, indent=2, default=str)
+        if path is not None:
+            with open(path, 'w') as handle:
+                handle.write(text)
+        return text
+
+
+# Registry used by the instrumented classes
+METRICS = MetricsRegistry()
+
+
+class _Stage:
+    """Context manager measuring a block; set ``rows``/``size`` or call ``set_result`` inside it."""
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+        self.rows = None
+        self.size = None
+
+    def set_result(self, result):
+        self.rows, self.size = result_size(result)
+        return result
+
+    def __enter__(self):
+        stack = self.registry._stack()
+        self.parent = stack[-1] if stack else None
+        stack.append(self.name)
+        self.memory = tracemalloc.get_traced_memory()[0] if self.registry.trace_memory else None
+        self.started = time.time()
+        self.clock = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.clock
+        memory_delta = None
+        if self.memory is not None and tracemalloc.is_tracing():
+            memory_delta = tracemalloc.get_traced_memory()[0] - self.memory
+        self.registry._stack().pop()
+        self.registry.record(self.name, self.parent, self.started, seconds, self.rows, self.size, memory_delta)
+        return False
+
+
+class _DisabledStage:
+    """Stand-in returned by ``stage`` when recording is off."""
+    rows = size = None
+
+    def set_result(self, result):
+        return result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_DISABLED_STAGE = _DisabledStage()
+
+
+def stage(name, registry=METRICS):
+    """Measures a block of code as stage ``name`` (a no-op when recording is off)."""
+    if not registry.enabled:
+        return _DISABLED_STAGE
+    return _Stage(registry, name)
+
+
+def instrumented(function=None, name=None, registry=METRICS):
+    """
+    Decorator measuring each call as a stage named after the function
+    ('Class.method' by default). The size of the return value is recorded.
+    When recording is off, the call only costs a flag check.
+    """
+    if function is None:
+        return functools.partial(instrumented, name=name, registry=registry)
+    label = name or function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not registry.enabled:
+            return function(*args, **kwargs)
+        with _Stage(registry, label) as measured:
+            return measured.set_result(function(*args, **kwargs))
+
+    return wrapper
+
+
+def enable(trace_memory=False):
+    METRICS.enable(trace_memory)
+
+
+def disable():
+    METRICS.disable()
+
+
+if os.environ.get(ENVIRONMENT_VARIABLE, '').lower() in ('1', 'true', 'memory'):
+    enable(trace_memory=os.environ[ENVIRONMENT_VARIABLE].lower() == 'memory')
@@ -5,6 +5,15 @@ from streamlit_folium import st_folium
 from dashboard_richer_data_visualization_experience import AgriculturalDashboard
 from map_visualization import AgriculturalMap
 from data_manager import AgriculturalDataManager
+from instrumentation import METRICS, instrumented, stage
+
+# Number of rendered variants kept per process (least recently used are evicted)
+BOKEH_CACHE_ENTRIES = 32
+MAP_CACHE_ENTRIES = 16
+
+# Number of neighbouring parcels framed around the selected parcel on the map
+MAP_NEIGHBOURS = 10
+
 
 class IntegratedDashboard:
     def __init__(self, data_manager):
@@ -13,9 +22,21 @@ class IntegratedDashboard:
         Bokeh visualizations and the Folium map.
         """
         self.data_manager = data_manager
-        self.bokeh_dashboard = AgriculturalDashboard(data_manager)
+        self._bokeh_dashboard = None
         self.map_view = AgriculturalMap(data_manager)
+        self.risk_scores = data_manager.get_parcel_risk_scores()
+        self.anomalies = data_manager.get_parcel_anomalies()
 
+    @property
+    def bokeh_dashboard(self):
+        """
+        Default Bokeh dashboard, built on first use only (the Streamlit page renders per parcel).
+        """
+        if self._bokeh_dashboard is None:
+            self._bokeh_dashboard = AgriculturalDashboard(self.data_manager)
+        return self._bokeh_dashboard
+
+    @instrumented
     def initialize_visualizations(self):
         """
         Initializes all visual components.
@@ -27,23 +48,63 @@ class IntegratedDashboard:
         self.map_view.create_base_map()
         self.map_view.add_yield_history_layer()
         self.map_view.add_current_ndvi_layer()
-        self.map_view.add_risk_heatmap()
+        self.map_view.add_risk_heatmap(risk_data=self.risk_scores)
+        self.map_view.add_anomaly_layer(anomaly_data=self.anomalies)
+
+    @instrumented
+    def render_bokeh(self, parcelle_id, start_date, end_date):
+        """
+        Renders the Bokeh layout for a parcel and period as (script, div) HTML strings.
+        """
+        dashboard = AgriculturalDashboard(self.data_manager, parcelle_id, start_date, end_date)
+        return components(dashboard.create_layout(), CDN)
 
-    def create_streamlit_dashboard(self):
+    @instrumented
+    def build_map(self, parcelle_id):
+        """
+        Builds the Folium map framed on a parcel and its nearest neighbours.
+        """
+        map_view = AgriculturalMap(self.data_manager)
+        parcel = self.data_manager.soil_data[self.data_manager.soil_data['parcelle_id'] == parcelle_id]
+        if not parcel.empty:
+            neighbours = self.data_manager.get_nearest_parcels(
+                parcel['latitude'].iloc[0], parcel['longitude'].iloc[0], k=MAP_NEIGHBOURS)
+            soil = self.data_manager.soil_data
+            framed = soil[soil['parcelle_id'].isin(neighbours['parcelle_id'])]
+            map_view.set_viewport([[framed['latitude'].min(), framed['longitude'].min()],
+                                   [framed['latitude'].max(), framed['longitude'].max()]])
+
+        map_view.create_base_map()
+        map_view.add_yield_history_layer()
+        map_view.add_current_ndvi_layer()
+        map_view.add_risk_heatmap(risk_data=self.risk_scores)
+        map_view.add_anomaly_layer(anomaly_data=self.anomalies)
+        return map_view.map
+
+    @instrumented
+    def create_streamlit_dashboard(self, parcelle_id=None, start_date=None, end_date=None):
         """
         Creates a Streamlit interface integrating all visualizations.
+
+        With a parcel and a period, the Bokeh components and the map are
+        taken from the process-wide memoized renderings.
         """
         st.title("Tableau de Bord Agricole Intégré")
 
         # Render Bokeh visualizations in Streamlit
         st.subheader("Visualisations Bokeh")
-        script, div = components(self.bokeh_layout, CDN)
+        if parcelle_id is None:
+            script, div = components(self.bokeh_layout, CDN)
+        else:
+            script, div = cached_bokeh_components(self, parcelle_id, start_date, end_date)
         st.markdown(script, unsafe_allow_html=True)
         st.markdown(div, unsafe_allow_html=True)
 
-        # Render Folium map in Streamlit
+        # Render Folium map in Streamlit; map interactions do not trigger reruns
         st.subheader("Carte Interactive Folium")
-        st_folium(self.map_view.map, width=700, height=500)
+        folium_map = self.map_view.map if parcelle_id is None else cached_map(self, parcelle_id)
+        with stage('st_folium'):
+            st_folium(folium_map, width=700, height=500, returned_objects=[])
 
     def update_visualizations(self, parcelle_id):
         """
@@ -56,19 +117,77 @@ class IntegratedDashboard:
         self.map_view.add_yield_history_layer()
         self.map_view.add_current_ndvi_layer()
 
+
+def show_metrics_panel(registry=METRICS):
+    """
+    Debug panel of the instrumentation: a sidebar switch to record stage
+    metrics (optionally with memory deltas), and the per-stage summary of
+    what was recorded with a JSON download of the raw records.
+    """
+    with st.sidebar.expander("Instrumentation"):
+        recording = st.checkbox("Enregistrer les mesures", value=registry.enabled)
+        trace_memory = st.checkbox("Mesurer la mémoire", value=registry.trace_memory, disabled=not recording)
+        if recording and (not registry.enabled or trace_memory != registry.trace_memory):
+            registry.enable(trace_memory)
+        elif not recording and registry.enabled:
+            registry.disable()
+        if st.button("Effacer les mesures"):
+            registry.clear()
+
+    if registry.records:
+        st.subheader("Instrumentation")
+        st.dataframe(registry.summary())
+        st.download_button("Télécharger les mesures (JSON)", registry.to_json(),
+                           file_name="metriques.json", mime="application/json")
+
+
+@st.cache_resource(show_spinner="Chargement des données...")
+def load_integrated_dashboard():
+    """
+    Loads the data and derived features once per process, shared by all sessions and reruns.
+    """
+    data_manager = AgriculturalDataManager()
+    data_manager.load_data()
+    if data_manager.monitoring_data is None:
+        return None
+    return IntegratedDashboard(data_manager)
+
+
+@st.cache_data(max_entries=BOKEH_CACHE_ENTRIES, show_spinner=False)
+def cached_bokeh_components(_dashboard, parcelle_id, start_date, end_date):
+    """
+    Memoized Bokeh rendering, keyed by parcel and period.
+    """
+    return _dashboard.render_bokeh(parcelle_id, start_date, end_date)
+
+
+@st.cache_resource(max_entries=MAP_CACHE_ENTRIES, show_spinner=False)
+def cached_map(_dashboard, parcelle_id):
+    """
+    Memoized Folium map, keyed by parcel.
+    """
+    return _dashboard.build_map(parcelle_id)
+
+
 # Main script to run the integrated dashboard
 if __name__ == "__main__":
-    # Initialize the data manager and load data
-    data_manager = AgriculturalDataManager()
-    try:
-        data_manager.load_data()
-    except FileNotFoundError as e:
-        st.error(f"Error loading datasets: {e}")
+    # Shared data manager and dashboard, loaded on the first run only
+    integrated_dashboard = load_integrated_dashboard()
+    if integrated_dashboard is None:
+        st.error("Error loading datasets: check the CSV files in data/")
         st.stop()
 
-    # Create integrated dashboard instance
-    integrated_dashboard = IntegratedDashboard(data_manager)
-    integrated_dashboard.initialize_visualizations()
+    # Parcel and period selection
+    data_manager = integrated_dashboard.data_manager
+    parcels = list(data_manager.parcel_index)
+    first_date = data_manager.monitoring_dates_sorted[0].astype('datetime64[D]').item()
+    last_date = data_manager.monitoring_dates_sorted[-1].astype('datetime64[D]').item()
+    parcelle_id = st.sidebar.selectbox("Parcelle", parcels)
+    start_date, end_date = st.sidebar.slider("Période", min_value=first_date, max_value=last_date,
+                                             value=(first_date, last_date))
 
     # Display the Streamlit dashboard
-    integrated_dashboard.create_streamlit_dashboard()
+    integrated_dashboard.create_streamlit_dashboard(parcelle_id, start_date, end_date)
+
+    # Stage timings of this process, when recording is switched on
+    show_metrics_panel()
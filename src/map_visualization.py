@@ -1,8 +1,59 @@
 import folium
 from folium import plugins
 from branca.colormap import LinearColormap
+import numpy as np
 import pandas as pd
 
+from instrumentation import instrumented
+from risk_surface import grid_bounds, risk_grid, surface_to_rgba
+
+
+def colormap_hex(colormap, values):
+    """
+    Compute the hex colors of many values at once from a branca LinearColormap.
+
+    Vectorized equivalent of calling ``colormap(value)`` for each value.
+    """
+    values = np.asarray(values, dtype=float)
+    index = np.asarray(colormap.index, dtype=float)
+    colors = np.asarray(colormap.colors, dtype=float)
+    channels = np.column_stack([np.interp(values, index, colors[:, j]) for j in range(4)])
+    channels = (channels * 255.9999).astype(int)
+    return ['#%02x%02x%02x%02x' % tuple(c) for c in channels.tolist()]
+
+
+def latest_by_parcel(frame):
+    """
+    Keep only the most recent row of each parcel.
+
+    Frames without 'parcelle_id' or 'date' columns are returned unchanged.
+    """
+    if 'parcelle_id' not in frame.columns or 'date' not in frame.columns:
+        return frame
+    return frame.loc[frame.groupby('parcelle_id', sort=False, observed=True)['date'].idxmax()]
+
+
+def points_feature_collection(frame, properties):
+    """
+    Build a GeoJSON FeatureCollection of points from the latitude/longitude columns.
+
+    ``properties`` maps each property name to an array aligned with ``frame``.
+    """
+    coordinates = zip(frame['longitude'].tolist(), frame['latitude'].tolist())
+    columns = {name: np.asarray(values).tolist() for name, values in properties.items()}
+    rows = zip(*columns.values()) if columns else iter(lambda: (), None)
+    return {
+        'type': 'FeatureCollection',
+        'features': [
+            {
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+                'properties': dict(zip(columns, row)),
+            }
+            for (lon, lat), row in zip(coordinates, rows)
+        ],
+    }
+
 class AgriculturalMap:
     def __init__(self, data_manager):
         """
@@ -13,6 +64,7 @@ class AgriculturalMap:
         """
         self.data_manager = data_manager
         self.map = None
+        self.viewport = None  # [[south, west], [north, east]], None for all parcels
         self.yield_colormap = LinearColormap(
             colors=['red', 'yellow', 'green'],
             vmin=0,
@@ -20,6 +72,7 @@ class AgriculturalMap:
             caption="Yield (tonnes/ha)"
         )
 
+    @instrumented
     def create_base_map(self):
         """
         Create the base map centered on the parcels.
@@ -29,48 +82,165 @@ class AgriculturalMap:
         center_lon = self.data_manager.parcels_data['longitude'].mean()
 
         self.map = folium.Map(location=[center_lat, center_lon], zoom_start=12)
+        if self.viewport is not None:
+            self.map.fit_bounds(self.viewport)
+
+    def set_viewport(self, bounds):
+        """
+        Restrict the layers to the parcels inside bounds ([[south, west], [north, east]]).
+
+        Pass None to render every parcel again.
+        """
+        self.viewport = bounds
+
+    def visible_parcels(self):
+        """
+        Return the ids of the parcels inside the viewport, using the manager's spatial index.
+
+        Returns None when every parcel is visible or the manager has no spatial index.
+        """
+        if self.viewport is None or getattr(self.data_manager, 'spatial_index', None) is None:
+            return None
+        return self.data_manager.get_parcels_in_bounds(self.viewport)
+
+    def filter_viewport(self, frame):
+        """
+        Keep only the rows of frame located inside the viewport.
+        """
+        if self.viewport is None:
+            return frame
+        visible = self.visible_parcels()
+        if visible is not None and 'parcelle_id' in frame.columns:
+            return frame[frame['parcelle_id'].isin(visible)]
+        (south, west), (north, east) = self.viewport
+        return frame[frame['latitude'].between(south, north) & frame['longitude'].between(west, east)]
 
+    @instrumented
     def add_yield_history_layer(self):
         """
         Add a layer visualizing the yield history for each parcel.
+
+        The layer is a single GeoJSON FeatureCollection holding the latest row
+        of each parcel, with colors computed in bulk from the yield colormap.
         """
-        for _, row in self.data_manager.parcels_data.iterrows():
-            folium.CircleMarker(
-                location=[row['latitude'], row['longitude']],
-                radius=8,
-                color=self.yield_colormap(row['predicted_yield']),
-                fill=True,
-                fill_opacity=0.7,
-                popup=f"Crop: {row['crop_name']}<br>Yield: {row['predicted_yield']} tonnes/ha"
-            ).add_to(self.map)
+        parcels = self.filter_viewport(latest_by_parcel(self.data_manager.parcels_data))
+        yields = parcels['predicted_yield'].to_numpy()
+        collection = points_feature_collection(parcels, {
+            'crop_name': parcels['crop_name'].to_numpy(),
+            'predicted_yield': np.round(yields, 2),
+            'color': colormap_hex(self.yield_colormap, yields),
+        })
 
+        folium.GeoJson(
+            collection,
+            name="Yield",
+            marker=folium.CircleMarker(radius=8, fill=True, fill_opacity=0.7),
+            style_function=lambda feature: {
+                'color': feature['properties']['color'],
+                'fillColor': feature['properties']['color'],
+            },
+            popup=folium.GeoJsonPopup(fields=['crop_name', 'predicted_yield'],
+                                      aliases=['Crop', 'Yield (tonnes/ha)']),
+        ).add_to(self.map)
+
+    @instrumented
     def add_current_ndvi_layer(self):
         """
         Add a layer visualizing the current NDVI status for each parcel.
+
+        Only the latest observation of each parcel is shown, as one GeoJSON layer.
+        """
+        if hasattr(self.data_manager, 'get_latest_observations'):
+            monitoring = self.data_manager.get_latest_observations(self.visible_parcels())
+        else:
+            monitoring = self.filter_viewport(latest_by_parcel(self.data_manager.monitoring_data))
+        crop_column = 'culture' if 'culture' in monitoring.columns else 'crop_name'
+        collection = points_feature_collection(monitoring, {
+            'ndvi': monitoring['ndvi'].to_numpy(),
+            'crop': monitoring[crop_column].to_numpy(),
+        })
+
+        folium.GeoJson(
+            collection,
+            name="NDVI",
+            marker=folium.Marker(icon=folium.Icon(color='green', icon='info-sign')),
+            popup=folium.GeoJsonPopup(fields=['ndvi', 'crop'], aliases=['NDVI', 'Crop']),
+        ).add_to(self.map)
+
+    @instrumented
+    def add_risk_heatmap(self, shape=(128, 128), bandwidth=4.0, risk_data=None):
         """
-        for _, row in self.data_manager.monitoring_data.iterrows():
-            folium.Marker(
-                location=[row['latitude'], row['longitude']],
-                popup=f"NDVI: {row['ndvi']}<br>Crop: {row['crop_name']}",
-                icon=folium.Icon(color='green', icon='info-sign')
-            ).add_to(self.map)
+        Add a risk surface layer of risk zones.
 
-    def add_risk_heatmap(self):
+        Per-parcel risk scores are binned onto a ``shape`` lat/lon grid,
+        smoothed with a Gaussian kernel of ``bandwidth`` cells and drawn as a
+        single image overlay colored from green (low) to red (high risk).
+        Precomputed scores can be passed as ``risk_data``.
         """
-        Add a heatmap layer of risk zones.
+        if risk_data is None:
+            if hasattr(self.data_manager, 'risk_data'):
+                risk_data = self.data_manager.risk_data
+            else:
+                risk_data = self.data_manager.get_parcel_risk_scores()
+        risk_data = self.filter_viewport(risk_data)
+        if risk_data.empty:
+            return
+
+        latitudes = risk_data['latitude'].to_numpy()
+        longitudes = risk_data['longitude'].to_numpy()
+        bounds = grid_bounds(latitudes, longitudes)
+        surface, density = risk_grid(latitudes, longitudes, risk_data['risk_score'].to_numpy(),
+                                     bounds, shape=shape, bandwidth=bandwidth)
+
+        colors = self.yield_colormap.colors[::-1]  # green -> yellow -> red
+        folium.raster_layers.ImageOverlay(
+            image=surface_to_rgba(surface, density, colors),
+            bounds=bounds,
+            origin='lower',
+            name="Risk",
+            pixelated=False,
+        ).add_to(self.map)
+
+    @instrumented
+    def add_anomaly_layer(self, anomaly_data=None):
+        """
+        Add a layer marking the parcels whose latest observation is anomalous.
+
+        Anomalies come from the manager's online detector, or can be passed
+        as ``anomaly_data`` (one row per parcel with 'mesures_anormales' and
+        'score_max'). Marker size grows with the anomaly score.
         """
-        heat_data = [
-            [row['latitude'], row['longitude'], row['risk_score']]
-            for _, row in self.data_manager.risk_data.iterrows()
-        ]
+        if anomaly_data is None:
+            if hasattr(self.data_manager, 'anomaly_data'):
+                anomaly_data = self.data_manager.anomaly_data
+            else:
+                anomaly_data = self.data_manager.get_parcel_anomalies()
+        anomaly_data = self.filter_viewport(anomaly_data.dropna(subset=['latitude', 'longitude']))
+        if anomaly_data.empty:
+            return
+
+        scores = anomaly_data['score_max'].to_numpy(dtype=float)
+        collection = points_feature_collection(anomaly_data, {
+            'parcelle_id': anomaly_data['parcelle_id'].astype(str).to_numpy(),
+            'mesures_anormales': anomaly_data['mesures_anormales'].to_numpy(),
+            'score_max': np.round(scores, 2),
+            'radius': np.clip(4 + 2 * scores, 6, 16),
+        })
 
-        plugins.HeatMap(
-            data=[[row[0], row[1]] for row in heat_data],
-            radius=15,
-            blur=10,
-            max_zoom=1
+        folium.GeoJson(
+            collection,
+            name="Anomalies",
+            marker=folium.CircleMarker(fill=True, fill_opacity=0.8),
+            style_function=lambda feature: {
+                'color': 'darkred',
+                'fillColor': 'red',
+                'radius': feature['properties']['radius'],
+            },
+            popup=folium.GeoJsonPopup(fields=['parcelle_id', 'mesures_anormales', 'score_max'],
+                                      aliases=['Parcel', 'Anomalous measures', 'Score (|z|)']),
         ).add_to(self.map)
 
+    @instrumented
     def save_map(self, filename="agricultural_map.html"):
         """
         Save the generated map to an HTML file.
@@ -103,6 +273,14 @@ class DataManager:
             'risk_score': [0.4, 0.8, 0.3]
         })
 
+        self.anomaly_data = pd.DataFrame({
+            'parcelle_id': ['P001', 'P002'],
+            'latitude': [34.05, 34.10],
+            'longitude': [-6.83, -6.80],
+            'mesures_anormales': ['ndvi', 'lai, stress_hydrique'],
+            'score_max': [3.4, 5.1]
+        })
+
 # Main script to generate the map
 if __name__ == "__main__":
     data_manager = DataManager()
@@ -112,6 +290,7 @@ if __name__ == "__main__":
     agri_map.add_yield_history_layer()
     agri_map.add_current_ndvi_layer()
     agri_map.add_risk_heatmap()
+    agri_map.add_anomaly_layer()
 
     # Save map to an HTML file
     agri_map.save_map("agricultural_map.html")
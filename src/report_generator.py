@@ -0,0 +1,498 @@
+import hashlib
+import html
+import json
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from downsampling import downsample
+from instrumentation import instrumented
+
+
+# Bump when the report layout changes, so that every report is rendered again
+REPORT_VERSION = 1
+
+# Parcels rendered by a worker process per task
+PARCELS_PER_TASK = 64
+
+# Size of the static charts, in pixels
+CHART_WIDTH = 640
+CHART_HEIGHT = 200
+
+# Parcels drawn on the mini-map of each report (the parcel and its nearest neighbours)
+MINIMAP_NEIGHBOURS = 15
+MINIMAP_SIZE = 240
+
+# Digests of the rendered inputs, used to skip unchanged parcels
+MANIFEST_FILE = 'manifest.json'
+
+# Risk colors from low to high, as in the map layer
+RISK_COLORS = np.array([[0, 128, 0], [255, 255, 0], [255, 0, 0]], dtype=float)
+
+SOIL_FIELDS = ['type_sol', 'surface_ha', 'capacite_retention_eau', 'ph', 'latitude', 'longitude']
+RISK_FIELDS = ['risk_score', 'deficit_precipitation', 'degres_jours', 'jours_chaleur_consecutifs',
+               'drought_risk', 'heat_risk']
+DECOMPOSITION_FIELDS = ['annee', 'culture', 'rendement', 'tendance', 'saisonnier', 'residu']
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html lang="fr">
+<head>
+<meta charset="utf-8">
+<title>Rapport parcelle {parcelle_id}</title>
+<style>
+body {{ font-family: sans-serif; margin: 2em; color: #222; }}
+table {{ border-collapse: collapse; margin-bottom: 1em; }}
+td, th {{ border: 1px solid #ccc; padding: 2px 8px; text-align: right; }}
+th {{ background: #eee; }}
+svg {{ display: block; margin-bottom: 1em; }}
+</style>
+</head>
+<body>
+<h1>Parcelle {parcelle_id}</h1>
+{summary}
+<h2>Évolution du NDVI</h2>
+{ndvi_chart}
+<h2>Rendements et décomposition</h2>
+{yield_chart}
+{decomposition}
+<h2>Indicateurs de risque</h2>
+{risk_chart}
+{risk_summary}
+<h2>Situation</h2>
+{minimap}
+</body>
+</html>
+"""
+
+
+def risk_color(values):
+    """Returns the hex colors of risk scores in [0, 1], from green to red."""
+    values = np.clip(np.nan_to_num(np.asarray(values, dtype=float)), 0.0, 1.0)
+    stops = np.linspace(0.0, 1.0, len(RISK_COLORS))
+    channels = np.column_stack([np.interp(values, stops, RISK_COLORS[:, j]) for j in range(3)])
+    return ['#%02x%02x%02x' % tuple(c) for c in channels.round().astype(int).tolist()]
+
+
+def _as_float(x):
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.astype('datetime64[D]').astype(np.float64)
+    return x.astype(np.float64)
+
+
+def _label(value, dates):
+    if dates:
+        return str(np.datetime64(int(round(value)), 'D'))
+    return f"{value:g}"
+
+
+def svg_line_chart(series, title, width=CHART_WIDTH, height=CHART_HEIGHT):
+    """
+    Draws series as an inline SVG chart.
+
+    ``series`` is a list of ``(x, y, color, label, kind)`` with ``kind``
+    'line' or 'points'; x values are numbers or datetime64. NaN points are
+    left out and series longer than the chart width are reduced to the
+    min/max of each pixel column.
+    """
+    margin_left, margin_right, margin_top, margin_bottom = 48, 12, 24, 28
+    dates = any(np.issubdtype(np.asarray(x).dtype, np.datetime64) for x, *_ in series)
+    prepared = []
+    for x, y, color, label, kind in series:
+        x, y = _as_float(x), np.asarray(y, dtype=np.float64)
+        valid = ~np.isnan(y)
+        x, y = x[valid], y[valid]
+        keep = downsample(x, y, width, method='minmax')
+        prepared.append((x[keep], y[keep], color, label, kind))
+
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+             f'font-size="11">',
+             f'<text x="{margin_left}" y="14" font-weight="bold">{html.escape(title)}</text>']
+    points = [(x, y) for x, y, *_ in prepared if len(x)]
+    if not points:
+        parts.append(f'<text x="{margin_left}" y="{height // 2}">Aucune donnée</text></svg>')
+        return ''.join(parts)
+
+    x_min = min(x.min() for x, _ in points)
+    x_max = max(x.max() for x, _ in points)
+    y_min = min(y.min() for _, y in points)
+    y_max = max(y.max() for _, y in points)
+    x_span = (x_max - x_min) or 1.0
+    y_span = (y_max - y_min) or 1.0
+    plot_width = width - margin_left - margin_right
+    plot_height = height - margin_top - margin_bottom
+
+    def to_pixels(x, y):
+        return (margin_left + (x - x_min) / x_span * plot_width,
+                margin_top + (1 - (y - y_min) / y_span) * plot_height)
+
+    bottom = margin_top + plot_height
+    parts.append(f'<rect x="{margin_left}" y="{margin_top}" width="{plot_width}" height="{plot_height}" '
+                 f'fill="none" stroke="#999"/>')
+    parts.append(f'<text x="{margin_left - 4}" y="{margin_top + 8}" text-anchor="end">{y_max:.3g}</text>')
+    parts.append(f'<text x="{margin_left - 4}" y="{bottom}" text-anchor="end">{y_min:.3g}</text>')
+    parts.append(f'<text x="{margin_left}" y="{bottom + 16}">{_label(x_min, dates)}</text>')
+    parts.append(f'<text x="{width - margin_right}" y="{bottom + 16}" text-anchor="end">'
+                 f'{_label(x_max, dates)}</text>')
+
+    legend_x = width - margin_right
+    for x, y, color, label, kind in reversed(prepared):
+        px, py = to_pixels(x, y)
+        if kind == 'points':
+            circle = f'<circle cx="%.1f" cy="%.1f" r="3" fill="{color}"/>'
+            parts.append(circle * len(px) % tuple(np.column_stack((px, py)).ravel()))
+        elif len(px):
+            coordinates = ("%.1f,%.1f " * len(px) % tuple(np.column_stack((px, py)).ravel())).rstrip()
+            parts.append(f'<polyline points="{coordinates}" fill="none" stroke="{color}" stroke-width="1.5"/>')
+        parts.append(f'<text x="{legend_x}" y="14" text-anchor="end" fill="{color}">{html.escape(label)}</text>')
+        legend_x -= 7 * len(label) + 12
+    parts.append('</svg>')
+    return ''.join(parts)
+
+
+def svg_minimap(latitudes, longitudes, risk, parcel_ids, size=MINIMAP_SIZE):
+    """
+    Draws the parcels as points colored by risk in an inline SVG; the
+    first parcel, the one the report is about, is outlined.
+    """
+    latitudes, longitudes = np.asarray(latitudes, dtype=float), np.asarray(longitudes, dtype=float)
+    margin = 16
+    # Same scale on both axes, longitudes shrunk by the cosine of the latitude
+    x = longitudes * np.cos(np.radians(latitudes.mean()))
+    span = max(np.ptp(x), np.ptp(latitudes), 1e-6)
+    px = margin + (x - x.min()) / span * (size - 2 * margin)
+    py = size - margin - (latitudes - latitudes.min()) / span * (size - 2 * margin)
+
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size}">',
+             f'<rect width="{size}" height="{size}" fill="#f4f4f0" stroke="#999"/>']
+    colors = risk_color(risk)
+    for i in range(len(px) - 1, -1, -1):
+        outline = 'stroke="#000" stroke-width="2"' if i == 0 else 'stroke="#555" stroke-width="0.5"'
+        radius = 7 if i == 0 else 5
+        parts.append(f'<circle cx="{px[i]:.1f}" cy="{py[i]:.1f}" r="{radius}" fill="{colors[i]}" {outline}>'
+                     f'<title>{html.escape(str(parcel_ids[i]))} : risque {risk[i]:.2f}</title></circle>')
+    parts.append('</svg>')
+    return ''.join(parts)
+
+
+def html_table(columns, rows):
+    """Renders rows (lists of already formatted values) as an HTML table."""
+    header = ''.join(f'<th>{html.escape(str(column))}</th>' for column in columns)
+    body = ''.join('<tr>' + ''.join(f'<td>{html.escape(str(value))}</td>' for value in row) + '</tr>'
+                   for row in rows)
+    return f'<table><tr>{header}</tr>{body}</table>'
+
+
+def _format(value, digits=2):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return '-'
+    if isinstance(value, (float, np.floating)):
+        return f"{value:.{digits}f}"
+    return str(value)
+
+
+def render_parcel_report(payload):
+    """Renders the HTML report of one parcel from its inputs (see ``collect_report_inputs``)."""
+    soil, trend, risk = payload['sol'], payload['tendance'], payload['risque']
+    summary = html_table(['Indicateur', 'Valeur'], [
+        ['Culture', payload['culture']],
+        ['Type de sol', soil.get('type_sol')],
+        ['Surface (ha)', _format(soil.get('surface_ha'))],
+        ['Rétention en eau', _format(soil.get('capacite_retention_eau'))],
+        ['Observations', trend.get('nb_observations')],
+        ['Dernière observation', trend.get('derniere_date')],
+        ['NDVI (moyenne glissante)', _format(trend.get('ndvi_rolling'), 3)],
+        ['Pente du NDVI', _format(trend.get('pente'), 5)],
+        ['Rendement prévu (t/ha)', _format(payload['rendement_prevu'])],
+        ['Score de risque moyen', _format(risk['score_moyen'])],
+    ])
+
+    ndvi_dates, ndvi = payload['ndvi']
+    rolling = pd.Series(ndvi).rolling(7, min_periods=1).mean().to_numpy()
+    ndvi_chart = svg_line_chart([(ndvi_dates, ndvi, '#9ccf9c', 'NDVI', 'line'),
+                                 (ndvi_dates, rolling, '#1a7a1a', 'Moyenne 7 obs.', 'line')],
+                                "NDVI observé")
+
+    yields = payload['rendements']
+    yield_chart = svg_line_chart([(yields['annee'], yields['rendement'], '#1f77b4', 'Rendement', 'points'),
+                                  (yields['annee'], yields['tendance'], '#ff7f0e', 'Tendance', 'line')],
+                                 "Rendements (t/ha)")
+    decomposition = html_table(
+        ['Année', 'Culture', 'Rendement', 'Tendance', 'Saisonnier', 'Résidu'],
+        [[year, crop] + [_format(value) for value in values]
+         for year, crop, *values in zip(*(yields[field] for field in DECOMPOSITION_FIELDS))])
+
+    risk_chart = svg_line_chart([(risk['date'], risk['risk_score'], '#d62728', 'Score de risque', 'line')],
+                                "Score de risque journalier")
+    risk_summary = html_table(['Indicateur', 'Valeur'], [
+        ['Jours de sécheresse', risk['jours_secheresse']],
+        ['Jours de chaleur', risk['jours_chaleur']],
+        ['Plus longue vague de chaleur (jours)', risk['vague_chaleur_max']],
+        ['Déficit hydrique maximal (mm)', _format(risk['deficit_max'], 1)],
+        ['Degrés-jours cumulés', _format(risk['degres_jours'], 0)],
+    ])
+
+    neighbours = payload['voisins']
+    minimap = svg_minimap(neighbours['latitude'], neighbours['longitude'], neighbours['risk_score'],
+                          neighbours['parcelle_id'])
+
+    return PAGE_TEMPLATE.format(parcelle_id=html.escape(str(payload['parcelle_id'])), summary=summary,
+                                ndvi_chart=ndvi_chart, yield_chart=yield_chart, decomposition=decomposition,
+                                risk_chart=risk_chart, risk_summary=risk_summary, minimap=minimap)
+
+
+def html_to_pdf(document, path):
+    """Converts an HTML report to PDF (requires weasyprint)."""
+    # weasyprint is only needed for PDF output, so it is not imported with the module
+    from weasyprint import HTML
+
+    HTML(string=document).write_pdf(path)
+
+
+def render_batch(payloads, output_dir, fmt='html'):
+    """
+    Renders and writes the reports of a list of parcels; the unit of work of a worker process.
+    Returns the written ``(parcelle_id, path)`` pairs.
+    """
+    written = []
+    for payload in payloads:
+        document = render_parcel_report(payload)
+        path = os.path.join(output_dir, f"{payload['parcelle_id']}.{fmt}")
+        if fmt == 'pdf':
+            html_to_pdf(document, path)
+        else:
+            with open(path, 'w', encoding='utf-8') as handle:
+                handle.write(document)
+        written.append((payload['parcelle_id'], path))
+    return written
+
+
+def payload_digest(payload, fmt):
+    """Hashes the inputs of a report, with the output format and the layout version."""
+    return hashlib.sha1(pickle.dumps((REPORT_VERSION, fmt, payload), protocol=4)).hexdigest()
+
+
+def _positions(frame, parcel_ids):
+    """Maps each parcel to the positions of its rows in ``frame``."""
+    groups = frame.groupby('parcelle_id', sort=False, observed=True).indices
+    empty = np.empty(0, dtype=np.int64)
+    return {pid: groups.get(pid, empty) for pid in parcel_ids}
+
+
+@instrumented
+def collect_report_inputs(data_manager, parcel_ids=None):
+    """
+    Gathers the inputs of the reports of ``parcel_ids`` (all monitored
+    parcels by default), computed once for all parcels by the data manager:
+    NDVI series and trend, yield decomposition, daily risk indicators,
+    predicted yield, soil properties and nearest neighbours.
+
+    Returns a dict mapping each parcel to a small payload of plain values and
+    arrays, so worker processes receive only what they render. Raises
+    ``ValueError`` for parcels without monitoring data.
+    """
+    if parcel_ids is None:
+        parcel_ids = list(data_manager.parcel_index)
+    unknown = [parcelle_id for parcelle_id in parcel_ids if parcelle_id not in data_manager.parcel_index]
+    if unknown:
+        raise ValueError(f"Unknown parcels (no monitoring data): {', '.join(map(str, unknown))}")
+
+    monitoring = data_manager.monitoring_data
+    dates = monitoring['date'].to_numpy()
+    ndvi = monitoring['ndvi'].to_numpy(dtype=np.float64)
+    cultures = monitoring['culture'].to_numpy()
+
+    trends = data_manager.get_ndvi_trends()
+    trends['derniere_date'] = trends['derniere_date'].dt.strftime('%Y-%m-%d')
+    trends = trends.set_index('parcelle_id').to_dict('index')
+    decomposition = data_manager.analyze_all_yield_patterns()
+    indicators = data_manager.get_risk_indicators()
+    predictions = data_manager.predict_yields().set_index('parcelle_id')['predicted_yield']
+    soil = data_manager.soil_data
+    soil_rows = dict(zip(soil['parcelle_id'].tolist(), range(len(soil))))
+    soil_columns = {field: soil[field].tolist() for field in SOIL_FIELDS}
+
+    # Mean risk of every parcel, for the neighbours drawn on the mini-maps
+    risk_columns = {field: indicators[field].to_numpy() for field in RISK_FIELDS}
+    risk_dates = indicators['date'].to_numpy()
+    mean_risk = indicators.groupby('parcelle_id', observed=True)['risk_score'].mean()
+    index = data_manager.spatial_index
+    neighbour_risk = mean_risk.reindex(index.parcel_ids).to_numpy()
+
+    decomposition_rows = _positions(decomposition, parcel_ids)
+    risk_rows = _positions(indicators, parcel_ids)
+    decomposition_columns = {field: decomposition[field].to_numpy() for field in DECOMPOSITION_FIELDS}
+
+    payloads = {}
+    for parcelle_id in parcel_ids:
+        rows = data_manager.parcel_index[parcelle_id]
+        position = soil_rows.get(parcelle_id)
+        soil_values = {} if position is None else {field: values[position] for field, values in soil_columns.items()}
+        trend = trends.get(parcelle_id, {})
+
+        parcel_risk = {field: values[risk_rows[parcelle_id]] for field, values in risk_columns.items()}
+        score = parcel_risk['risk_score']
+        heat_run = parcel_risk['jours_chaleur_consecutifs']
+        gdd = parcel_risk['degres_jours']
+
+        neighbours = {'parcelle_id': [], 'latitude': [], 'longitude': [], 'risk_score': []}
+        if position is not None:
+            near, _ = index.nearest(soil_values['latitude'], soil_values['longitude'], k=MINIMAP_NEIGHBOURS)
+            # The parcel itself first, then its neighbours
+            near = np.concatenate(([position], near[near != position]))
+            neighbours = {'parcelle_id': index.parcel_ids[near].tolist(),
+                          'latitude': index.latitudes[near], 'longitude': index.longitudes[near],
+                          'risk_score': np.nan_to_num(neighbour_risk[near])}
+
+        payloads[parcelle_id] = {
+            'parcelle_id': parcelle_id,
+            'culture': str(cultures[rows][-1]) if len(cultures[rows]) else '-',
+            'sol': soil_values,
+            'tendance': trend,
+            'ndvi': (dates[rows], ndvi[rows]),
+            'rendements': {field: values[decomposition_rows[parcelle_id]]
+                           for field, values in decomposition_columns.items()},
+            'risque': {
+                'date': risk_dates[risk_rows[parcelle_id]],
+                'risk_score': score,
+                'score_moyen': float(score.mean()) if len(score) else np.nan,
+                'jours_secheresse': int(parcel_risk['drought_risk'].sum()),
+                'jours_chaleur': int(parcel_risk['heat_risk'].sum()),
+                'vague_chaleur_max': int(heat_run.max()) if len(heat_run) else 0,
+                'deficit_max': float(parcel_risk['deficit_precipitation'].max()) if len(score) else np.nan,
+                'degres_jours': float(gdd[-1]) if len(gdd) else np.nan,
+            },
+            'rendement_prevu': float(predictions.get(parcelle_id, np.nan)),
+            'voisins': neighbours,
+        }
+    return payloads
+
+
+def load_manifest(output_dir):
+    """Reads the entries of the reports rendered so far; empty if there was none."""
+    try:
+        with open(os.path.join(output_dir, MANIFEST_FILE)) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(output_dir, manifest):
+    """Writes the entries of the rendered reports (replaced atomically)."""
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as handle:
+        json.dump(manifest, handle, indent=0, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def manifest_entry(payload, digest):
+    """Manifest entry of a rendered report: its digest and the values listed in the index."""
+    def number(value):
+        return None if value is None or np.isnan(value) else float(value)
+
+    return {'empreinte': digest, 'culture': str(payload['culture']),
+            'rendement_prevu': number(payload['rendement_prevu']),
+            'risque_moyen': number(payload['risque']['score_moyen'])}
+
+
+def _manifest_digest(entry):
+    # Manifests of earlier versions hold the digest alone
+    return entry.get('empreinte') if isinstance(entry, dict) else entry
+
+
+def write_index(output_dir, manifest, fmt):
+    """
+    Writes an index page linking every report of the manifest found in
+    ``output_dir``, with its predicted yield and mean risk, including the
+    reports of earlier runs over other parcels.
+    """
+    rows = []
+    for pid, entry in sorted(manifest.items()):
+        if not os.path.exists(os.path.join(output_dir, f"{pid}.{fmt}")):
+            continue
+        entry = entry if isinstance(entry, dict) else {}
+        rows.append([f'<a href="{html.escape(str(pid))}.{fmt}">{html.escape(str(pid))}</a>',
+                     html.escape(entry.get('culture', '-')), _format(entry.get('rendement_prevu')),
+                     _format(entry.get('risque_moyen'))])
+    header = ''.join(f'<th>{name}</th>' for name in ['Parcelle', 'Culture', 'Rendement prévu', 'Risque moyen'])
+    body = ''.join('<tr>' + ''.join(f'<td>{value}</td>' for value in row) + '</tr>' for row in rows)
+    with open(os.path.join(output_dir, 'index.html'), 'w', encoding='utf-8') as handle:
+        handle.write(f'<!DOCTYPE html><html lang="fr"><head><meta charset="utf-8"><title>Rapports</title>'
+                     f'</head><body><h1>Rapports par parcelle</h1><table>'
+                     f'<tr>{header}</tr>{body}</table></body></html>')
+
+
+@instrumented
+def generate_reports(data_manager, output_dir='reports', fmt='html', parcel_ids=None, force=False,
+                     max_workers=None):
+    """
+    Renders one report per parcel to ``output_dir`` as HTML or PDF (``fmt``).
+
+    Inputs of all parcels are computed once in this process. Each parcel's
+    inputs are hashed and compared with the manifest of the previous run:
+    unchanged parcels whose report exists are skipped unless ``force`` is
+    set. The others are rendered by a process pool of ``max_workers`` (all
+    CPUs by default) in tasks of ``PARCELS_PER_TASK`` parcels; with one
+    worker or a single task, everything runs in this process.
+
+    Returns one row per parcel with its file and status ('genere' or 'inchange').
+    """
+    if fmt not in ('html', 'pdf'):
+        raise ValueError(f"Unknown report format: {fmt}")
+    if fmt == 'pdf':
+        try:
+            import weasyprint  # noqa: F401
+        except ImportError:
+            print("PDF reports need the weasyprint package; use fmt='html' or install it.")
+            return None
+
+    os.makedirs(output_dir, exist_ok=True)
+    payloads = collect_report_inputs(data_manager, parcel_ids)
+    manifest = load_manifest(output_dir)
+
+    digests, pending = {}, []
+    for parcelle_id, payload in payloads.items():
+        digests[parcelle_id] = payload_digest(payload, fmt)
+        path = os.path.join(output_dir, f"{parcelle_id}.{fmt}")
+        changed = _manifest_digest(manifest.get(parcelle_id)) != digests[parcelle_id]
+        if force or changed or not os.path.exists(path):
+            pending.append(payload)
+
+    tasks = [pending[i:i + PARCELS_PER_TASK] for i in range(0, len(pending), PARCELS_PER_TASK)]
+    max_workers = min(max_workers or os.cpu_count() or 1, max(len(tasks), 1))
+    rendered = set()
+    if max_workers == 1:
+        for task in tasks:
+            rendered.update(pid for pid, _ in render_batch(task, output_dir, fmt))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for written in executor.map(render_batch, tasks, [output_dir] * len(tasks), [fmt] * len(tasks)):
+                rendered.update(pid for pid, _ in written)
+
+    # Unchanged reports keep their digest; their index values are refreshed with the rendered ones
+    pending_ids = {payload['parcelle_id'] for payload in pending}
+    manifest.update({pid: manifest_entry(payloads[pid], digests[pid]) for pid in payloads
+                     if pid in rendered or pid not in pending_ids})
+    save_manifest(output_dir, manifest)
+    write_index(output_dir, manifest, fmt)
+
+    return pd.DataFrame({
+        'parcelle_id': list(payloads),
+        'fichier': [os.path.join(output_dir, f"{pid}.{fmt}") for pid in payloads],
+        'statut': ['genere' if pid in rendered else 'inchange' for pid in payloads],
+    })
+
+
+if __name__ == "__main__":
+    from data_manager import AgriculturalDataManager
+
+    data_manager = AgriculturalDataManager()
+    data_manager.load_data()
+
+    summary = generate_reports(data_manager)
+    if summary is not None:
+        print(summary['statut'].value_counts())
@@ -0,0 +1,184 @@
+import numpy as np
+import pandas as pd
+
+
+# Daily maximum temperature above which a day counts as a heat day (°C)
+HEAT_THRESHOLD = 35.0
+
+# Consecutive heat days at which the heat component of the risk saturates
+HEAT_RUN_SATURATION = 5
+
+# Base temperature of growing degree days (°C)
+GDD_BASE_TEMPERATURE = 10.0
+
+# Plant-available water, in mm, per unit of soil 'capacite_retention_eau'
+ROOT_ZONE_WATER_MM = 150.0
+
+# Latitude used for the reference evapotranspiration when rows have none
+DEFAULT_LATITUDE = 45.0
+
+# Weights of the risk components, summing to 1
+RISK_WEIGHTS = {'stress_combine': 0.6, 'chaleur': 0.4}
+
+SOLAR_CONSTANT = 0.0820  # MJ m-2 min-1
+
+
+def daily_inputs(data):
+    """
+    Reduces weather/monitoring rows to one row per parcel and day, sorted by parcel then day.
+
+    Precipitation is summed over the day's rows (hourly readings, or the
+    single row of daily inputs); temperatures give the daily min, max and
+    mean; water stress, soil retention and latitude are averaged.
+    """
+    parcels = data['parcelle_id'].to_numpy()
+    days = data['date'].to_numpy().astype('datetime64[D]')
+    codes, parcel_ids = pd.factorize(parcels, sort=True)
+    order = np.lexsort((days, codes))
+    codes, days = codes[order], days[order]
+    boundaries = (codes[1:] != codes[:-1]) | (days[1:] != days[:-1])
+    starts = np.flatnonzero(np.concatenate(([len(codes) > 0], boundaries)))
+
+    def column(name):
+        return data[name].to_numpy(dtype=np.float64)[order]
+
+    def reduce(values, reducer):
+        return reducer.reduceat(values, starts) if len(starts) else values
+
+    def mean(values):
+        valid = ~np.isnan(values)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return reduce(np.where(valid, values, 0.0), np.add) / reduce(valid.astype(np.float64), np.add)
+
+    temperature = column('temperature')
+    lowest = column('temperature_min') if 'temperature_min' in data else temperature
+    highest = column('temperature_max') if 'temperature_max' in data else temperature
+    result = {
+        'parcelle_id': np.asarray(parcel_ids)[codes[starts]],
+        'date': days[starts].astype('datetime64[ns]'),
+        'temperature_min': reduce(lowest, np.fmin),
+        'temperature_max': reduce(highest, np.fmax),
+        'temperature': mean(temperature),
+        'precipitation': reduce(np.nan_to_num(column('precipitation')), np.add),
+    }
+    for name in ('stress_hydrique', 'capacite_retention_eau', 'latitude'):
+        if name in data:
+            result[name] = mean(column(name))
+    return pd.DataFrame(result)
+
+
+def reference_evapotranspiration(dates, temperature_min, temperature_max, temperature, latitude):
+    """
+    Hargreaves reference evapotranspiration (mm/day), with the extraterrestrial
+    radiation of FAO-56 computed from the day of year and latitude.
+    """
+    day_of_year = pd.DatetimeIndex(dates).dayofyear.to_numpy()
+    phi = np.radians(latitude)
+    angle = 2 * np.pi * day_of_year / 365
+    inverse_distance = 1 + 0.033 * np.cos(angle)
+    declination = 0.409 * np.sin(angle - 1.39)
+    sunset = np.arccos(np.clip(-np.tan(phi) * np.tan(declination), -1.0, 1.0))
+    radiation = (24 * 60 / np.pi * SOLAR_CONSTANT * inverse_distance
+                 * (sunset * np.sin(phi) * np.sin(declination)
+                    + np.cos(phi) * np.cos(declination) * np.sin(sunset)))
+    spread = np.sqrt(np.maximum(temperature_max - temperature_min, 0.0))
+    return np.maximum(0.0023 * 0.408 * radiation * (temperature + 17.8) * spread, 0.0)
+
+
+def _segment_starts(reset):
+    """For each row, the position of the last row where ``reset`` is True (inclusive)."""
+    positions = np.arange(len(reset))
+    return np.maximum.accumulate(np.where(reset, positions, 0)) if len(reset) else positions
+
+
+def compute_risk_indicators(data, window=30, carry=None):
+    """
+    Computes agronomic risk indicators for every parcel and day in one vectorized pass.
+
+    ``data`` holds weather rows (hourly or daily) per parcel, optionally with
+    'stress_hydrique', 'capacite_retention_eau' and 'latitude'; it is not
+    modified. Returned columns, one row per parcel and day:
+
+    - 'deficit_precipitation': reference evapotranspiration minus
+      precipitation, summed over the last ``window`` days (mm, >= 0)
+    - 'jours_chaleur_consecutifs': consecutive days above ``HEAT_THRESHOLD``
+    - 'degres_jours': growing degree days accumulated over the parcel's
+      days of the current calendar year
+    - 'stress_sol': deficit relative to the soil's available water (0-1)
+    - 'stress_combine': mean of 'stress_sol' and 'stress_hydrique'
+    - 'drought_risk' / 'heat_risk': boolean flags (stress_sol >= 0.5, heat day)
+    - 'risk_score': weighted combination of the above, in [0, 1]
+
+    ``carry`` (indexed by parcel, columns 'date' and 'degres_jours') gives
+    the degree days accumulated before the first row of each parcel, used
+    when only recent days are recomputed.
+    """
+    days = daily_inputs(data)
+    n = len(days)
+    codes = pd.factorize(days['parcelle_id'])[0]
+    day_numbers = days['date'].to_numpy().astype('datetime64[D]').astype(np.int64)
+    tmin = days['temperature_min'].to_numpy()
+    tmax = days['temperature_max'].to_numpy()
+    latitude = days['latitude'].to_numpy() if 'latitude' in days else np.full(n, DEFAULT_LATITUDE)
+    latitude = np.where(np.isnan(latitude), DEFAULT_LATITUDE, latitude)
+
+    new_parcel = np.concatenate(([True], codes[1:] != codes[:-1])) if n else np.zeros(0, dtype=bool)
+    follows = np.concatenate(([False], np.diff(day_numbers) == 1)) & ~new_parcel
+
+    # Rolling water balance over calendar days, from prefix sums within each parcel
+    evapotranspiration = reference_evapotranspiration(days['date'], tmin, tmax,
+                                                      days['temperature'].to_numpy(), latitude)
+    balance = evapotranspiration - days['precipitation'].to_numpy()
+    # (parcel, day) keys: a window never reaches back into the previous parcel
+    span = int(np.ptp(day_numbers)) + window + 1 if n else 1
+    keys = codes.astype(np.int64) * span + day_numbers
+    window_starts = np.searchsorted(keys, keys - window + 1, side='left')
+    cumulative = np.concatenate(([0.0], np.cumsum(balance)))
+    deficit = np.maximum(cumulative[1:] - cumulative[window_starts], 0.0)
+
+    # Runs of consecutive heat days, reset by a cool day, a gap or a new parcel
+    hot = tmax > HEAT_THRESHOLD
+    run_starts = _segment_starts(~(follows & np.concatenate(([False], hot[:-1]))))
+    heat_run = np.where(hot, np.arange(n) - run_starts + 1, 0)
+
+    # Growing degree days accumulated per parcel and calendar year
+    years = days['date'].dt.year.to_numpy()
+    new_season = new_parcel | np.concatenate(([True], years[1:] != years[:-1]))
+    daily_gdd = np.maximum((tmin + tmax) / 2 - GDD_BASE_TEMPERATURE, 0.0)
+    cumulative_gdd = np.cumsum(daily_gdd)
+    season_starts = _segment_starts(new_season)
+    gdd = cumulative_gdd - cumulative_gdd[season_starts] + daily_gdd[season_starts]
+    if carry is not None and len(carry):
+        carried = carry.reindex(days['parcelle_id'].to_numpy())
+        same_year = carried['date'].dt.year.to_numpy() == years
+        gdd = gdd + np.where(same_year, carried['degres_jours'].fillna(0.0).to_numpy(), 0.0)
+
+    # Deficit against the soil's available water, combined with observed crop stress
+    retention = (days['capacite_retention_eau'].to_numpy() if 'capacite_retention_eau' in days
+                 else np.full(n, np.nan))
+    reserve = np.where(np.isnan(retention), 1.0, retention) * ROOT_ZONE_WATER_MM
+    soil_stress = np.clip(deficit / reserve, 0.0, 1.0)
+    if 'stress_hydrique' in days:
+        crop_stress = np.clip(days['stress_hydrique'].to_numpy(), 0.0, 1.0)
+        combined = np.where(np.isnan(crop_stress), soil_stress, (soil_stress + crop_stress) / 2)
+    else:
+        combined = soil_stress
+    heat = np.minimum(heat_run / HEAT_RUN_SATURATION, 1.0)
+
+    indicators = days[['parcelle_id', 'date']].copy()
+    indicators['deficit_precipitation'] = deficit
+    indicators['jours_chaleur_consecutifs'] = heat_run
+    indicators['degres_jours'] = gdd
+    indicators['stress_sol'] = soil_stress
+    indicators['stress_combine'] = combined
+    indicators['drought_risk'] = soil_stress >= 0.5
+    indicators['heat_risk'] = hot
+    indicators['risk_score'] = np.clip(RISK_WEIGHTS['stress_combine'] * combined
+                                       + RISK_WEIGHTS['chaleur'] * heat, 0.0, 1.0)
+    return indicators
+
+
+def parcel_risk_scores(indicators):
+    """Returns the mean daily 'risk_score' of each parcel."""
+    return (indicators.groupby('parcelle_id', observed=True)['risk_score'].mean()
+            .rename('risk_score').reset_index())
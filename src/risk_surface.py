@@ -0,0 +1,71 @@
+import numpy as np
+
+
+def _gaussian_matrix(size, sigma):
+    """Returns the (size x size) matrix applying a 1-D Gaussian blur of ``sigma`` cells."""
+    positions = np.arange(size)
+    return np.exp(-0.5 * ((positions[:, None] - positions[None, :]) / sigma) ** 2)
+
+
+def grid_bounds(latitudes, longitudes, padding=0.1):
+    """
+    Returns ``[[lat_min, lon_min], [lat_max, lon_max]]`` around the points.
+
+    ``padding`` is the fraction of the extent added on every side, so the
+    smoothed surface is not cut at the outermost parcels.
+    """
+    lat_min, lat_max = float(np.min(latitudes)), float(np.max(latitudes))
+    lon_min, lon_max = float(np.min(longitudes)), float(np.max(longitudes))
+    lat_pad = max(lat_max - lat_min, 1e-3) * padding
+    lon_pad = max(lon_max - lon_min, 1e-3) * padding
+    return [[lat_min - lat_pad, lon_min - lon_pad], [lat_max + lat_pad, lon_max + lon_pad]]
+
+
+def risk_grid(latitudes, longitudes, risk, bounds, shape=(128, 128), bandwidth=4.0):
+    """
+    Bins per-parcel risk onto a regular lat/lon grid and smooths it.
+
+    The surface is a kernel-weighted mean (Nadaraya-Watson): risk-weighted
+    counts and plain counts are both blurred by a Gaussian of ``bandwidth``
+    cells, then divided. The second returned grid is the smoothed density,
+    used to fade out cells far from any parcel. Row 0 is the southern edge.
+    The cost depends on the number of points (binning) and on ``shape``
+    (smoothing), not on how many markers would have been drawn.
+    """
+    (lat_min, lon_min), (lat_max, lon_max) = bounds
+    rows, cols = shape
+    edges = (np.linspace(lat_min, lat_max, rows + 1), np.linspace(lon_min, lon_max, cols + 1))
+
+    weighted, _, _ = np.histogram2d(latitudes, longitudes, bins=edges, weights=risk)
+    counts, _, _ = np.histogram2d(latitudes, longitudes, bins=edges)
+
+    # Separable Gaussian blur written as two matrix products
+    blur_rows = _gaussian_matrix(rows, bandwidth)
+    blur_cols = _gaussian_matrix(cols, bandwidth)
+    weighted = blur_rows @ weighted @ blur_cols.T
+    density = blur_rows @ counts @ blur_cols.T
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        surface = np.where(density > 1e-9, weighted / density, 0.0)
+    return surface, density
+
+
+def surface_to_rgba(surface, density, colors, vmin=0.0, vmax=1.0, max_alpha=0.7):
+    """
+    Colors a risk surface into an RGBA ``uint8`` image.
+
+    ``colors`` is a list of RGB(A) float tuples evenly spread between ``vmin``
+    and ``vmax``. Transparency follows the smoothed parcel density so that
+    areas without parcels stay see-through.
+    """
+    colors = np.asarray(colors, dtype=float)[:, :3]
+    stops = np.linspace(vmin, vmax, len(colors))
+    values = np.clip(surface, vmin, vmax)
+
+    image = np.empty(surface.shape + (4,), dtype=float)
+    for channel in range(3):
+        image[..., channel] = np.interp(values, stops, colors[:, channel])
+
+    peak = density.max()
+    image[..., 3] = max_alpha * np.clip(density / peak, 0.0, 1.0) ** 0.5 if peak > 0 else 0.0
+    return (image * 255).round().astype(np.uint8)
@@ -0,0 +1,110 @@
+import numpy as np
+
+
+KM_PER_DEGREE_LAT = 110.574
+KM_PER_DEGREE_LON = 111.320
+
+
+class ParcelSpatialIndex:
+    def __init__(self, parcel_ids, latitudes, longitudes, cell_size_km=None):
+        """
+        Uniform grid index over parcel coordinates.
+
+        Coordinates are projected to kilometres (equirectangular projection
+        around the mean latitude, accurate at regional scale) and bucketed in
+        square cells stored in CSR form: positions sorted by cell plus one
+        offset per cell. By default cells hold about four parcels each.
+        """
+        self.parcel_ids = np.asarray(parcel_ids)
+        self.latitudes = np.asarray(latitudes, dtype=float)
+        self.longitudes = np.asarray(longitudes, dtype=float)
+        self.lat0 = float(self.latitudes.mean()) if len(self.latitudes) else 0.0
+
+        x, y = self._project(self.latitudes, self.longitudes)
+        self.x0 = float(x.min()) if len(x) else 0.0
+        self.y0 = float(y.min()) if len(y) else 0.0
+        if cell_size_km is None:
+            extent = max(np.ptp(x), np.ptp(y), 1e-3) if len(x) else 1.0
+            cell_size_km = extent / max(np.sqrt(len(x) / 4.0), 1.0)
+        self.cell_size = float(cell_size_km)
+
+        cols = ((x - self.x0) // self.cell_size).astype(np.int64)
+        rows = ((y - self.y0) // self.cell_size).astype(np.int64)
+        self.n_cols = int(cols.max()) + 1 if len(cols) else 1
+        self.n_rows = int(rows.max()) + 1 if len(rows) else 1
+
+        cells = rows * self.n_cols + cols
+        self.order = np.argsort(cells, kind='stable')
+        self.offsets = np.searchsorted(cells[self.order], np.arange(self.n_rows * self.n_cols + 1))
+        self.x, self.y = x, y
+
+    def _project(self, latitudes, longitudes):
+        """Projects coordinates to kilometres around the reference latitude."""
+        x = np.asarray(longitudes, dtype=float) * KM_PER_DEGREE_LON * np.cos(np.radians(self.lat0))
+        y = np.asarray(latitudes, dtype=float) * KM_PER_DEGREE_LAT
+        return x, y
+
+    def _cell_of(self, x, y):
+        return int((x - self.x0) // self.cell_size), int((y - self.y0) // self.cell_size)
+
+    def _positions_in_cells(self, row_min, row_max, col_min, col_max):
+        """Returns the positions of all parcels stored in a rectangle of cells."""
+        row_min, col_min = max(row_min, 0), max(col_min, 0)
+        row_max, col_max = min(row_max, self.n_rows - 1), min(col_max, self.n_cols - 1)
+        if row_min > row_max or col_min > col_max:
+            return np.empty(0, dtype=np.int64)
+
+        rows = np.arange(row_min, row_max + 1)
+        cols = np.arange(col_min, col_max + 1)
+        cells = (rows[:, None] * self.n_cols + cols[None, :]).ravel()
+        starts, stops = self.offsets[cells], self.offsets[cells + 1]
+
+        # Concatenate the ranges [start, stop) of every cell without a Python loop
+        lengths = stops - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return np.empty(0, dtype=np.int64)
+        shifts = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        return self.order[np.arange(total) + shifts]
+
+    def query_bbox(self, south, west, north, east):
+        """
+        Returns the positions of the parcels inside a latitude/longitude bounding box.
+        """
+        x_pair, y_pair = self._project([south, north], [west, east])
+        x_min, x_max = sorted(x_pair)
+        y_min, y_max = sorted(y_pair)
+        col_min, row_min = self._cell_of(x_min, y_min)
+        col_max, row_max = self._cell_of(x_max, y_max)
+
+        candidates = self._positions_in_cells(row_min, row_max, col_min, col_max)
+        lat, lon = self.latitudes[candidates], self.longitudes[candidates]
+        inside = (lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)
+        return np.sort(candidates[inside])
+
+    def nearest(self, latitude, longitude, k=5):
+        """
+        Returns the positions of the ``k`` nearest parcels and their distances in km.
+
+        Rings of cells are searched outward from the query cell until ``k``
+        candidates are found and no unexplored cell can hold a closer parcel.
+        """
+        k = min(k, len(self.parcel_ids))
+        if k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        qx, qy = self._project(latitude, longitude)
+        col, row = self._cell_of(float(qx), float(qy))
+        max_ring = max(self.n_rows, self.n_cols) + abs(row) + abs(col)
+
+        # Start from the first ring that reaches the grid
+        ring = max(0, -row, row - (self.n_rows - 1), -col, col - (self.n_cols - 1))
+        while True:
+            candidates = self._positions_in_cells(row - ring, row + ring, col - ring, col + ring)
+            if len(candidates) >= k or ring >= max_ring:
+                distances = np.hypot(self.x[candidates] - qx, self.y[candidates] - qy)
+                best = np.argsort(distances, kind='stable')[:k]
+                # Anything outside the searched square is at least `ring` cells away
+                if len(best) == k and (distances[best[-1]] <= ring * self.cell_size or ring >= max_ring):
+                    return candidates[best], distances[best]
+            ring += 1
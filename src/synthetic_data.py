@@ -0,0 +1,201 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_manager import DATASET_FILES
+
+
+# Crops with their mean and standard deviation of yield (tonnes/ha)
+CROPS = {
+    'Ble': (6.5, 2.9),
+    'Mais': (10.8, 4.7),
+    'Tournesol': (3.3, 1.4),
+}
+
+SOIL_TYPES = ['argileux', 'argilo-limoneux', 'sablo-limoneux']
+
+# Center of the parcels of the real data set, and its spread in degrees for 50 parcels
+CENTER = (33.878, -5.552)
+SPREAD = 0.022
+
+# Share of solar radiation readings replaced by the -999.99 sensor error code
+RADIATION_ERROR_RATE = 1e-4
+
+# Columns of each file, in the order of the real data set
+MONITORING_COLUMNS = ['date', 'parcelle_id', 'culture', 'ndvi', 'lai', 'stress_hydrique',
+                      'biomasse_estimee', 'latitude', 'longitude']
+WEATHER_COLUMNS = ['date', 'temperature', 'humidite', 'precipitation', 'rayonnement_solaire',
+                   'vitesse_vent', 'direction_vent']
+STATION_COLUMNS = ['station_id', 'latitude', 'longitude']
+SOIL_COLUMNS = ['parcelle_id', 'latitude', 'longitude', 'type_sol', 'surface_ha', 'capacite_retention_eau',
+                'ph', 'matiere_organique', 'azote', 'phosphore', 'potassium']
+YIELD_COLUMNS = ['parcelle_id', 'annee', 'culture', 'rendement']
+
+
+def parcel_ids(n_parcels):
+    """Returns the ids 'P001', 'P002', ... (wider when there are more than 999 parcels)."""
+    width = max(3, len(str(n_parcels)))
+    return np.array([f"P{i:0{width}d}" for i in range(1, n_parcels + 1)])
+
+
+def generate_soil(ids, rng):
+    """One row per parcel; the parcels spread further out as their number grows."""
+    n = len(ids)
+    spread = SPREAD * np.sqrt(n / 50)
+    return pd.DataFrame({
+        'parcelle_id': ids,
+        'latitude': np.round(CENTER[0] + rng.uniform(-spread, spread, n), 6),
+        'longitude': np.round(CENTER[1] + rng.uniform(-spread, spread, n), 6),
+        'type_sol': rng.choice(SOIL_TYPES, n),
+        'surface_ha': np.round(rng.uniform(5, 22, n), 2),
+        'capacite_retention_eau': np.round(rng.uniform(0.4, 0.9, n), 2),
+        'ph': np.round(rng.uniform(6.0, 8.0, n), 1),
+        'matiere_organique': np.round(rng.uniform(1.5, 5.0, n), 2),
+        'azote': np.round(rng.uniform(0.1, 0.3, n), 3),
+        'phosphore': np.round(rng.uniform(20, 60, n), 1),
+        'potassium': np.round(rng.uniform(150, 360, n), 1),
+    })[SOIL_COLUMNS]
+
+
+def generate_yields(ids, years, rng):
+    """One row per parcel and year, with a crop drawn each year."""
+    crops = np.array(list(CROPS))
+    parcels = np.repeat(ids, len(years))
+    culture = rng.choice(crops, len(parcels))
+    mean = np.array([CROPS[crop][0] for crop in culture])
+    std = np.array([CROPS[crop][1] for crop in culture])
+    return pd.DataFrame({
+        'parcelle_id': parcels,
+        'annee': np.tile(years, len(ids)),
+        'culture': culture,
+        'rendement': np.round(np.clip(rng.normal(mean, std), 0.5, None), 2),
+    })[YIELD_COLUMNS]
+
+
+def generate_weather(start, end, rng):
+    """Hourly readings from ``start`` to the end of ``end``, with daily and seasonal cycles."""
+    dates = pd.date_range(pd.Timestamp(start), pd.Timestamp(end) + pd.Timedelta(hours=23), freq='h')
+    n = len(dates)
+    season = np.cos(2 * np.pi * (dates.dayofyear.to_numpy() - 200) / 365.25)
+    daylight = np.sin(np.pi * (dates.hour.to_numpy() - 6) / 12)
+
+    temperature = 15 + 9 * season + 5 * daylight + rng.normal(0, 2, n)
+    radiation = np.clip(daylight, 0, None) * (600 + 300 * season) * rng.uniform(0.6, 1.0, n)
+    radiation[rng.random(n) < RADIATION_ERROR_RATE] = -999.99
+    raining = rng.random(n) < 0.1 * (1 - 0.5 * season)
+    return pd.DataFrame({
+        'date': dates,
+        'temperature': np.round(temperature, 2),
+        'humidite': np.round(np.clip(70 - 15 * season - 10 * daylight + rng.normal(0, 8, n), 30, 100), 2),
+        'precipitation': np.round(np.where(raining, rng.exponential(2.0, n), 0.0), 1),
+        'rayonnement_solaire': np.round(radiation, 2),
+        'vitesse_vent': np.round(np.clip(rng.normal(5.3, 2.7, n), 0, None), 1),
+        'direction_vent': np.round(rng.uniform(0, 360, n), 1),
+    })[WEATHER_COLUMNS]
+
+
+def generate_stations(weather, n_stations, n_parcels, rng):
+    """
+    Repeats ``weather`` for ``n_stations`` stations spread over the parcels'
+    area, each with its own temperature offset and rain multiplier, and
+    adds the station id and coordinates to every reading.
+    """
+    spread = SPREAD * np.sqrt(n_parcels / 50)
+    stations = []
+    for i in range(n_stations):
+        station = weather.copy()
+        station['temperature'] = np.round(station['temperature'] + rng.normal(0, 1.5), 2)
+        station['precipitation'] = np.round(station['precipitation'] * rng.uniform(0.6, 1.4), 1)
+        station.insert(0, 'longitude', np.round(CENTER[1] + rng.uniform(-spread, spread), 6))
+        station.insert(0, 'latitude', np.round(CENTER[0] + rng.uniform(-spread, spread), 6))
+        station.insert(0, 'station_id', f"S{i + 1:02d}")
+        stations.append(station)
+    return pd.concat(stations, ignore_index=True)[STATION_COLUMNS + WEATHER_COLUMNS]
+
+
+def generate_monitoring(soil, yields, start, end, rng):
+    """
+    Daily observations of each parcel of ``soil`` from a random first day
+    (within 90 days of ``start``) to ``end``. The crop of each day is the
+    crop of that year in ``yields``; NDVI, LAI and biomass follow a growth
+    curve peaking at a per-parcel day of the year.
+    """
+    days = pd.date_range(pd.Timestamp(start), pd.Timestamp(end), freq='D').to_numpy()
+    n = len(soil)
+    first = rng.integers(0, min(90, len(days)), n)
+    counts = len(days) - first
+
+    rows = np.repeat(np.arange(n), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    dates = days[np.repeat(first, counts) + offsets]
+
+    years = dates.astype('datetime64[Y]').astype(np.int64) + 1970
+    crops = yields.set_index(['parcelle_id', 'annee'])['culture']
+    keys = pd.MultiIndex.from_arrays([soil['parcelle_id'].to_numpy()[rows], years])
+    culture = crops.reindex(keys).to_numpy()
+
+    day_of_year = (dates - dates.astype('datetime64[Y]')).astype('timedelta64[D]').astype(np.int64)
+    peak = rng.uniform(110, 180, n)[rows]
+    growth = np.exp(-((day_of_year - peak) / 45) ** 2)
+    size = len(rows)
+    lai = np.clip(5.5 * growth + rng.normal(0, 0.3, size), 0.1, None)
+    return pd.DataFrame({
+        'date': dates,
+        'parcelle_id': soil['parcelle_id'].to_numpy()[rows],
+        'culture': culture,
+        'ndvi': np.round(np.clip(0.35 + 0.5 * growth + rng.normal(0, 0.04, size), 0.1, 0.95), 3),
+        'lai': np.round(lai, 2),
+        'stress_hydrique': np.round(np.clip(rng.gamma(1.6, 0.05, size), 0.001, 0.5), 3),
+        'biomasse_estimee': np.round(lai * rng.uniform(6, 9, size), 2),
+        'latitude': soil['latitude'].to_numpy()[rows],
+        'longitude': soil['longitude'].to_numpy()[rows],
+    })[MONITORING_COLUMNS]
+
+
+def generate_dataset(directory, n_parcels=50, start='2024-01-01', end='2024-12-31', history_years=4,
+                     seed=0, chunk_parcels=1000, n_stations=1):
+    """
+    Writes a synthetic data set with the files and columns of ``data/`` to ``directory``.
+
+    Monitoring covers ``n_parcels`` parcels from ``start`` to ``end``; hourly
+    weather covers ``history_years`` years before ``start`` up to ``end``,
+    like yield history. With ``n_stations`` above 1, weather is recorded by
+    that many stations, with their id and coordinates. Monitoring rows are
+    generated and written ``chunk_parcels`` parcels at a time, so memory
+    does not grow with the number of parcels. Returns the number of rows
+    written per file.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    years = np.arange(start.year - history_years, end.year + 1)
+
+    ids = parcel_ids(n_parcels)
+    soil = generate_soil(ids, rng)
+    yields = generate_yields(ids, years, rng)
+    weather = generate_weather(pd.Timestamp(f"{years[0]}-01-01"), end, rng)
+    if n_stations > 1:
+        weather = generate_stations(weather, n_stations, n_parcels, rng)
+
+    def path(name):
+        return os.path.join(directory, DATASET_FILES[name][0])
+
+    soil.to_csv(path('soil_data'), index=False)
+    yields.to_csv(path('yield_history'), index=False)
+    weather.to_csv(path('weather_data'), index=False, date_format='%Y-%m-%d %H:%M:%S')
+
+    monitoring_rows = 0
+    for first in range(0, n_parcels, chunk_parcels):
+        block = generate_monitoring(soil.iloc[first:first + chunk_parcels], yields, start, end, rng)
+        block.to_csv(path('monitoring_data'), index=False, date_format='%Y-%m-%d',
+                     mode='w' if first == 0 else 'a', header=first == 0)
+        monitoring_rows += len(block)
+
+    return {'monitoring_data': monitoring_rows, 'weather_data': len(weather),
+            'soil_data': len(soil), 'yield_history': len(yields)}
+
+
+if __name__ == "__main__":
+    counts = generate_dataset(os.path.join('data', 'synthetique', 'x10'), n_parcels=500)
+    print(counts)
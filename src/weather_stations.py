@@ -0,0 +1,183 @@
+import numpy as np
+import pandas as pd
+
+from spatial_index import KM_PER_DEGREE_LAT, KM_PER_DEGREE_LON
+
+
+# Station of weather files without a 'station_id' column: one farm-wide series
+DEFAULT_STATION = 'ferme'
+
+# Columns identifying and locating the station of each weather reading
+STATION_COLUMNS = ['station_id', 'latitude', 'longitude']
+
+# Weather columns taken from the nearest station instead of blended (circular values)
+UNBLENDED_COLUMNS = ['direction_vent']
+
+# Parcels whose station distances are computed at once, bounding the distance matrix
+PARCELS_PER_BLOCK = 4096
+
+
+def weather_stations(weather):
+    """
+    Returns one row per station of ``weather``: 'station_id', 'latitude' and
+    'longitude' (NaN for the default station of single-series files).
+    """
+    if weather is None or 'station_id' not in weather.columns:
+        return pd.DataFrame({'station_id': [DEFAULT_STATION], 'latitude': [np.nan], 'longitude': [np.nan]})
+    columns = [column for column in STATION_COLUMNS if column in weather.columns]
+    stations = (weather[columns].drop_duplicates('station_id').astype({'station_id': str})
+                .sort_values('station_id', ignore_index=True))
+    return stations.reindex(columns=STATION_COLUMNS)
+
+
+def assign_stations(parcel_ids, latitudes, longitudes, stations, method='nearest', k=3, power=2.0):
+    """
+    Assigns each parcel to weather stations from their coordinates.
+
+    With ``method='nearest'`` a parcel gets its nearest station; with
+    ``'idw'`` its ``k`` nearest, weighted by inverse distance to the power
+    ``power`` (a station at the parcel's location takes all the weight).
+    Parcels without coordinates are placed at the mean parcel location, or
+    at the mean station location when no parcel has coordinates. Distances
+    are in km (equirectangular projection). Returns one row per parcel and
+    station: 'parcelle_id', 'station_id', 'rang' (0 for the nearest),
+    'distance_km' and 'poids' (summing to 1 per parcel).
+    """
+    parcel_ids = np.asarray(parcel_ids)
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    station_ids = stations['station_id'].to_numpy()
+    station_lat = stations['latitude'].to_numpy(dtype=np.float64)
+    station_lon = stations['longitude'].to_numpy(dtype=np.float64)
+    k = 1 if method == 'nearest' else max(1, min(k, len(station_ids)))
+
+    if np.isnan(station_lat).any() or np.isnan(station_lon).any():
+        # Stations without coordinates cannot be ranked: the first one serves every parcel
+        ranks = np.zeros((len(parcel_ids), 1), dtype=np.int64)
+        distances = np.full((len(parcel_ids), 1), np.nan)
+        weights = np.ones((len(parcel_ids), 1))
+    else:
+        known = ~(np.isnan(latitudes) | np.isnan(longitudes))
+        if not known.all():
+            center_lat, center_lon = ((latitudes[known].mean(), longitudes[known].mean()) if known.any()
+                                      else (station_lat.mean(), station_lon.mean()))
+            latitudes = np.where(known, latitudes, center_lat)
+            longitudes = np.where(known, longitudes, center_lon)
+        scale = KM_PER_DEGREE_LON * np.cos(np.radians(latitudes.mean() if len(latitudes) else 0.0))
+
+        ranks = np.empty((len(parcel_ids), k), dtype=np.int64)
+        distances = np.empty((len(parcel_ids), k))
+        for start in range(0, len(parcel_ids), PARCELS_PER_BLOCK):
+            block = slice(start, start + PARCELS_PER_BLOCK)
+            matrix = np.hypot((longitudes[block, None] - station_lon[None, :]) * scale,
+                              (latitudes[block, None] - station_lat[None, :]) * KM_PER_DEGREE_LAT)
+            nearest = np.argpartition(matrix, k - 1, axis=1)[:, :k] if k < matrix.shape[1] else \
+                np.broadcast_to(np.arange(matrix.shape[1]), matrix.shape)
+            found = np.take_along_axis(matrix, nearest, axis=1)
+            order = np.argsort(found, axis=1, kind='stable')
+            ranks[block] = np.take_along_axis(nearest, order, axis=1)
+            distances[block] = np.take_along_axis(found, order, axis=1)
+
+        with np.errstate(divide='ignore'):
+            weights = 1.0 / distances ** power
+        on_station = distances[:, :1] == 0
+        weights = np.where(on_station, (np.arange(k) == 0).astype(np.float64)[None, :], weights)
+        weights /= weights.sum(axis=1, keepdims=True)
+
+    n_ranks = ranks.shape[1]
+    return pd.DataFrame({
+        'parcelle_id': np.repeat(parcel_ids, n_ranks),
+        'station_id': station_ids[ranks.ravel()],
+        'rang': np.tile(np.arange(n_ranks), len(parcel_ids)),
+        'distance_km': distances.ravel(),
+        'poids': weights.ravel(),
+    })
+
+
+def join_station_weather(observations, weather, partitions, assignment, exact_day=False):
+    """
+    Joins each observation with the weather of its parcel's stations.
+
+    ``weather`` is sorted by station then date and ``partitions`` maps each
+    station to the slice (or date-ordered positions) of its rows, so no sort
+    happens here: observations are located in each station's dates by
+    binary search, the latest reading at or before them (or, with
+    ``exact_day``, the reading of the same day). With several stations per
+    parcel the numeric columns are the weighted mean of the stations'
+    values, renormalized over the stations with a value;
+    ``UNBLENDED_COLUMNS`` and 'station_id' come from the nearest station.
+
+    Returns the weather columns (without date and station coordinates), one
+    row per observation in the order of ``observations``.
+    """
+    columns = [column for column in weather.columns if column not in ['date'] + STATION_COLUMNS]
+    n = len(observations)
+    parcel_codes, parcels = pd.factorize(observations['parcelle_id'])
+    dates = observations['date'].to_numpy().astype('datetime64[ns]')
+    if exact_day:
+        dates = dates.astype('datetime64[D]').astype('datetime64[ns]')
+    weather_dates = weather['date'].to_numpy().astype('datetime64[ns]')
+
+    # (parcel, rank) -> station and weight, looked up per observation
+    assignment = assignment.astype({'parcelle_id': str, 'station_id': str})
+    n_ranks = int(assignment['rang'].max()) + 1 if len(assignment) else 1
+    parcel_index = pd.Index(assignment.loc[assignment['rang'] == 0, 'parcelle_id'].to_numpy())
+    station_codes = {station: i for i, station in enumerate(partitions)}
+    station_grid = np.full((len(parcel_index), n_ranks), -1, dtype=np.int64)
+    weight_grid = np.zeros((len(parcel_index), n_ranks))
+    rows = parcel_index.get_indexer(assignment['parcelle_id'].to_numpy())
+    station_grid[rows, assignment['rang'].to_numpy()] = [station_codes.get(s, -1) for s in assignment['station_id']]
+    weight_grid[rows, assignment['rang'].to_numpy()] = assignment['poids'].to_numpy()
+    # Unique parcels are looked up once, missing ids (code -1) get the trailing -1
+    positions = np.append(parcel_index.get_indexer(np.asarray(parcels).astype(str)), -1)[parcel_codes]
+
+    # Row of `weather` matched by each observation for each rank, -1 when none
+    matches = np.full((n, n_ranks), -1, dtype=np.int64)
+    weights = np.zeros((n, n_ranks))
+    known = positions >= 0
+    for rank in range(n_ranks):
+        stations = np.where(known, station_grid[positions, rank], -1)
+        weights[:, rank] = np.where(known, weight_grid[positions, rank], 0.0)
+        for station, code in station_codes.items():
+            selected = np.flatnonzero(stations == code)
+            if not len(selected):
+                continue
+            rows = partitions[station]
+            station_dates = weather_dates[rows]
+            if exact_day:
+                found = np.searchsorted(station_dates, dates[selected], side='left')
+                hit = found < len(station_dates)
+                hit[hit] = station_dates[found[hit]] == dates[selected][hit]
+            else:
+                found = np.searchsorted(station_dates, dates[selected], side='right') - 1
+                hit = found >= 0
+            matches[selected[hit], rank] = (rows.start + found[hit] if isinstance(rows, slice)
+                                            else rows[found[hit]])
+
+    joined = {}
+    for column in columns:
+        values = weather[column].to_numpy()
+        if column in UNBLENDED_COLUMNS or n_ranks == 1 or not np.issubdtype(values.dtype, np.number):
+            taken = values.take(np.maximum(matches[:, 0], 0))
+            if np.issubdtype(values.dtype, np.number):
+                taken = np.where(matches[:, 0] >= 0, taken, np.nan)
+            else:
+                taken = np.where(matches[:, 0] >= 0, taken, None)
+            joined[column] = taken
+            continue
+        values = values.astype(np.float64)
+        total = np.zeros(n)
+        weight_sum = np.zeros(n)
+        for rank in range(n_ranks):
+            taken = np.where(matches[:, rank] >= 0, values.take(np.maximum(matches[:, rank], 0)), np.nan)
+            valid = ~np.isnan(taken)
+            total += np.where(valid, taken * weights[:, rank], 0.0)
+            weight_sum += np.where(valid, weights[:, rank], 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            joined[column] = np.where(weight_sum > 0, total / weight_sum, np.nan)
+
+    if 'station_id' in weather.columns:
+        nearest = np.array(list(partitions), dtype=object)
+        first = np.where(known, station_grid[positions, 0], -1)
+        joined['station_id'] = np.where(first >= 0, nearest[np.maximum(first, 0)], None)
+    return pd.DataFrame(joined, index=observations.index)
@@ -0,0 +1,65 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+# Parcels sent to a worker process per task, to amortize inter-process overhead
+PARCELS_PER_TASK = 256
+
+
+def history_digest(years, values):
+    """
+    Hashes a yield series (years and values), used to key memoized decompositions.
+    """
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(years, dtype=np.int64).tobytes())
+    digest.update(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def decompose_series(values, period, model='additive'):
+    """
+    Decomposes one yield series into trend, seasonal and residual components.
+
+    Series shorter than two full periods cannot be decomposed; their
+    components are returned as NaN.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if period < 1 or len(values) < 2 * period or np.isnan(values).any():
+        empty = np.full(len(values), np.nan)
+        return empty, empty.copy(), empty.copy()
+
+    # statsmodels is only needed here, so it is not imported with the module
+    from statsmodels.tsa.seasonal import seasonal_decompose
+
+    result = seasonal_decompose(values, model=model, period=period)
+    return np.asarray(result.trend), np.asarray(result.seasonal), np.asarray(result.resid)
+
+
+def decompose_batch(series, period, model='additive'):
+    """
+    Decomposes a list of ``(key, values)`` series; the unit of work of a worker process.
+    """
+    return [(key, decompose_series(values, period, model)) for key, values in series]
+
+
+def decompose_many(series, period, model='additive', max_workers=None):
+    """
+    Decomposes many ``(key, values)`` series, spread over a process pool.
+
+    ``max_workers`` defaults to the number of CPUs; with one worker, or
+    fewer series than one task holds, everything runs in this process.
+    Returns a dict mapping each key to its ``(trend, seasonal, resid)``.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers == 1 or len(series) <= PARCELS_PER_TASK:
+        return dict(decompose_batch(series, period, model))
+
+    tasks = [series[i:i + PARCELS_PER_TASK] for i in range(0, len(series), PARCELS_PER_TASK)]
+    results = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for batch in executor.map(decompose_batch, tasks, [period] * len(tasks), [model] * len(tasks)):
+            results.update(batch)
+    return results
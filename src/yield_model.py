@@ -0,0 +1,201 @@
+import hashlib
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+
+# Per-season aggregates of the prepared features: column -> reductions
+SEASON_AGGREGATIONS = {
+    'ndvi': ['mean', 'max'],
+    'lai': ['mean', 'max'],
+    'stress_hydrique': ['mean', 'max'],
+    'biomasse_estimee': ['max'],
+    'temperature': ['mean'],
+    'temperature_max': ['max'],
+    'humidite': ['mean'],
+    'precipitation': ['mean'],
+    'rayonnement_solaire': ['mean'],
+}
+
+# Soil properties, constant over a season
+SOIL_FEATURES = ['surface_ha', 'capacite_retention_eau', 'ph', 'matiere_organique',
+                 'azote', 'phosphore', 'potassium']
+
+# Yields of the previous seasons, known before the harvest being predicted
+HISTORY_FEATURES = ['rendement_precedent', 'rendement_moyen_precedent', 'rendement_culture_precedent']
+
+# Categorical inputs, one-hot encoded with the categories seen at training time
+CATEGORICAL_FEATURES = ['culture', 'type_sol']
+
+
+def yield_lags(yield_history):
+    """
+    Computes, for each parcel and year, statistics of the yields of earlier years only.
+
+    'rendement_precedent' is last year's yield, 'rendement_moyen_precedent'
+    the mean of all earlier years and 'rendement_culture_precedent' the mean
+    of earlier years with the same crop (NaN when there is none).
+    """
+    history = yield_history.sort_values(['parcelle_id', 'annee'], kind='stable')
+    by_parcel = history.groupby('parcelle_id', observed=True)['rendement']
+    by_crop = history.groupby(['parcelle_id', 'culture'], observed=True)['rendement']
+
+    lags = history[['parcelle_id', 'annee']].copy()
+    lags['rendement_precedent'] = by_parcel.shift(1)
+    lags['rendement_moyen_precedent'] = (by_parcel.cumsum() - history['rendement']) / by_parcel.cumcount()
+    lags['rendement_culture_precedent'] = (by_crop.cumsum() - history['rendement']) / by_crop.cumcount()
+    return lags.replace([np.inf, -np.inf], np.nan)
+
+
+def season_features(features, yield_history):
+    """
+    Aggregates prepared features to one row per parcel and season.
+
+    ``features`` is the output of ``prepare_features`` (optionally enriched
+    with the yield history, whose 'rendement' becomes the training target).
+    The crop is the last one observed in the season.
+    """
+    aggregations = {column: reductions for column, reductions in SEASON_AGGREGATIONS.items()
+                    if column in features.columns}
+    grouped = features.sort_values('date', kind='stable').groupby(['parcelle_id', 'annee'], observed=True)
+
+    seasons = grouped.agg(aggregations)
+    seasons.columns = [f"{column}_{reduction}" for column, reduction in seasons.columns]
+
+    static = [column for column in ['culture', 'type_sol', 'rendement'] + SOIL_FEATURES
+              if column in features.columns]
+    seasons = seasons.join(grouped[static].last()).reset_index()
+
+    seasons = seasons.merge(yield_lags(yield_history), on=['parcelle_id', 'annee'], how='left')
+    return seasons
+
+
+def frame_digest(frame):
+    """Hashes the content of a DataFrame (values and column names)."""
+    digest = hashlib.sha1(','.join(map(str, frame.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+class YieldModel:
+    def __init__(self, regressor=None):
+        """
+        Yield regressor over season features: standardized inputs feeding an
+        sklearn regressor (ridge regression by default).
+
+        Missing inputs are replaced by their training mean; categorical
+        inputs are one-hot encoded with the categories seen by ``fit``.
+        """
+        self.regressor = regressor
+        self.pipeline = None
+        self.numeric_columns = []
+        self.categories = {}
+        self.fill_values = None
+        self.signature = None
+        # Signature of the datasets the model was last validated against, set by its owner
+        self.source_signature = None
+
+    def design_matrix(self, seasons):
+        """Builds the float64 input matrix of the model, one row per season."""
+        blocks = [seasons.reindex(columns=self.numeric_columns).to_numpy(dtype=np.float64)]
+        for column, categories in self.categories.items():
+            # Missing and unseen categories are encoded as all zeros
+            values = seasons[column] if column in seasons else pd.Series(np.nan, index=seasons.index)
+            present = values.notna().to_numpy()[:, None]
+            values = values.astype(str).to_numpy(dtype=object)[:, None]
+            blocks.append((present & (values == np.asarray(categories, dtype=object)[None, :])).astype(np.float64))
+        matrix = np.hstack(blocks)
+
+        if self.fill_values is not None:
+            missing = np.isnan(matrix)
+            matrix[missing] = np.broadcast_to(self.fill_values, matrix.shape)[missing]
+        return matrix
+
+    def fit(self, seasons, target='rendement'):
+        """
+        Fits the model on the seasons whose ``target`` yield is known.
+        """
+        # sklearn is only needed to train, so it is not imported with the module
+        from sklearn.linear_model import Ridge
+        from sklearn.pipeline import make_pipeline
+        from sklearn.preprocessing import StandardScaler
+
+        known = seasons[seasons[target].notna()]
+        if known.empty:
+            raise ValueError("No season with a known yield to train on")
+
+        excluded = {'parcelle_id', 'annee', target, *CATEGORICAL_FEATURES}
+        self.numeric_columns = [column for column in known.columns
+                                if column not in excluded and pd.api.types.is_numeric_dtype(known[column])]
+        self.categories = {column: sorted(known[column].dropna().astype(str).unique())
+                           for column in CATEGORICAL_FEATURES if column in known}
+
+        self.fill_values = None
+        matrix = self.design_matrix(known)
+        with np.errstate(invalid='ignore'):
+            self.fill_values = np.nan_to_num(np.nanmean(matrix, axis=0))
+        matrix = self.design_matrix(known)
+
+        self.pipeline = make_pipeline(StandardScaler(), self.regressor or Ridge(alpha=1.0))
+        self.pipeline.fit(matrix, known[target].to_numpy(dtype=np.float64))
+        self.signature = frame_digest(known)
+        return self
+
+    def is_trained_on(self, seasons, target='rendement'):
+        """Tells whether the model was fitted on exactly these seasons."""
+        return self.pipeline is not None and self.signature == frame_digest(seasons[seasons[target].notna()])
+
+    def predict(self, seasons):
+        """Predicts the yield of every season in one batched call."""
+        if len(seasons) == 0:
+            return np.empty(0)
+        return self.pipeline.predict(self.design_matrix(seasons))
+
+    def score(self, seasons, previous=None):
+        """
+        Scores seasons, reusing ``previous`` predictions for unchanged inputs.
+
+        Each season is fingerprinted by a hash of its input row; only rows
+        whose fingerprint is not found in ``previous`` (a frame returned by an
+        earlier call) are passed to the model. Returns 'parcelle_id', 'annee',
+        'predicted_yield' and 'empreinte' (the fingerprint).
+        """
+        inputs = seasons.drop(columns='rendement', errors='ignore')
+        fingerprints = pd.util.hash_pandas_object(inputs, index=False).to_numpy()
+
+        predictions = np.full(len(seasons), np.nan)
+        changed = np.ones(len(seasons), dtype=bool)
+        if previous is not None and len(previous):
+            known = pd.Series(previous['predicted_yield'].to_numpy(), index=previous['empreinte'].to_numpy())
+            known = known[~known.index.duplicated()]
+            positions = known.index.get_indexer(fingerprints)
+            changed = positions < 0
+            predictions[~changed] = known.to_numpy()[positions[~changed]]
+
+        if changed.any():
+            predictions[changed] = self.predict(seasons[changed])
+
+        return pd.DataFrame({'parcelle_id': seasons['parcelle_id'].to_numpy(),
+                             'annee': seasons['annee'].to_numpy(),
+                             'predicted_yield': predictions,
+                             'empreinte': fingerprints})
+
+    def save(self, path):
+        """Writes the fitted model to ``path`` (replaced atomically)."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as handle:
+            pickle.dump(self, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Reads a model written by ``save``; returns None if it is missing or unreadable."""
+        try:
+            with open(path, 'rb') as handle:
+                model = pickle.load(handle)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+        return model if isinstance(model, cls) else None
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from data_manager import AgriculturalDataManager  # noqa: E402
+from synthetic_data import generate_dataset  # noqa: E402
+
+
+@pytest.mark.parametrize('n_stations, station_join', [(1, 'nearest'), (3, 'nearest'), (3, 'idw')])
+@pytest.mark.parametrize('daily_weather', [False, True])
+def test_parcel_without_soil_row_gets_weather(tmp_path, n_stations, station_join, daily_weather):
+    generate_dataset(tmp_path, n_parcels=4, start='2024-01-01', end='2024-02-29', history_years=1,
+                     n_stations=n_stations)
+    soil = pd.read_csv(tmp_path / 'sols.csv')
+    missing = soil['parcelle_id'].iloc[-1]
+    soil.iloc[:-1].to_csv(tmp_path / 'sols.csv', index=False)
+
+    data_manager = AgriculturalDataManager(str(tmp_path), use_cache=False, station_join=station_join)
+    data_manager.load_data()
+    features = data_manager.prepare_features(daily_weather=daily_weather)
+
+    rows = features[features['parcelle_id'] == missing]
+    assert len(rows)
+    assert rows['temperature'].notna().all()
+    assignment = data_manager.get_station_assignment()
+    assert missing in set(assignment['parcelle_id'])